@@ -0,0 +1,62 @@
+"""
+batching.py
+
+This module defines the batch scheduling of the local `StanceDetector`: `token_budget_batches`
+groups prompts into batches and `contiguous_shards` splits them between worker processes.
+
+A batch of prompts is padded to its longest prompt, so batching tweets in arrival order wastes
+most of the compute on padding. Prompts are instead sorted by token length and grouped so that
+each batch, once padded, holds at most `max_tokens` tokens: short prompts go in large batches
+and long prompts in small ones. The batches hold indices into the input, so the caller can put
+the outputs back in the original order.
+
+Usage:
+    scores = [None] * len(prompts)
+    for batch in token_budget_batches([len(ids) for ids in token_ids], max_tokens=4096):
+        for index, score in zip(batch, run([prompts[index] for index in batch])):
+            scores[index] = score
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+
+def token_budget_batches(lengths: Sequence[int], max_tokens: int,
+                         max_batch_size: Optional[int] = None) -> List[List[int]]:
+    """
+    Groups the items by length into batches of at most `max_tokens` padded tokens.
+
+    Args:
+        lengths (Sequence[int]): Token length of each item.
+        max_tokens (int): Maximum of (batch size x longest item of the batch). An item longer
+            than the budget is batched alone.
+        max_batch_size (Optional[int]): Maximum number of items per batch (None for no limit).
+
+    Returns:
+        List[List[int]]: Indices of the items of each batch, shortest items first.
+    """
+    batches, batch = [], []
+    for index in sorted(range(len(lengths)), key=lambda index: lengths[index]):
+        # Items come in increasing length, so the new item is the longest of the batch.
+        full = max_batch_size is not None and len(batch) >= max_batch_size
+        if batch and (full or (len(batch) + 1) * lengths[index] > max_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def contiguous_shards(item_count: int, shard_count: int) -> List[Tuple[int, int]]:
+    """
+    Splits range(item_count) into `shard_count` contiguous (start, end) ranges whose sizes
+    differ by at most one (empty shards are dropped).
+    """
+    size, remainder = divmod(item_count, shard_count)
+    shards, start = [], 0
+    for shard in range(shard_count):
+        end = start + size + (shard < remainder)
+        if end > start:
+            shards.append((start, end))
+        start = end
+    return shards
@@ -0,0 +1,48 @@
+"""
+calibration.py
+
+This module defines the temperature scaling used by the scoring mode of `StanceDetector`.
+
+In scoring mode the stance is read from the logits of the candidate label tokens (e.g. '0' to
+'10' and '-1') after a single forward pass. The softmax of these logits is usually
+over-confident; dividing the logits by a temperature T > 1 fitted on labeled tweets (the one
+minimizing the negative log-likelihood) gives probabilities that match the observed accuracy,
+without changing the most likely label.
+
+Usage:
+    temperature = fit_temperature(logits, targets)
+    probabilities = softmax(logits, temperature)
+"""
+
+from typing import Sequence
+
+import numpy as np
+
+
+def softmax(logits: np.ndarray, temperature: float = 1.0) -> np.ndarray:
+    """
+    Row-wise softmax of `logits / temperature`.
+    """
+    scaled = np.asarray(logits, dtype=np.float64) / temperature
+    scaled = scaled - scaled.max(axis=1, keepdims=True)
+    exp_scaled = np.exp(scaled)
+    return exp_scaled / exp_scaled.sum(axis=1, keepdims=True)
+
+
+def negative_log_likelihood(logits: np.ndarray, targets: Sequence[int], temperature: float) -> float:
+    probabilities = softmax(logits, temperature)
+    return float(-np.log(probabilities[np.arange(len(targets)), targets] + 1e-12).mean())
+
+
+def fit_temperature(logits: np.ndarray, targets: Sequence[int],
+                    temperatures: np.ndarray = np.exp(np.linspace(np.log(0.05), np.log(20.0), 200))) -> float:
+    """
+    Temperature of `temperatures` with the lowest negative log-likelihood of the targets.
+
+    Args:
+        logits (np.ndarray): (items, labels) logits of the candidate labels.
+        targets (Sequence[int]): Index of the correct label of each item.
+    """
+    targets = np.asarray(targets)
+    losses = [negative_log_likelihood(logits, targets, temperature) for temperature in temperatures]
+    return float(temperatures[int(np.argmin(losses))])
@@ -0,0 +1,156 @@
+"""
+cassette.py
+
+This module contains a record-and-replay harness for the calls that `OpenAIStanceDetector`
+makes to the OpenAI Responses API, so the evaluation scripts can be benchmarked offline and
+deterministically.
+
+- `CassetteRecorder` wraps an `OpenAIClientPool` and appends every request/response pair to a
+  JSONL cassette (see `ResultLog`).
+- `CassettePlayer` serves the responses of a cassette instead of calling the API. It exposes the
+  same `create_response(**kwargs)` method as the pool, optionally sleeping to reproduce the
+  latency of the recorded calls.
+
+Record and replay runs write their results, result log, result store, work queue and dead-letter
+queue to their own files (see `run_filepath`): a replay then evaluates the same sample as the
+record run, instead of skipping the items recorded in the real outputs and sampling others, and
+never writes into the real outputs.
+
+Each cassette entry looks like:
+    {"key": "<sha256 of the request>", "request": {...}, "output_text": "neutral",
+     "usage": {"input_tokens": 812, "output_tokens": 1}, "latency_seconds": 0.41}
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import numpy as np
+
+sys.path.append('..')
+
+from src.result_log import ResultLog
+
+
+# Backends whose runs keep their own outputs.
+BENCHMARK_BACKENDS = ('record', 'replay')
+
+
+def run_filepath(filepath: str, backend: str) -> str:
+    """
+    Path of an output file (results, log, store, queue or dead-letter queue) for a run with the
+    given LLM backend: 'data/x.jsonl' becomes 'data/x.record.jsonl' for a record run and
+    'data/x.replay.jsonl' for a replay run, and is unchanged for the other backends.
+    """
+    if backend not in BENCHMARK_BACKENDS:
+        return filepath
+    root, ext = os.path.splitext(filepath)
+    return f'{root}.{backend}{ext}'
+
+
+class CassetteMissError(KeyError):
+    """
+    The cassette holds no response for the request being replayed.
+    """
+
+
+def request_key(**kwargs) -> str:
+    """
+    Identifies a request by the hash of its (canonically serialized) arguments.
+    """
+    return hashlib.sha256(json.dumps(kwargs, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class CassetteRecorder:
+    """
+    Calls the API through `pool` and records every request/response pair.
+    """
+
+    def __init__(self, pool, filepath: str):
+        self.pool = pool
+        self._log = ResultLog(filepath, fsync_every=200)
+        self._lock = threading.Lock()
+
+    def create_response(self, **kwargs):
+        start = time.monotonic()
+        response = self.pool.create_response(**kwargs)
+        latency = time.monotonic() - start
+        entry = {
+            'key': request_key(**kwargs),
+            'request': kwargs,
+            'output_text': response.output_text,
+            'usage': {
+                'input_tokens': response.usage.input_tokens,
+                'output_tokens': response.usage.output_tokens,
+            },
+            'latency_seconds': latency,
+        }
+        with self._lock:
+            self._log.append(entry)
+        return response
+
+    def close(self) -> None:
+        with self._lock:
+            self._log.close()
+
+
+class CassettePlayer:
+    """
+    Replays the responses recorded in a cassette.
+
+    When a request was recorded several times (e.g. a malformed output followed by a valid one
+    on retry), its responses are served in the recorded order, cycling once exhausted.
+
+    Attributes:
+        latency (str): 'none' to answer immediately, 'recorded' to sleep the latency recorded for
+            the response, or 'sampled' to sleep a latency drawn from all the recorded latencies.
+        latency_scale (float): Factor applied to the simulated latencies.
+    """
+    LATENCY_MODES = ('none', 'recorded', 'sampled')
+
+    def __init__(self, filepath: str, latency: str = 'none', latency_scale: float = 1.0, seed: Optional[int] = None):
+        assert latency in CassettePlayer.LATENCY_MODES, f'Unknown latency mode: {latency}'
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self._entries: Dict[str, List[dict]] = {}
+        with ResultLog(filepath) as log:
+            for entry in log:
+                self._entries.setdefault(entry['key'], []).append(entry)
+        self._latencies = np.array([entry['latency_seconds']
+                                    for entries in self._entries.values()
+                                    for entry in entries])
+        self._next = {key: 0 for key in self._entries}
+        self._rng = np.random.default_rng(seed=seed)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def _delay(self, entry: dict) -> float:
+        if self.latency == 'recorded':
+            return entry['latency_seconds'] * self.latency_scale
+        if self.latency == 'sampled' and len(self._latencies) > 0:
+            with self._lock:
+                return float(self._rng.choice(self._latencies)) * self.latency_scale
+        return 0.0
+
+    def create_response(self, **kwargs):
+        key = request_key(**kwargs)
+        if key not in self._entries:
+            raise CassetteMissError(f'No recorded response for request {key[:16]}.')
+        with self._lock:
+            entries = self._entries[key]
+            entry = entries[self._next[key] % len(entries)]
+            self._next[key] += 1
+        delay = self._delay(entry)
+        if delay > 0:
+            time.sleep(delay)
+        return SimpleNamespace(output_text=entry['output_text'], usage=SimpleNamespace(**entry['usage']))
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,175 @@
+"""
+client_pool.py
+
+This module defines the `OpenAIClientPool` class, which spreads the calls to the OpenAI
+Responses API across several API keys (e.g. the `personal_key` and the `project_key` known by
+`PathsHandler.get_api_key`).
+
+Each key has its own client, its own request budget (a token bucket refilled at
+`requests_per_minute`) and its own health state: a key that receives a 429 response is put
+in a cool-down that grows exponentially with consecutive rate-limit errors (or follows the
+`retry-after` header when the API sends one), while the remaining keys keep serving requests.
+The pool is thread-safe, so concurrent callers share the aggregate quota of all keys. The
+clients do not retry by themselves (`max_retries=0`), so every 429 reaches the pool and retries
+are left to the pool and to `core/retry.py`.
+"""
+
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+sys.path.append('..')
+
+from openai import OpenAI, RateLimitError
+from src import io
+from src.paths_handler import PathsHandler
+
+
+@dataclass
+class _KeyState:
+    """
+    Rate-limit and health state of a single API key.
+    """
+    name: str
+    client: OpenAI
+    requests_per_minute: float
+    tokens: float
+    last_refill: float
+    cooldown_until: float = 0.0
+    consecutive_rate_limits: int = 0
+    in_flight: int = 0
+    stats: Dict[str, int] = field(default_factory=lambda: {'requests': 0, 'rate_limited': 0, 'errors': 0})
+
+    def refill(self, now: float) -> None:
+        capacity = max(1.0, self.requests_per_minute / 60.0)
+        self.tokens = min(capacity, self.tokens + (now - self.last_refill) * self.requests_per_minute / 60.0)
+        self.last_refill = now
+
+    def available_at(self, now: float) -> float:
+        """
+        Earliest time at which the key can serve a request.
+        """
+        ready = max(now, self.cooldown_until)
+        if self.tokens < 1.0:
+            ready = max(ready, now + (1.0 - self.tokens) * 60.0 / self.requests_per_minute)
+        return ready
+
+
+class OpenAIClientPool:
+    """
+    Pool of OpenAI clients, one per API key, with per-key rate limiting and back-off.
+
+    Attributes:
+        BASE_COOLDOWN_SECONDS (float): Cool-down applied to a key after its first 429.
+        MAX_COOLDOWN_SECONDS (float): Upper bound of the exponential cool-down.
+    """
+    BASE_COOLDOWN_SECONDS = 2.0
+    MAX_COOLDOWN_SECONDS = 120.0
+
+    def __init__(self, key_names: List[str], requests_per_minute: float, base_url: Optional[str] = None,
+                 api_keys: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            key_names (List[str]): Keys to use, as accepted by `PathsHandler.get_api_key`.
+            requests_per_minute (float): Request budget of each key.
+            base_url (Optional[str]): Alternative API endpoint (None for the OpenAI API).
+            api_keys (Optional[Dict[str, str]]): Key values by key name, instead of reading them
+                with `PathsHandler.get_api_key` (e.g. dummy keys for a mock server).
+        """
+        assert len(key_names) > 0, 'At least one API key is required.'
+        if api_keys is None:
+            config = PathsHandler()
+            api_keys = {key_name: config.get_api_key(which=key_name) for key_name in key_names}
+        now = time.monotonic()
+        self._keys = [
+            _KeyState(name=key_name,
+                      client=OpenAI(api_key=api_keys[key_name], base_url=base_url, max_retries=0),
+                      requests_per_minute=requests_per_minute,
+                      tokens=1.0,
+                      last_refill=now)
+            for key_name in key_names
+        ]
+        self._condition = threading.Condition()
+
+    @property
+    def key_names(self) -> List[str]:
+        return [key.name for key in self._keys]
+
+    def _acquire(self) -> _KeyState:
+        """
+        Blocks until a healthy key with request budget is available and reserves it.
+        Among the available keys, the one with the fewest requests in flight is chosen.
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                for key in self._keys:
+                    key.refill(now)
+                available = [key for key in self._keys if key.available_at(now) <= now]
+                if available:
+                    key = min(available, key=lambda key: (key.in_flight, -key.tokens))
+                    key.tokens -= 1.0
+                    key.in_flight += 1
+                    key.stats['requests'] += 1
+                    return key
+                wait = min(key.available_at(now) for key in self._keys) - now
+                self._condition.wait(timeout=max(wait, 0.01))
+
+    def _release(self, key: _KeyState, rate_limited: bool = False, failed: bool = False,
+                 retry_after: Optional[float] = None) -> None:
+        with self._condition:
+            key.in_flight -= 1
+            if rate_limited:
+                key.stats['rate_limited'] += 1
+                key.consecutive_rate_limits += 1
+                cooldown = min(OpenAIClientPool.MAX_COOLDOWN_SECONDS,
+                               OpenAIClientPool.BASE_COOLDOWN_SECONDS * 2 ** (key.consecutive_rate_limits - 1))
+                if retry_after is not None:
+                    cooldown = max(cooldown, retry_after)
+                key.cooldown_until = time.monotonic() + cooldown
+                io.warning(f'Key {key.name} rate limited, cooling down for {cooldown:.1f}s.')
+            elif failed:
+                key.stats['errors'] += 1
+            else:
+                key.consecutive_rate_limits = 0
+            self._condition.notify_all()
+
+    @staticmethod
+    def _retry_after(error: RateLimitError) -> Optional[float]:
+        try:
+            return float(error.response.headers.get('retry-after'))
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    def create_response(self, **kwargs):
+        """
+        Calls `responses.create(**kwargs)` with the least loaded healthy key.
+
+        A 429 response puts the key in cool-down and the request is sent again with another
+        key. The error is raised only when every key was rate limited `len(keys)` times in a row
+        for this request.
+        """
+        max_attempts = len(self._keys) ** 2
+        for attempt in range(max_attempts):
+            key = self._acquire()
+            try:
+                response = key.client.responses.create(**kwargs)
+            except RateLimitError as error:
+                self._release(key, rate_limited=True, retry_after=OpenAIClientPool._retry_after(error))
+                if attempt == max_attempts - 1:
+                    raise
+                continue
+            except Exception:
+                self._release(key, failed=True)
+                raise
+            self._release(key)
+            return response
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the number of requests, rate-limited requests and errors of each key.
+        """
+        with self._condition:
+            return {key.name: dict(key.stats) for key in self._keys}
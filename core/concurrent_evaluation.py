@@ -0,0 +1,72 @@
+"""
+concurrent_evaluation.py
+
+This module defines `evaluate_concurrently`, which keeps a fixed number of `evaluate_user` calls
+of an `OpenAIStanceDetector` in flight in a thread pool: a new user is dispatched as soon as any
+call completes (instead of waiting for a whole batch), and results are yielded in completion
+order, so a slow user does not hold back the others.
+
+Usage:
+    for result in evaluate_concurrently(detector, author_ids, author2tweets, dead_letters, concurrency=8):
+        result_log.append(result)
+"""
+
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List
+
+sys.path.append('..')
+
+from core.retry import FATAL_ERRORS
+from core.usage_metrics import BudgetExceededError
+from src import io
+from src.dead_letter_queue import DeadLetterQueue
+from src.tweet import Tweet
+
+
+def evaluate_concurrently(detector, author_ids: Iterable[str], author2tweets: Dict[str, List[Tweet]],
+                          dead_letters: DeadLetterQueue, concurrency: int) -> Iterator[dict]:
+    """
+    Evaluates the users with at most `concurrency` calls in flight, and yields each result as
+    soon as it arrives (in completion order). Users that fail are recorded in the dead-letter
+    queue. When the budget is spent, no more users are dispatched and the calls in flight finish.
+
+    The detector is shared by the threads; the dead-letter queue (and whatever the caller does
+    with the results) is only written from the calling thread.
+
+    Args:
+        detector: Object with an `evaluate_user(tweets)` method (an `OpenAIStanceDetector`).
+        author_ids (Iterable[str]): Users to evaluate, dispatched in this order.
+    """
+    pending = iter(author_ids)
+    in_flight = {}
+    budget_exceeded = False
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        def dispatch_next() -> None:
+            author_id = next(pending, None)
+            if author_id is not None:
+                in_flight[executor.submit(detector.evaluate_user, author2tweets[author_id])] = author_id
+
+        for _ in range(concurrency):
+            dispatch_next()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                author_id = in_flight.pop(future)
+                result = None
+                try:
+                    result = future.result()
+                except BudgetExceededError as error:
+                    if not budget_exceeded:
+                        io.warning(f'{error} Stopping dispatch.')
+                    budget_exceeded = True
+                except FATAL_ERRORS:
+                    raise
+                except Exception as error:
+                    io.error(f'Evaluation of user {author_id} failed ({type(error).__name__}: {error}), added to the dead-letter queue.')
+                    dead_letters.add(author_id, error)
+                if not budget_exceeded:
+                    dispatch_next()
+                if result is not None:
+                    assert result['author_id'] == author_id
+                    yield result
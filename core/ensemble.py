@@ -0,0 +1,77 @@
+"""
+ensemble.py
+
+This module defines the early-exit majority vote used by the ensemble mode of
+`OpenAIStanceDetector`, and `EnsembleStats`, which counts the calls it makes.
+
+Models are queried one at a time, in the configured order (e.g. cheapest first). The vote stops
+as soon as a label has `agreement` votes, so when the first models agree the others are never
+called, or as soon as no label can reach `agreement` with the models left. Without agreement,
+the label with the most votes wins (ties go to the label voted first).
+
+Usage:
+    label, votes = early_exit_vote(['gpt-4.1-nano', 'gpt-4.1-mini', 'gpt-4.1'], ask, agreement=2)
+"""
+
+import threading
+from collections import Counter
+from typing import Callable, Dict, List, Sequence, Tuple
+
+
+def early_exit_vote(models: Sequence[str], ask: Callable[[str], str], agreement: int) -> Tuple[str, Dict[str, str]]:
+    """
+    Majority vote of the models, stopping as soon as the outcome is decided.
+
+    Args:
+        ask (Callable[[str], str]): Label given by a model.
+        agreement (int): Votes that decide a label.
+
+    Returns:
+        Tuple[str, Dict[str, str]]: The winning label and the label of each model queried.
+    """
+    assert 1 <= agreement <= len(models), 'The agreement must be between 1 and the number of models.'
+    assert len(set(models)) == len(models), 'Each model can only vote once.'
+    votes, counts = {}, Counter()
+    for k, model in enumerate(models):
+        label = ask(model)
+        votes[model] = label
+        counts[label] += 1
+        if counts[label] >= agreement:
+            break
+        if max(counts.values()) + len(models) - k - 1 < agreement:
+            break
+    best = max(counts.values())
+    return next(label for label in votes.values() if counts[label] == best), votes
+
+
+class EnsembleStats:
+    """
+    Thread-safe counts of the ensemble votes: calls per item and how often the models agreed.
+    """
+
+    def __init__(self, agreement: int):
+        self.agreement = agreement
+        self._lock = threading.Lock()
+        self._calls: List[int] = []
+        self._decided = 0
+
+    def record(self, votes: Dict[str, str]) -> None:
+        decided = max(Counter(votes.values()).values()) >= self.agreement
+        with self._lock:
+            self._calls.append(len(votes))
+            self._decided += decided
+
+    def summary(self) -> dict:
+        with self._lock:
+            items = len(self._calls)
+            return {
+                'items': items,
+                'mean_calls_per_item': sum(self._calls) / items if items else 0.0,
+                'calls_histogram': dict(sorted(Counter(self._calls).items())),
+                'agreement_rate': self._decided / items if items else 0.0,
+            }
+
+    def format_summary(self) -> List[str]:
+        summary = self.summary()
+        return [f'Ensemble: {summary["items"]:,} tweets, {summary["mean_calls_per_item"]:.2f} calls per tweet '
+                f'(histogram {summary["calls_histogram"]}), {summary["agreement_rate"]:.1%} reached the agreement.']
@@ -1,17 +1,28 @@
 # from enum import Enum
 import json5
+import multiprocessing
+import os
 import sys
 import numpy as np
 sys.path.append('..')
 
 from src.paths_handler import PathsHandler
 import torch
-from transformers import pipeline, AutoTokenizer
+from transformers import pipeline, AutoTokenizer, DynamicCache
 from src import io
+from src.result_log import ResultLog
 
-from typing import List
+from typing import List, Optional, Union
 from src.tweet import Tweet
-from openai import OpenAI
+from core.batching import contiguous_shards, token_budget_batches
+from core.calibration import fit_temperature, softmax
+from core.cassette import CassettePlayer, CassetteRecorder
+from core.client_pool import OpenAIClientPool
+from core.ensemble import EnsembleStats, early_exit_vote
+from core.prompt_registry import PromptRegistry
+from core.timeline_selector import TimelineSelector
+from core.usage_metrics import UsageMetrics
+from core.retry import CircuitBreaker, LLMResponseError, RetryPolicy
 
 
 # class TweetPoliticalAlignment(Enum):
@@ -21,10 +32,36 @@ from openai import OpenAI
 
 class StanceDetector:
 
-    def __init__(self):
+    def __init__(self, device: Optional[str] = None, torch_threads: Optional[int] = None,
+                 quantization: Optional[str] = None):
+        """
+        Args:
+            device (Optional[str]): 'auto', 'cpu', 'mps' or 'cuda', overrides the `device` of the
+                configuration (None to use the configured value).
+            torch_threads (Optional[int]): Intra-op threads of torch, overrides the
+                `torch-threads` of the configuration (None to use the configured value).
+            quantization (Optional[str]): 'none' or 'dynamic-int8', overrides the `quantization`
+                of the configuration (None to use the configured value).
+        """
         config = PathsHandler()
         stance_detector_config = config.get_variable('stance-detector-configuration')
         model_name = stance_detector_config['model-name']
+
+        self.device = StanceDetector.resolve_device(device or stance_detector_config['device'])
+        self.quantization = quantization or stance_detector_config['quantization']
+        if self.quantization not in ('none', 'dynamic-int8'):
+            raise ValueError(f'Unknown quantization: {self.quantization}')
+        if self.quantization == 'dynamic-int8' and self.device != 'cpu':
+            raise ValueError('dynamic-int8 quantization only runs on the cpu device.')
+        # Dynamic quantization converts float32 linear layers.
+        self.torch_dtype = (torch.float32 if self.quantization == 'dynamic-int8' else
+                            StanceDetector.resolve_dtype(stance_detector_config['torch-dtype'], self.device))
+        if torch_threads is None:
+            torch_threads = stance_detector_config['torch-threads']
+        if torch_threads is not None:
+            torch.set_num_threads(torch_threads)
+        io.info(f'Using device= {self.device}, dtype= {self.torch_dtype}, torch threads= {torch.get_num_threads()}')
+
         self.tokenizer = AutoTokenizer.from_pretrained(model_name, padding_side="left")
         if self.tokenizer.pad_token_id is None:
             self.tokenizer.pad_token_id = self.tokenizer.eos_token_id
@@ -34,16 +71,142 @@ class StanceDetector:
               model=model_name,
               tokenizer=self.tokenizer,
               pad_token_id= self.tokenizer.pad_token_id or self.tokenizer.eos_token_id,
-              torch_dtype=torch.bfloat16,
-              device_map="mps",
+              torch_dtype=self.torch_dtype,
+              device_map=self.device,
               )
+        if self.quantization == 'dynamic-int8':
+            # Weights of the linear layers stored in int8, activations quantized on the fly.
+            self.pipe.model = torch.ao.quantization.quantize_dynamic(self.pipe.model, {torch.nn.Linear}, dtype=torch.qint8)
+            io.info('Using dynamic int8 quantization of the linear layers.')
         
         self.system_messages = {
               "role": "system", 
               "content": stance_detector_config['system-prompt']
               }
 
-    def evaluate_batch(self, tweets: list[str]) -> list[int]:
+        # Prompts are batched by token length: each batch holds at most `batch-max-tokens`
+        # tokens once padded to its longest prompt (see core/batching.py).
+        self.batch_max_tokens = stance_detector_config['batch-max-tokens']
+        self.batch_max_size = stance_detector_config['batch-max-size']
+
+        # In 'score' mode the stance is read from the logits of the first token of each label
+        # after one forward pass, instead of generating and parsing up to 3 tokens.
+        self.decoding = stance_detector_config['decoding']
+        self.score_labels, self.label_scores = StanceDetector.resolve_score_labels(stance_detector_config['score-labels'])
+        self.score_temperature = stance_detector_config['score-temperature']
+        self.score_token_ids = [self.tokenizer.encode(label, add_special_tokens=False)[0] for label in self.score_labels]
+        if self.decoding == 'score' and len(set(self.score_token_ids)) != len(self.score_token_ids):
+            raise ValueError(f'The score labels {self.score_labels} do not start with distinct tokens.')
+
+        # With `prefix-cache`, the keys and values of the tokens shared by every prompt (the
+        # system prompt and chat template up to the tweet) are computed once, and each scoring
+        # pass only runs the tweet tokens. Generation ('generate' decoding) does not use them.
+        self._prefix_ids, self._prefix_past = None, None
+        if stance_detector_config['prefix-cache']:
+            if self.decoding == 'score':
+                self._build_prefix_cache()
+            else:
+                io.warning('prefix-cache is only used with score decoding, ignoring it.')
+
+    @staticmethod
+    def resolve_device(device: str) -> str:
+        """
+        Maps 'auto' to the best available device (cuda, then mps, then cpu).
+        """
+        if device != 'auto':
+            return device
+        if torch.cuda.is_available():
+            return 'cuda'
+        if torch.backends.mps.is_available():
+            return 'mps'
+        return 'cpu'
+
+    @staticmethod
+    def cpu_supports_bfloat16() -> bool:
+        """
+        Whether the CPU has native bfloat16 instructions (AVX-512 BF16 or AMX), without which
+        bfloat16 matrix products are emulated and slower than float32.
+        """
+        try:
+            with open('/proc/cpuinfo') as reader:
+                flags = reader.read()
+        except OSError:
+            return False
+        return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+    @staticmethod
+    def resolve_dtype(torch_dtype: str, device: str) -> torch.dtype:
+        """
+        Maps 'auto' to bfloat16 on accelerators and on CPUs with bfloat16 support, float32 otherwise.
+        """
+        if torch_dtype == 'auto':
+            if device != 'cpu' or StanceDetector.cpu_supports_bfloat16():
+                return torch.bfloat16
+            return torch.float32
+        return getattr(torch, torch_dtype)
+
+    @staticmethod
+    def resolve_score_labels(score_labels: Union[list, dict]) -> tuple[list[str], list[Union[int, str]]]:
+        """
+        Splits the configured `score-labels` in the labels scored and the score returned for each.
+
+        `score-labels` is either a list of labels or a mapping from each label to its score (e.g.
+        {left: -1, neutral: 0, right: 1}). The labels of a list are their own score: an integer
+        for numeric labels (e.g. '7'), the label itself otherwise (e.g. 'left').
+        """
+        if isinstance(score_labels, dict):
+            return [str(label) for label in score_labels], list(score_labels.values())
+        labels = [str(label) for label in score_labels]
+        return labels, [int(label) if label.lstrip('-').isdigit() else label for label in labels]
+
+    @staticmethod
+    def evaluate_parallel(tweets: list[str], processes: int) -> list[int]:
+        """
+        Evaluates the tweets with `processes` CPU worker processes, each loading its own model
+        and using an equal share of the cores. The tweets are split in contiguous shards, so the
+        scores are in the order of `tweets`.
+        """
+        if processes <= 1:
+            return StanceDetector().evaluate_batch(tweets)
+        threads = max(1, (os.cpu_count() or processes) // processes)
+        shards = [tweets[start:end] for start, end in contiguous_shards(len(tweets), processes)]
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(processes=processes, initializer=_init_parallel_worker, initargs=(threads,)) as pool:
+            return [score for shard_scores in pool.map(_evaluate_shard, shards) for score in shard_scores]
+
+    def prompt_ids(self, messages: list[dict]) -> list[int]:
+        """
+        Tokens of a chat prompt, generation prompt included.
+        """
+        return self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=True)
+
+    def prompt_length(self, messages: list[dict]) -> int:
+        return len(self.prompt_ids(messages))
+
+    @torch.inference_mode()
+    def _build_prefix_cache(self) -> None:
+        """
+        Computes the keys and values of the longest token prefix shared by all the prompts.
+        """
+        first, second = (self.prompt_ids(messages) for messages in self._full_inputs(['a', 'b']))
+        length = next((k for k, (x, y) in enumerate(zip(first, second)) if x != y), min(len(first), len(second)))
+        self._prefix_ids = first[:length]
+        model = self.pipe.model
+        output = model(input_ids=torch.tensor([self._prefix_ids], device=model.device), use_cache=True)
+        past = output.past_key_values
+        self._prefix_past = past.to_legacy_cache() if hasattr(past, 'to_legacy_cache') else past
+        io.info(f'Cached the keys and values of the {length} prompt tokens shared by every tweet.')
+
+    @staticmethod
+    def parse_score(output_text: str) -> int:
+        try:
+            score = int(output_text)
+            assert 0 <= score <= 10 or score == -1
+        except Exception:
+            score = -1  # Fallback for malformed outputs
+        return score
+
+    def _full_inputs(self, tweets: list[str]) -> list[list[dict]]:
         prompts = [
             {
                 "role": "user",
@@ -53,32 +216,136 @@ class StanceDetector:
         ]
         
         # Repeat the system message for each input
-        full_inputs = [[self.system_messages, prompt] for prompt in prompts]
+        return [[self.system_messages, prompt] for prompt in prompts]
+
+    def _batches(self, full_inputs: list[list[dict]]) -> list[list[int]]:
+        lengths = [self.prompt_length(messages) for messages in full_inputs]
+        return token_budget_batches(lengths, self.batch_max_tokens, self.batch_max_size)
+
+    @torch.inference_mode()
+    def _label_logits(self, full_inputs: list[list[dict]]) -> np.ndarray:
+        """
+        Logits of the first token of each score label, at the first generated position.
+        """
+        encoded = self.tokenizer.apply_chat_template(full_inputs, add_generation_prompt=True, padding=True,
+                                                     return_tensors='pt', return_dict=True)
+        encoded = {name: tensor.to(self.pipe.model.device) for name, tensor in encoded.items()}
+        # Prompts are left-padded: positions start at the first real token.
+        position_ids = (encoded['attention_mask'].cumsum(dim=-1) - 1).clamp(min=0)
+        logits = self.pipe.model(**encoded, position_ids=position_ids).logits[:, -1, :]
+        return logits[:, self.score_token_ids].float().cpu().numpy()
+
+    @torch.inference_mode()
+    def _label_logits_from_prefix(self, full_inputs: list[list[dict]]) -> np.ndarray:
+        """
+        Same as `_label_logits`, running only the tokens after the cached prefix.
+        """
+        prefix_length = len(self._prefix_ids)
+        suffixes = []
+        for messages in full_inputs:
+            ids = self.prompt_ids(messages)
+            if ids[:prefix_length] != self._prefix_ids:
+                return self._label_logits(full_inputs)
+            suffixes.append(ids[prefix_length:])
+
+        model = self.pipe.model
+        longest = max(len(suffix) for suffix in suffixes)
+        input_ids = torch.tensor([[self.tokenizer.pad_token_id] * (longest - len(suffix)) + suffix for suffix in suffixes],
+                                 device=model.device)
+        suffix_mask = torch.tensor([[0] * (longest - len(suffix)) + [1] * len(suffix) for suffix in suffixes],
+                                   device=model.device)
+        attention_mask = torch.cat([torch.ones((len(suffixes), prefix_length), dtype=suffix_mask.dtype, device=model.device),
+                                    suffix_mask], dim=1)
+        # The padding sits between the prefix and the tweet: positions skip it.
+        position_ids = (attention_mask.cumsum(dim=-1) - 1)[:, prefix_length:].clamp(min=0)
+        past_key_values = DynamicCache.from_legacy_cache(tuple(
+            (keys.expand(len(suffixes), -1, -1, -1).contiguous(), values.expand(len(suffixes), -1, -1, -1).contiguous())
+            for keys, values in self._prefix_past
+        ))
+        logits = model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                       past_key_values=past_key_values, use_cache=True).logits[:, -1, :]
+        return logits[:, self.score_token_ids].float().cpu().numpy()
+
+    def label_logits(self, tweets: list[str]) -> np.ndarray:
+        """
+        (tweets, score labels) logits of the candidate labels, one forward pass per batch.
+        """
+        full_inputs = self._full_inputs(tweets)
+        logits = np.zeros((len(full_inputs), len(self.score_labels)), dtype=np.float32)
+        batch_logits = self._label_logits if self._prefix_past is None else self._label_logits_from_prefix
+        for batch in self._batches(full_inputs):
+            logits[batch] = batch_logits([full_inputs[index] for index in batch])
+        return logits
+
+    def score_batch(self, tweets: list[str]) -> tuple[list[Union[int, str]], np.ndarray]:
+        """
+        Most likely score of each tweet (see `resolve_score_labels`) and the calibrated
+        probabilities of every score label (columns in the order of `score_labels`).
+        """
+        probabilities = softmax(self.label_logits(tweets), self.score_temperature)
+        scores = [self.label_scores[k] for k in probabilities.argmax(axis=1)]
+        return scores, probabilities
+
+    def calibrate(self, tweets: list[str], scores: list[Union[int, str]]) -> float:
+        """
+        Fits (and uses) the temperature of the score probabilities on tweets with known scores.
+        """
+        targets = [self.label_scores.index(score) for score in scores]
+        self.score_temperature = fit_temperature(self.label_logits(tweets), targets)
+        io.info(f'Calibrated score temperature= {self.score_temperature:.3f}')
+        return self.score_temperature
+
+    def evaluate_batch(self, tweets: list[str]) -> list[Union[int, str]]:
+        if self.decoding == 'score':
+            return self.score_batch(tweets)[0]
+
+        full_inputs = self._full_inputs(tweets)
+        scores = [-1] * len(full_inputs)
+        for batch in self._batches(full_inputs):
+            outputs = self.pipe(
+                [full_inputs[index] for index in batch],
+                max_new_tokens=3,
+                batch_size=len(batch),
+            )
+            for index, out in zip(batch, outputs):
+                scores[index] = StanceDetector.parse_score(out["generated_text"][-1]['content'])
 
-        outputs = self.pipe(
-            full_inputs,
-            max_new_tokens=3,
-            batch_size=8,  # Adjust based on your hardware
-        )
+        return scores
 
-        scores = []
-        for out in outputs:
-            try:
-                score = int(out["generated_text"][-1]['content'])  # Ensure correct access pattern
-                assert 0 <= score <= 10 or score == -1
-            except Exception:
-                score = -1  # Fallback for malformed outputs
-            scores.append(score)
 
-        return scores
 
 
+# Detector of each worker process of StanceDetector.evaluate_parallel.
+_parallel_detector: Optional[StanceDetector] = None
+
+
+def _init_parallel_worker(torch_threads: int) -> None:
+    global _parallel_detector
+    _parallel_detector = StanceDetector(device='cpu', torch_threads=torch_threads)
+
+
+def _evaluate_shard(tweets: list[str]) -> list[int]:
+    return _parallel_detector.evaluate_batch(tweets)
 
 
 class OpenAIStanceDetector:
-    def __init__(self):
+    def __init__(self, budget_usd: Optional[float] = None, backend: Optional[str] = None, worker: Optional[int] = None):
+        """
+        Args:
+            budget_usd (Optional[float]): Maximum spend of the run, overrides the `budget-usd`
+                of the configuration (None to use the configured value).
+            backend (Optional[str]): 'openai', 'record', 'replay' or 'mock', overrides the
+                `llm-backend` of the configuration (None to use the configured value).
+            worker (Optional[int]): Index of the worker process using the detector. The usage log
+                and the recorded cassette of a worker are written to their own shard (see
+                `ResultLog.shard_filepath`), merged by the parent process.
+        """
         self.config = PathsHandler()
 
+        def log_path(path_key: str) -> str:
+            filepath = self.config.get_path(path_key)
+            return filepath if worker is None else ResultLog.shard_filepath(filepath, worker)
+
 
         self.stance_detector_config = self.config.get_variable('openai-tweet-stance-detector-configuration')
         io.info(f'Using detector configuration={self.stance_detector_config}')
@@ -86,20 +353,127 @@ class OpenAIStanceDetector:
         # Retrieving vars from config:
         SEED = self.stance_detector_config['seed']
         self.max_tweet_count = self.stance_detector_config['user-timeline-max-tweet-count']
-        which_key = self.stance_detector_config['openai-key']
+        which_keys = self.stance_detector_config['openai-keys']
+        requests_per_minute = self.stance_detector_config['requests-per-minute-per-key']
 
         io.info(f'Using seed={SEED}')
         io.info(f'Using max tweet count= {self.max_tweet_count}')
-        io.info(f'Using key= {which_key}')
-
+        io.info(f'Using keys= {which_keys} ({requests_per_minute} requests per minute each)')
+
+        # Prompts are read once and kept in memory (reloaded by a watcher thread when their file
+        # changes), so evaluations do no file I/O and the developer message stays byte-identical.
+        self.prompts = PromptRegistry(
+            self.config.get_path('prompts-folder'),
+            watch_seconds=self.stance_detector_config['prompt-watch-seconds'],
+            on_change=lambda template: io.info(f'Prompt {template.name} changed, now using version {template.version}.'),
+        )
 
-        self.rng = np.random.default_rng(seed=SEED)
+        # The tweets of a user are chosen within a token budget for the whole input (developer
+        # prompt included), skipping empty and duplicate tweets and spreading them over time.
+        self.max_user_input_tokens = self.stance_detector_config['user-timeline-max-input-tokens']
+        self.timeline_selector = TimelineSelector(
+            max_tweet_count=self.max_tweet_count,
+            max_tokens=self.max_user_input_tokens,
+            encoding_name=self.stance_detector_config['tokenizer-encoding'],
+        )
+        io.info(f'Using max user input tokens= {self.max_user_input_tokens} '
+                f'({"exact" if self.timeline_selector.exact else "estimated, tiktoken is not installed"})')
+
+        # Requests are spread across all configured keys (each with its own rate limit). The
+        # calls can also be recorded to (or replayed from) a cassette, for offline benchmarks, or
+        # sent to a local mock server (see core/mock_openai_server.py), for load tests.
+        if backend is None:
+            backend = self.stance_detector_config['llm-backend']
+        io.info(f'Using LLM backend= {backend}')
+        if backend == 'replay':
+            self.client_pool = CassettePlayer(
+                self.config.get_path('llm-cassette'),
+                latency=self.stance_detector_config['replay-latency'],
+                latency_scale=self.stance_detector_config['replay-latency-scale'],
+                seed=SEED,
+            )
+        elif backend == 'mock':
+            self.client_pool = OpenAIClientPool(key_names=which_keys,
+                                                requests_per_minute=requests_per_minute,
+                                                base_url=self.stance_detector_config['mock-server-url'],
+                                                api_keys={key_name: 'mock' for key_name in which_keys})
+        elif backend in ('openai', 'record'):
+            self.client_pool = OpenAIClientPool(key_names=which_keys, requests_per_minute=requests_per_minute)
+            if backend == 'record':
+                self.client_pool = CassetteRecorder(self.client_pool, log_path('llm-cassette'))
+        else:
+            raise ValueError(f'Unknown LLM backend: {backend}')
+
+        # Transient errors and malformed outputs are retried with backoff; dispatch pauses when
+        # the error rate spikes.
+        self.retry_policy = RetryPolicy(
+            max_attempts=self.stance_detector_config['retry-max-attempts'],
+            base_delay=self.stance_detector_config['retry-base-delay-seconds'],
+            max_delay=self.stance_detector_config['retry-max-delay-seconds'],
+            max_parse_attempts=self.stance_detector_config['retry-max-parse-attempts'],
+            circuit_breaker=CircuitBreaker(
+                window_size=self.stance_detector_config['circuit-breaker-window'],
+                error_rate_threshold=self.stance_detector_config['circuit-breaker-error-rate'],
+                cooldown_seconds=self.stance_detector_config['circuit-breaker-cooldown-seconds'],
+            ),
+            seed=SEED,
+        )
 
-        self.client = OpenAI(api_key= self.config.get_api_key(which=which_key))
+        # Token usage, cost, latency and retries of every call (one JSONL line per call, only
+        # for the calls that reach the OpenAI API).
+        if budget_usd is None:
+            budget_usd = self.stance_detector_config['budget-usd']
+        io.info(f'Using budget= {"unlimited" if budget_usd is None else f"${budget_usd:.2f}"}')
+        self.metrics = UsageMetrics(
+            prices=self.stance_detector_config['price-per-million-tokens'],
+            budget_usd=budget_usd,
+            sink_filepath=log_path('llm-usage-log') if backend in ('openai', 'record') else None,
+        )
+        self.metrics.require_price(self.stance_detector_config['model-name'])
+
+        # In ensemble mode each tweet is sent to the ensemble models in order until
+        # `ensemble-agreement` of them give the same label.
+        self.ensemble_models = self.stance_detector_config['ensemble-models']
+        self.ensemble_stats = None
+        if self.ensemble_models:
+            # Votes are kept by model, so a repeated model would silently lose its votes.
+            duplicates = sorted({model for model in self.ensemble_models if self.ensemble_models.count(model) > 1})
+            if duplicates:
+                raise ValueError(f'Repeated models in ensemble-models: {duplicates}.')
+            self.ensemble_stats = EnsembleStats(agreement=self.stance_detector_config['ensemble-agreement'])
+            for model in self.ensemble_models:
+                self.metrics.require_price(model)
+            io.info(f'Using ensemble= {self.ensemble_models} (agreement of {self.ensemble_stats.agreement})')
+
+    def log_usage_summary(self) -> None:
+        """
+        Logs the tokens, cost, throughput and latency of the calls made so far, then closes the
+        detector.
+        """
+        for line in self.metrics.format_summary():
+            io.info(line)
+        if self.ensemble_stats is not None:
+            for line in self.ensemble_stats.format_summary():
+                io.info(line)
+        self.close()
+
+    def close(self) -> None:
+        """
+        Flushes and closes the usage log and the cassette being recorded (if any), and stops
+        watching the prompts.
+        """
+        self.prompts.close()
+        self.metrics.close()
+        if hasattr(self.client_pool, 'close'):
+            self.client_pool.close()
 
     @staticmethod
     def format_evaluate_tweet_prompt(tweet:Tweet) -> str:
-        return f"<user_query>\nTweet: {tweet.sanitized_text}\n</user_query>\n"
+        return OpenAIStanceDetector.format_evaluate_tweet_text_prompt(tweet.sanitized_text)
+
+    @staticmethod
+    def format_evaluate_tweet_text_prompt(sanitized_text: str) -> str:
+        return f"<user_query>\nTweet: {sanitized_text}\n</user_query>\n"
 
     @staticmethod
     def format_evaluate_user_prompt(tweets: List[Tweet]) -> str:
@@ -107,19 +481,75 @@ class OpenAIStanceDetector:
         return f"<user_query>\n{'\n'.join(formated_tweet_list)}\n</user_query>"
 
 
+    def _create_response(self, developer_content: str, user_content: str, model: Optional[str] = None):
+        model = model or self.stance_detector_config['model-name']
+        # The prompt is only tokenized when a budget has to be enforced.
+        input_tokens = (self.timeline_selector.count_tokens(developer_content) +
+                        self.timeline_selector.count_tokens(user_content)) if self.metrics.budget_usd is not None else 0
+        with self.metrics.reserve(model, input_tokens):
+            self.metrics.add_attempt()
+            response = self.client_pool.create_response(
+                model=model,
+                input=[
+                    {
+                        "role": "developer",
+                        "content": developer_content
+                    },
+                    {
+                        "role": "user",
+                        "content": user_content
+                    }
+                ],
+                temperature=0
+            )
+            self.metrics.add_response(model, response.usage)
+        return response
+
+    @staticmethod
+    def normalize_tweet_response(output_text: str) -> str:
+        """
+        Maps the output of the tweet prompt to 'right', 'left' or 'neutral'.
+
+        Raises:
+            LLMResponseError: If the output contains none of the labels.
+        """
+        llm_response = output_text.replace('Assistant Response: ', '')
+
+        if 'right' in llm_response.lower():
+            return 'right'
+        elif 'left' in llm_response.lower():
+            return 'left'
+        elif 'neutral' in llm_response.lower():
+            return 'neutral'
+        else:
+            raise LLMResponseError('Got wrong response from LLM. Problem with prompt?')
+
+    def _request_tweet_stance(self, developer_content: str, user_content: str, model: Optional[str] = None) -> str:
+        llm_response = self._create_response(developer_content, user_content, model)
+        return OpenAIStanceDetector.normalize_tweet_response(llm_response.output_text)
+
+    def _request_user_stance(self, developer_content: str, user_content: str) -> dict:
+        llm_response = self._create_response(developer_content, user_content)
+        try:
+            return json5.loads(llm_response.output_text)
+        except ValueError as error:
+            raise LLMResponseError(f'Got wrong response from LLM, invalid JSON: {error}') from error
+
     def evaluate_user(self, tweets: List[Tweet]) -> str:
         assert len(tweets)>0, 'Trying to evaluate a user with no tweets.'
         assert len({tweet.author_id for tweet in tweets})==1, 'Trying to evaluate tweets of multiple users at the same time.'
 
-        # io.info(f'Randomly choosing {self.max_tweet_count} tweets out of {len(tweets)}')
-        selected_tweets = self.rng.choice(
-            a=tweets,
-            size=self.max_tweet_count,
-            replace=False
-        )
-
         # Setting up system prompt
-        developer_content = self.config.get_prompt(self.stance_detector_config['user-eval-developer-prompt-name'])
+        template = self.prompts.get(self.stance_detector_config['user-eval-developer-prompt-name'])
+        developer_content = template.content
+
+        selected_tweets = self.timeline_selector.select(
+            tweets,
+            OpenAIStanceDetector.format_evaluate_user_prompt,
+            max_tokens=self.max_user_input_tokens - self.timeline_selector.count_tokens(developer_content),
+        )
+        if not selected_tweets:
+            raise ValueError(f'No tweet of user {tweets[0].author_id} fits the input token budget.')
 
         # Formatting up user input
         user_content = OpenAIStanceDetector.format_evaluate_user_prompt(selected_tweets)
@@ -128,38 +558,31 @@ class OpenAIStanceDetector:
         # for line in user_content.splitlines():
         #     io.info(line)
 
-        assert len(developer_content) + len(user_content) < 5000 + self.max_tweet_count*500, 'Call to API with suspiciously big payload.'
-
-        llm_response = self.client.responses.create(
-            model=self.stance_detector_config['model-name'],
-            input=[
-                {
-                    "role": "developer",
-                    "content": developer_content
-                },
-                {
-                    "role": "user",
-                    "content": user_content
-                }
-            ],
-            temperature=0
-        )
-
-        
+        with self.metrics.track_call('user', tweets[0].author_id):
+            llm_response = self.retry_policy.call(self._request_user_stance, developer_content, user_content)
 
         full_response = {
-            'llm_response': json5.loads(llm_response.output_text),
+            'llm_response': llm_response,
             'author_id': tweets[0].author_id,
             'formatted_user_input': user_content,
-            'tweet_ids': [tweet.id for tweet in selected_tweets]
+            'tweet_ids': [tweet.id for tweet in selected_tweets],
+            'model': self.stance_detector_config['model-name'],
+            'prompt_version': template.version,
         }        
 
         return full_response
 
 
-    def evaluate_tweet(self, tweet: Tweet) -> dict:
-        developer_content = self.config.get_prompt(self.stance_detector_config['tweet-eval-developer-prompt-name'])
-        user_content = OpenAIStanceDetector.format_evaluate_tweet_prompt(tweet)
+    def evaluate_tweet(self, tweet: Tweet, user_content: Optional[str] = None) -> dict:
+        """
+        Args:
+            user_content (Optional[str]): The tweet prompt, if already formatted (e.g. by an
+                earlier stage of src/pipeline.py).
+        """
+        template = self.prompts.get(self.stance_detector_config['tweet-eval-developer-prompt-name'])
+        developer_content = template.content
+        if user_content is None:
+            user_content = OpenAIStanceDetector.format_evaluate_tweet_prompt(tweet)
         assert len(developer_content) + len(user_content) < 5000 + 280
 
 
@@ -167,41 +590,35 @@ class OpenAIStanceDetector:
         # for line in user_content.splitlines():
         #     io.info(line)
 
-        llm_response = self.client.responses.create(
-            model=self.stance_detector_config['model-name'],
-            input=[
-                {
-                    "role": "developer",
-                    "content": developer_content
-                },
-                {
-                    "role": "user",
-                    "content": user_content
-                }
-            ],
-            temperature=0 
-        )
-
-        # io.info(f'Response:             {llm_response}')
-        # io.info(f'Response.output_text: {llm_response.output_text}')
+        if self.ensemble_models:
+            return self._evaluate_tweet_ensemble(tweet, developer_content, user_content, template.version)
 
-        llm_response = llm_response.output_text.replace('Assistant Response: ', '')
-
-        
-        if 'right' in llm_response.lower():
-            normalized_llm_response = 'right'
-        elif 'left' in llm_response.lower():
-            normalized_llm_response = 'left'
-        elif 'neutral' in llm_response.lower():
-            normalized_llm_response = 'neutral'
-        else:
-            raise ValueError('Got wrong response from LLM. Problem with prompt?')
+        with self.metrics.track_call('tweet', tweet.id):
+            normalized_llm_response = self.retry_policy.call(self._request_tweet_stance, developer_content, user_content)
 
         full_response = {
             'llm_response': normalized_llm_response,
             'tweet_id': tweet.id,
             'author_id': tweet.author_id,
+            'model': self.stance_detector_config['model-name'],
+            'prompt_version': template.version,
         }
 
 
-        return full_response
\ No newline at end of file
+        return full_response
+
+    def _evaluate_tweet_ensemble(self, tweet: Tweet, developer_content: str, user_content: str, prompt_version: str) -> dict:
+        def ask(model: str) -> str:
+            with self.metrics.track_call('tweet', tweet.id):
+                return self.retry_policy.call(self._request_tweet_stance, developer_content, user_content, model)
+
+        label, votes = early_exit_vote(self.ensemble_models, ask, self.ensemble_stats.agreement)
+        self.ensemble_stats.record(votes)
+        return {
+            'llm_response': label,
+            'tweet_id': tweet.id,
+            'author_id': tweet.author_id,
+            'model': '+'.join(votes),
+            'ensemble_votes': votes,
+            'prompt_version': prompt_version,
+        }
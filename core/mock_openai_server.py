@@ -0,0 +1,225 @@
+"""
+mock_openai_server.py
+
+This module defines the `MockOpenAIServer` class, a local HTTP stand-in for the part of the
+OpenAI Responses API used by `OpenAIStanceDetector` (`POST /v1/responses`). It is meant for
+load tests of the detector: tuning concurrency, rate limiting and retries without spending
+tokens.
+
+The server can be configured with:
+    - a log-normal latency (median `latency_seconds`, spread `latency_sigma`),
+    - a server-side rate limit (`rate_limit_rpm`), answered with 429 and a `retry-after` header,
+    - a rate of 500 errors (`error_rate`) and of outputs the detector cannot parse (`malformed_rate`).
+
+Labels are deterministic: the answer to a prompt only depends on the hash of its user content,
+a tweet stance ('left', 'neutral' or 'right') for tweet prompts and a JSON score for user
+prompts.
+
+Usage:
+    with MockOpenAIServer(port=8089, latency_seconds=0.3, rate_limit_rpm=600) as server:
+        client = OpenAI(api_key='mock', base_url=server.url)
+"""
+
+import hashlib
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Routes the HTTP requests to the `MockOpenAIServer` attached to the HTTP server.
+    """
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v1/responses':
+            self._send(404, {}, MockOpenAIServer.error_body('Not found.', 'invalid_request_error'))
+            return
+        length = int(self.headers.get('content-length', 0))
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._send(400, {}, MockOpenAIServer.error_body('Invalid JSON body.', 'invalid_request_error'))
+            return
+        status, headers, payload = self.server.mock.respond(body)
+        self._send(status, headers, payload)
+
+    def _send(self, status: int, headers: Dict[str, str], payload: dict) -> None:
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Requests are counted in `MockOpenAIServer.stats` instead of printed.
+        pass
+
+
+class MockOpenAIServer:
+    """
+    Local mock of the OpenAI Responses API.
+
+    Attributes:
+        url (str): Base URL to give to the OpenAI client (e.g. 'http://127.0.0.1:8089/v1').
+    """
+    TWEET_LABELS = ('left', 'neutral', 'right')
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_seconds: float = 0.3,
+                 latency_sigma: float = 0.5, error_rate: float = 0.0, malformed_rate: float = 0.0,
+                 rate_limit_rpm: Optional[float] = None, seed: Optional[int] = None):
+        """
+        Args:
+            port (int): Port to listen on (0 picks a free port).
+            rate_limit_rpm (Optional[float]): Requests per minute accepted before answering 429
+                (None for no limit).
+        """
+        assert 0 <= error_rate + malformed_rate <= 1, 'error_rate + malformed_rate must be a probability.'
+        self.latency_seconds = latency_seconds
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.rate_limit_rpm = rate_limit_rpm
+        self._rng = np.random.default_rng(seed=seed)
+        self._lock = threading.Lock()
+        self._tokens = max(1.0, rate_limit_rpm / 60.0) if rate_limit_rpm else 0.0
+        self._last_refill = time.monotonic()
+        self._stats = {'requests': 0, 'ok': 0, 'rate_limited': 0, 'errors': 0, 'malformed': 0}
+
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self) -> 'MockOpenAIServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        # shutdown() waits for serve_forever() to exit, so it would block if it never ran.
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    @staticmethod
+    def error_body(message: str, error_type: str) -> dict:
+        return {'error': {'message': message, 'type': error_type, 'param': None, 'code': None}}
+
+    @staticmethod
+    def label_for(user_content: str) -> str:
+        """
+        Deterministic answer to a prompt: a JSON score for user timelines, a stance for tweets.
+        """
+        digest = int.from_bytes(hashlib.sha256(user_content.encode('utf-8')).digest()[:8], 'big')
+        if 'tweet 1:' in user_content:
+            score = digest % 11
+            if score == 0:
+                return json.dumps({'score': 'Not enough information'})
+            return json.dumps({'explanation': 'Mock evaluation.', 'score': score})
+        return MockOpenAIServer.TWEET_LABELS[digest % len(MockOpenAIServer.TWEET_LABELS)]
+
+    def _take_token(self) -> Optional[float]:
+        """
+        Takes a request from the rate-limit bucket. Returns None if the request is accepted, or
+        the number of seconds until it would be.
+        """
+        if not self.rate_limit_rpm:
+            return None
+        rate = self.rate_limit_rpm / 60.0
+        now = time.monotonic()
+        self._tokens = min(max(1.0, rate), self._tokens + (now - self._last_refill) * rate)
+        self._last_refill = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return None
+        return (1.0 - self._tokens) / rate
+
+    def respond(self, body: dict) -> Tuple[int, Dict[str, str], dict]:
+        """
+        Computes the answer to a `responses.create` request body: (status, headers, payload).
+        """
+        with self._lock:
+            self._stats['requests'] += 1
+            retry_after = self._take_token()
+            if retry_after is not None:
+                self._stats['rate_limited'] += 1
+                return (429, {'retry-after': f'{retry_after:.3f}'},
+                        MockOpenAIServer.error_body('Rate limit reached.', 'rate_limit_error'))
+            latency = self.latency_seconds * float(np.exp(self.latency_sigma * self._rng.standard_normal()))
+            outcome = self._rng.random()
+
+        time.sleep(latency)
+
+        if outcome < self.error_rate:
+            with self._lock:
+                self._stats['errors'] += 1
+            return 500, {}, MockOpenAIServer.error_body('The server had an error.', 'server_error')
+
+        messages = body.get('input', [])
+        if isinstance(messages, str):
+            messages = [{'role': 'user', 'content': messages}]
+        user_content = '\n'.join(message.get('content', '') for message in messages if message.get('role') == 'user')
+        if outcome < self.error_rate + self.malformed_rate:
+            text = 'I cannot tell.'
+            with self._lock:
+                self._stats['malformed'] += 1
+        else:
+            text = MockOpenAIServer.label_for(user_content)
+            with self._lock:
+                self._stats['ok'] += 1
+
+        input_tokens = sum(len(message.get('content', '')) for message in messages) // 4 + 1
+        output_tokens = len(text) // 4 + 1
+        payload = {
+            'id': f'resp_{uuid.uuid4().hex}',
+            'object': 'response',
+            'created_at': int(time.time()),
+            'status': 'completed',
+            'model': body.get('model'),
+            'output': [{
+                'type': 'message',
+                'id': f'msg_{uuid.uuid4().hex}',
+                'status': 'completed',
+                'role': 'assistant',
+                'content': [{'type': 'output_text', 'text': text, 'annotations': []}],
+            }],
+            'parallel_tool_calls': True,
+            'tool_choice': 'auto',
+            'tools': [],
+            'metadata': {},
+            'temperature': body.get('temperature'),
+            'usage': {
+                'input_tokens': input_tokens,
+                'input_tokens_details': {'cached_tokens': 0},
+                'output_tokens': output_tokens,
+                'output_tokens_details': {'reasoning_tokens': 0},
+                'total_tokens': input_tokens + output_tokens,
+            },
+        }
+        return 200, {}, payload
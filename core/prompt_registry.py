@@ -0,0 +1,122 @@
+"""
+prompt_registry.py
+
+This module defines the `PromptRegistry` class, an in-memory cache of the prompt templates of
+the prompts folder (config/prompts/*.md) used by `OpenAIStanceDetector`.
+
+Templates are read and hashed once, the first time they are used, so no file is read on the hot
+path of the evaluation. Line endings are normalized when a template is loaded, so the developer
+message (the first message of every request) is byte-identical across calls and machines, which
+lets the provider-side prompt caching apply to it. A watcher thread checks the modification time
+of the loaded templates every `watch_seconds` and reloads the ones that changed; the version
+(hash) of the template used is stored with each result.
+
+Usage:
+    prompts = PromptRegistry('config/prompts/', watch_seconds=5)
+    template = prompts.get('openai-evaluate-tweet-developer-prompt')
+    template.content, template.version
+"""
+
+import hashlib
+import os
+import threading
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+
+class PromptTemplate(NamedTuple):
+    name: str
+    content: str
+    version: str
+
+
+class PromptRegistry:
+    """
+    Cache of prompt templates, reloaded when their file changes.
+
+    Attributes:
+        folder (str): Folder of the templates (one `<name>.md` file per template).
+        watch_seconds (Optional[float]): Seconds between checks for changes (None to never
+            reload a template once loaded).
+        on_change (Optional[Callable[[PromptTemplate], None]]): Called with each template whose
+            content changed.
+    """
+
+    def __init__(self, folder: str, watch_seconds: Optional[float] = 5.0,
+                 on_change: Optional[Callable[[PromptTemplate], None]] = None):
+        self.folder = folder
+        self.watch_seconds = watch_seconds
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._templates: Dict[str, Tuple[PromptTemplate, Tuple[int, int]]] = {}
+        self._stop = threading.Event()
+        self._watcher = None
+        if watch_seconds is not None:
+            self._watcher = threading.Thread(target=self._watch, daemon=True)
+            self._watcher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    @staticmethod
+    def version(content: str) -> str:
+        """
+        Short hash identifying the content of a template, stored with each result.
+        """
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+
+    def _filename(self, name: str) -> str:
+        return os.path.join(self.folder, f'{name}.md')
+
+    def _load(self, name: str) -> Tuple[PromptTemplate, Tuple[int, int]]:
+        filename = self._filename(name)
+        stat = os.stat(filename)
+        with open(filename, 'r', encoding='utf-8', newline='') as reader:
+            content = reader.read().replace('\r\n', '\n')
+        return PromptTemplate(name, content, PromptRegistry.version(content)), (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, name: str) -> PromptTemplate:
+        """
+        The current template `name` (read from disk only the first time).
+        """
+        with self._lock:
+            entry = self._templates.get(name)
+        if entry is None:
+            entry = self._load(name)
+            with self._lock:
+                entry = self._templates.setdefault(name, entry)
+        return entry[0]
+
+    def refresh(self) -> int:
+        """
+        Reloads the loaded templates whose file changed. Returns the number reloaded.
+        """
+        with self._lock:
+            loaded = dict(self._templates)
+        reloaded = 0
+        for name, (template, signature) in loaded.items():
+            try:
+                stat = os.stat(self._filename(name))
+                if (stat.st_mtime_ns, stat.st_size) == signature:
+                    continue
+                entry = self._load(name)
+            except OSError:
+                continue  # Keep the cached template while the file is being replaced.
+            with self._lock:
+                self._templates[name] = entry
+            if entry[0].version != template.version and self.on_change is not None:
+                self.on_change(entry[0])
+            reloaded += 1
+        return reloaded
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.watch_seconds):
+            self.refresh()
@@ -0,0 +1,152 @@
+"""
+retry.py
+
+This module contains the fault-tolerance helpers used around the LLM calls:
+
+- `LLMResponseError`: raised when the LLM output cannot be parsed. Requests are sent with
+  temperature 0, so a malformed output is likely to repeat: it is retried at most
+  `max_parse_attempts - 1` times, without backoff.
+- `CircuitBreaker`: pauses the dispatch of new calls when the recent error rate spikes,
+  instead of hammering a failing API.
+- `RetryPolicy`: retries retryable errors with jittered exponential backoff, reporting every
+  attempt to an (optional) circuit breaker.
+"""
+
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import numpy as np
+from openai import (APIConnectionError, APITimeoutError, AuthenticationError, InternalServerError,
+                    PermissionDeniedError, RateLimitError)
+
+sys.path.append('..')
+
+from core.cassette import CassetteMissError
+from core.usage_metrics import BudgetExceededError
+from src import io
+
+
+class LLMResponseError(ValueError):
+    """
+    The LLM answered, but its output does not follow the expected format.
+    """
+
+
+# Errors worth a second attempt: transient API problems and malformed outputs.
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError, LLMResponseError)
+
+# Errors that affect every request (wrong or revoked key, budget spent, replaying a cassette
+# recorded for other requests): the run must stop.
+FATAL_ERRORS = (AuthenticationError, PermissionDeniedError, BudgetExceededError, CassetteMissError)
+
+
+class CircuitBreaker:
+    """
+    Sliding-window circuit breaker.
+
+    The outcomes of the last `window_size` calls are kept. When at least `min_calls` outcomes
+    are known and the fraction of failures reaches `error_rate_threshold`, the circuit opens:
+    `wait_until_closed` blocks new calls for `cooldown_seconds`, after which the window is
+    cleared and calls are let through again (half-open). `clock` and `sleep` can be replaced
+    (e.g. by a fake clock in tests).
+    """
+
+    def __init__(self, window_size: int = 50, error_rate_threshold: float = 0.5,
+                 cooldown_seconds: float = 60.0, min_calls: int = 10,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.window_size = window_size
+        self.error_rate_threshold = error_rate_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.min_calls = min_calls
+        self.clock = clock
+        self.sleep = sleep
+        self._outcomes = deque(maxlen=window_size)
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.clock() < self._open_until
+
+    def record(self, success: bool) -> None:
+        with self._lock:
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.error_rate_threshold:
+                self._open_until = self.clock() + self.cooldown_seconds
+                self._outcomes.clear()
+                io.warning(f'Circuit breaker opened: {failures} failures in the last calls, '
+                           f'pausing for {self.cooldown_seconds:.0f}s.')
+
+    def wait_until_closed(self) -> None:
+        while True:
+            remaining = self._open_until - self.clock()
+            if remaining <= 0:
+                return
+            self.sleep(remaining)
+
+
+class RetryPolicy:
+    """
+    Retries a call on retryable errors with "full jitter" exponential backoff: before attempt
+    k+1 the policy sleeps a uniform random time in [0, min(max_delay, base_delay * 2**k)].
+
+    Malformed outputs (`LLMResponseError`) have their own, smaller limit (`max_parse_attempts`)
+    and are retried immediately, since waiting does not make a deterministic output valid.
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 60.0,
+                 circuit_breaker: Optional[CircuitBreaker] = None, seed: Optional[int] = None,
+                 max_parse_attempts: int = 2, sleep: Callable[[float], None] = time.sleep):
+        assert max_attempts >= 1, 'At least one attempt is required.'
+        assert max_parse_attempts >= 1, 'At least one attempt is required.'
+        self.max_attempts = max_attempts
+        self.max_parse_attempts = max_parse_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.circuit_breaker = circuit_breaker
+        self.sleep = sleep
+        self._rng = np.random.default_rng(seed=seed)
+        self._lock = threading.Lock()
+
+    def _delay(self, attempt: int) -> float:
+        with self._lock:
+            return float(self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def call(self, function: Callable, *args, **kwargs):
+        """
+        Calls `function(*args, **kwargs)`, retrying retryable errors.
+
+        Raises:
+            The last error, once `max_attempts` attempts failed (or immediately for errors that
+            are not retryable).
+        """
+        parse_failures = 0
+        for attempt in range(self.max_attempts):
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.wait_until_closed()
+            try:
+                result = function(*args, **kwargs)
+            except LLMResponseError as error:
+                # The API worked: the outcome does not count against the circuit breaker.
+                parse_failures += 1
+                if parse_failures >= self.max_parse_attempts or attempt == self.max_attempts - 1:
+                    raise
+                io.warning(f'Attempt {attempt + 1}/{self.max_attempts} got a malformed output ({error}), retrying.')
+                continue
+            except RETRYABLE_ERRORS as error:
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.record(success=False)
+                if attempt == self.max_attempts - 1:
+                    raise
+                delay = self._delay(attempt)
+                io.warning(f'Attempt {attempt + 1}/{self.max_attempts} failed ({type(error).__name__}: {error}), '
+                           f'retrying in {delay:.1f}s.')
+                self.sleep(delay)
+                continue
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record(success=True)
+            return result
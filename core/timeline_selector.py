@@ -0,0 +1,136 @@
+"""
+timeline_selector.py
+
+This module defines the `TimelineSelector` class, which picks the tweets of a user sent to the
+LLM by `OpenAIStanceDetector.evaluate_user`.
+
+Instead of drawing tweets uniformly at random, the selector:
+    - drops tweets with no words besides hashtags, mentions and URLs, and duplicates (same
+      normalized text),
+    - orders the remaining tweets so that every prefix of the order is spread over the timeline
+      (first, last, middle, quarters, ...),
+    - adds tweets in that order while the formatted prompt stays within a token budget, up to
+      `max_tweet_count` tweets.
+The selected tweets are returned in chronological order.
+
+Tokens are counted with tiktoken when it is installed (exact counts for the OpenAI models), or
+estimated conservatively from the length in bytes otherwise.
+
+Usage:
+    selector = TimelineSelector(max_tweet_count=50, max_tokens=6000)
+    tweets = selector.select(user_tweets, OpenAIStanceDetector.format_evaluate_user_prompt)
+"""
+
+import re
+from typing import Callable, List, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from src.tweet import Tweet
+
+
+class TimelineSelector:
+    """
+    Token-budget-aware selection of the tweets of a user timeline.
+
+    Attributes:
+        max_tweet_count (int): Maximum number of tweets selected.
+        max_tokens (int): Maximum number of tokens of the formatted prompt.
+    """
+    _WHITESPACES = re.compile(r'\s+')
+    _NON_WORDS = re.compile(r'#\w+|@AnonymizedUser|\[AnonymizedURL\]')
+
+    def __init__(self, max_tweet_count: int, max_tokens: int, encoding_name: Optional[str] = 'o200k_base'):
+        """
+        Args:
+            encoding_name (Optional[str]): tiktoken encoding of the model (None to always use the
+                estimate).
+        """
+        self.max_tweet_count = max_tweet_count
+        self.max_tokens = max_tokens
+        self._encoding = tiktoken.get_encoding(encoding_name) if tiktoken is not None and encoding_name else None
+
+    @property
+    def exact(self) -> bool:
+        """
+        Whether tokens are counted with the tokenizer of the model (instead of estimated).
+        """
+        return self._encoding is not None
+
+    def count_tokens(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        # OpenAI tokenizers average about 4 bytes per token in English, 3 is an upper bound.
+        return len(text.encode('utf-8')) // 3 + 1
+
+    @staticmethod
+    def spread_order(count: int) -> List[int]:
+        """
+        Order of the indices 0..count-1 in which every prefix is spread over the range: the ends
+        first, then the middle, then the middles of the halves, and so on.
+        """
+        if count <= 2:
+            return list(range(count))
+        order, seen = [0, count - 1], {0, count - 1}
+        intervals = [(0, count - 1)]
+        while intervals:
+            next_intervals = []
+            for start, end in intervals:
+                if end - start < 2:
+                    continue
+                middle = (start + end) // 2
+                if middle not in seen:
+                    seen.add(middle)
+                    order.append(middle)
+                next_intervals.extend([(start, middle), (middle, end)])
+            intervals = next_intervals
+        return order
+
+    def candidates(self, tweets: List[Tweet]) -> List[Tweet]:
+        """
+        Tweets with words besides hashtags, mentions and URLs, without duplicates (the first
+        tweet of each text is kept), in chronological order.
+        """
+        texts, candidates = set(), []
+        for tweet in sorted(tweets, key=lambda tweet: (tweet.created_at, tweet.id)):
+            text = TimelineSelector._WHITESPACES.sub(' ', tweet.sanitized_text).strip().lower()
+            words = TimelineSelector._NON_WORDS.sub(' ', tweet.sanitized_text)
+            if re.search(r'\w', words) and text not in texts:
+                texts.add(text)
+                candidates.append(tweet)
+        return candidates
+
+    def select(self, tweets: List[Tweet], format_prompt: Callable[[List[Tweet]], str],
+               max_tokens: Optional[int] = None) -> List[Tweet]:
+        """
+        Selects the tweets of a timeline.
+
+        Args:
+            format_prompt (Callable[[List[Tweet]], str]): Formats the selected tweets as the
+                prompt whose tokens are counted.
+            max_tokens (Optional[int]): Token budget of this prompt (None for `self.max_tokens`).
+
+        Returns:
+            List[Tweet]: The selected tweets, in chronological order (empty if no tweet has words).
+        """
+        max_tokens = self.max_tokens if max_tokens is None else max_tokens
+        candidates = self.candidates(tweets)
+        used = self.count_tokens(format_prompt([]))
+        selected = []
+        for index in TimelineSelector.spread_order(len(candidates)):
+            if len(selected) == self.max_tweet_count:
+                break
+            # Each tweet adds a "tweet k: <text>" line; the exact total is checked below.
+            tokens = self.count_tokens(f'tweet {len(selected) + 1}: {candidates[index].sanitized_text}\n')
+            if used + tokens <= max_tokens:
+                selected.append(index)
+                used += tokens
+
+        selected.sort()
+        while selected and self.count_tokens(format_prompt([candidates[index] for index in selected])) > max_tokens:
+            # Tokens can merge across lines once joined: drop the longest tweets until it fits.
+            selected.pop(max(range(len(selected)), key=lambda k: len(candidates[selected[k]].sanitized_text)))
+        return [candidates[index] for index in selected]
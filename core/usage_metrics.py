@@ -0,0 +1,236 @@
+"""
+usage_metrics.py
+
+This module defines the `UsageMetrics` class, which accounts for the tokens, cost, latency and
+retries of the LLM calls made by `OpenAIStanceDetector`.
+
+Every logical call (the evaluation of one tweet or one user, including its retries) is
+recorded as one line of a JSONL metrics file, and a per-run summary (tokens/s, cost, p50/p95
+latency) can be reported at the end of a run. An optional budget stops the dispatch of new calls
+before the configured spend is exceeded: each API attempt reserves its expected cost (from the
+token count of its prompt) before it is sent, so concurrent calls cannot overshoot the budget,
+and the reservation is replaced by the actual cost when the response arrives.
+"""
+
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+sys.path.append('..')
+
+from src.result_log import ResultLog
+
+
+class BudgetExceededError(RuntimeError):
+    """
+    Dispatching another call would exceed the configured budget.
+    """
+
+
+class UsageMetrics:
+    """
+    Thread-safe accounting of LLM usage.
+
+    Attributes:
+        prices (Dict[str, Dict[str, float]]): Price in USD per million tokens, per model, with
+            'input' and 'output' entries.
+        budget_usd (Optional[float]): Maximum spend of the run (None for no limit).
+        first_output_tokens (int): Expected output tokens of a response, until responses are
+            received (then, the average output tokens of the responses so far is used).
+    """
+
+    def __init__(self, prices: Dict[str, Dict[str, float]], budget_usd: Optional[float] = None,
+                 sink_filepath: Optional[str] = None, first_output_tokens: int = 100):
+        self.prices = prices
+        self.budget_usd = budget_usd
+        self.first_output_tokens = first_output_tokens
+        self._reserved_usd = 0.0
+        self._responses = 0
+        self._sink = ResultLog(sink_filepath, fsync_every=200) if sink_filepath is not None else None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._latencies = []
+        self._retries = []
+        self._totals = {'calls': 0, 'failed_calls': 0, 'input_tokens': 0, 'output_tokens': 0, 'cost_usd': 0.0}
+
+    def require_price(self, model: str) -> None:
+        """
+        Raises ValueError if a budget is set but the cost of `model` is unknown (the budget
+        could never be enforced).
+        """
+        if self.budget_usd is not None and model not in self.prices:
+            raise ValueError(f'A budget is set but model {model} has no price per million tokens.')
+
+    def cost(self, model: str, input_tokens: int, output_tokens: int) -> float:
+        """
+        Cost in USD of a response. Models without a price cost nothing when no budget is set.
+        """
+        self.require_price(model)
+        if model not in self.prices:
+            return 0.0
+        price = self.prices[model]
+        return (input_tokens * price['input'] + output_tokens * price['output']) / 1_000_000
+
+    @property
+    def spent_usd(self) -> float:
+        with self._lock:
+            return self._totals['cost_usd']
+
+    def check_budget(self) -> None:
+        """
+        Raises BudgetExceededError if the next call (estimated at the average cost of the calls
+        made so far) would exceed the budget, counting the reservations of the calls in flight.
+        """
+        if self.budget_usd is None:
+            return
+        with self._lock:
+            calls = self._totals['calls']
+            spent = self._totals['cost_usd'] + self._reserved_usd
+            expected_next = self._totals['cost_usd'] / calls if calls > 0 else 0.0
+        if spent + expected_next > self.budget_usd:
+            raise BudgetExceededError(f'Budget of ${self.budget_usd:.2f} reached (spent ${spent:.4f}).')
+
+    @contextmanager
+    def reserve(self, model: str, input_tokens: int):
+        """
+        Context manager around one API attempt: reserves its expected cost (`input_tokens` of
+        prompt and the average output tokens so far) before the request is sent, and releases the
+        reservation at the end (the actual cost is added by `add_response` inside the block).
+
+        Raises:
+            BudgetExceededError: If the spend plus the reservations in flight plus the expected
+                cost of this attempt would exceed the budget.
+        """
+        if self.budget_usd is None:
+            yield
+            return
+        with self._lock:
+            output_tokens = (self._totals['output_tokens'] / self._responses if self._responses > 0
+                             else self.first_output_tokens)
+            expected = self.cost(model, input_tokens, output_tokens)
+            spent = self._totals['cost_usd'] + self._reserved_usd
+            if spent + expected > self.budget_usd:
+                raise BudgetExceededError(f'Budget of ${self.budget_usd:.2f} reached (spent and reserved '
+                                          f'${spent:.4f}, next call ${expected:.4f}).')
+            self._reserved_usd += expected
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._reserved_usd -= expected
+
+    @contextmanager
+    def track_call(self, kind: str, item_id: str):
+        """
+        Context manager around a logical call (with its retries). The responses received
+        inside it must be reported with `add_response`, and each API attempt with `add_attempt`
+        (inside `reserve`, since retries also cost).
+        """
+        self.check_budget()
+        state = self._local
+        state.input_tokens = 0
+        state.output_tokens = 0
+        state.cost_usd = 0.0
+        state.attempts = 0
+        state.model = None
+        with self._lock:
+            if self._started_at is None:
+                self._started_at = time.monotonic()
+        start = time.monotonic()
+        success = False
+        try:
+            yield
+            success = True
+        finally:
+            self._record(kind, item_id, latency=time.monotonic() - start, success=success)
+
+    def add_attempt(self) -> None:
+        if hasattr(self._local, 'attempts'):
+            self._local.attempts += 1
+
+    def add_response(self, model: str, usage) -> None:
+        """
+        Accounts for the usage (`response.usage`) of one API response.
+        """
+        input_tokens = getattr(usage, 'input_tokens', 0) or 0
+        output_tokens = getattr(usage, 'output_tokens', 0) or 0
+        cost = self.cost(model, input_tokens, output_tokens)
+        with self._lock:
+            self._totals['input_tokens'] += input_tokens
+            self._totals['output_tokens'] += output_tokens
+            self._totals['cost_usd'] += cost
+            self._responses += 1
+        if hasattr(self._local, 'input_tokens'):
+            self._local.input_tokens += input_tokens
+            self._local.output_tokens += output_tokens
+            self._local.cost_usd += cost
+            self._local.model = model
+
+    def _record(self, kind: str, item_id: str, latency: float, success: bool) -> None:
+        state = self._local
+        retries = max(0, state.attempts - 1)
+        record = {
+            'timestamp': datetime.now().isoformat(timespec='milliseconds'),
+            'kind': kind,
+            'item_id': item_id,
+            'model': state.model,
+            'input_tokens': state.input_tokens,
+            'output_tokens': state.output_tokens,
+            'cost_usd': state.cost_usd,
+            'latency_seconds': latency,
+            'retries': retries,
+            'success': success,
+        }
+        with self._lock:
+            self._totals['calls'] += 1
+            if not success:
+                self._totals['failed_calls'] += 1
+            self._latencies.append(latency)
+            self._retries.append(retries)
+            if self._sink is not None:
+                self._sink.append(record)
+
+    def summary(self) -> dict:
+        """
+        Returns the aggregated usage of the run.
+        """
+        with self._lock:
+            totals = dict(self._totals)
+            latencies = np.array(self._latencies) if self._latencies else np.zeros(1)
+            retries = np.array(self._retries) if self._retries else np.zeros(1)
+            elapsed = time.monotonic() - self._started_at if self._started_at is not None else 0.0
+        tokens = totals['input_tokens'] + totals['output_tokens']
+        return {
+            **totals,
+            'elapsed_seconds': elapsed,
+            'tokens_per_second': tokens / elapsed if elapsed > 0 else 0.0,
+            'calls_per_second': totals['calls'] / elapsed if elapsed > 0 else 0.0,
+            'latency_p50_seconds': float(np.percentile(latencies, 50)),
+            'latency_p95_seconds': float(np.percentile(latencies, 95)),
+            'mean_retries': float(retries.mean()),
+        }
+
+    def format_summary(self) -> List[str]:
+        """
+        Returns the summary of the run as printable lines.
+        """
+        summary = self.summary()
+        budget = f' (budget ${self.budget_usd:.2f})' if self.budget_usd is not None else ''
+        return [
+            f'LLM calls:          {summary["calls"]:,} ({summary["failed_calls"]:,} failed)',
+            f'Tokens:             {summary["input_tokens"]:,} input, {summary["output_tokens"]:,} output',
+            f'Cost:               ${summary["cost_usd"]:.4f}{budget}',
+            f'Throughput:         {summary["tokens_per_second"]:,.1f} tokens/s, {summary["calls_per_second"]:.2f} calls/s',
+            f'Latency:            p50={summary["latency_p50_seconds"]:.2f}s p95={summary["latency_p95_seconds"]:.2f}s',
+            f'Retries per call:   {summary["mean_retries"]:.2f}',
+        ]
+
+    def close(self) -> None:
+        if self._sink is not None:
+            self._sink.close()
@@ -5,6 +5,7 @@ sys.path.append('..')
 from src import io
 from src.convoy_protest_dataset import DatasetType,ConvoyProtestDataset
 from src.paths_handler import PathsHandler
+from src.stance_result_store import StanceResultStore
 from src.tweet import Tweet
 
 
@@ -22,21 +23,19 @@ def main() -> None:
         '#TruckerConvoy2022'
     }
 
-    # ========== Loading Tweet stances: ==========
-    with open(config.get_path('tweet-evaluation-output'), 
-            'r',
-            encoding='utf-8'
-            ) as file:
-        tweet_id2stance = {tweet_stance_output['tweet_id']: tweet_stance_output['llm_response']
-                        for tweet_stance_output in json.load(file)}
-
-    io.info(f'Tweet with stances loaded, {len(tweet_id2stance):3,} tweet_ids found.')
-
     # ========== Loading Tweets: ==========
     hashtag2tweets = {}
     _, tweets,_  = ConvoyProtestDataset.get_dataset(data_type=DatasetType.ALL, removed_repeated=True)
     io.info(f'Loaded {len(tweets):,} tweets from the dataset (repeated removed).')
 
+    # ========== Loading Tweet stances: ==========
+    hashtag_tweet_ids = (tweet.id for tweet in tweets
+                         if any(hashtag.lower() in tweet.text.lower() for hashtag in hashtags))
+    with StanceResultStore(config.get_path('stance-result-store')) as store:
+        tweet_id2stance = store.get_many(hashtag_tweet_ids, label_sources=StanceResultStore.LLM_LABEL_SOURCES)
+
+    io.info(f'Tweet with stances loaded, {len(tweet_id2stance):3,} tweet_ids found.')
+
     for hashtag in hashtags:
         hashtag_tweets = [tweet for tweet in tweets if hashtag.lower() in tweet.text.lower()]
         io.info(f'Hashtag: {hashtag:18} --- Tweets: {len(hashtag_tweets):6,}')
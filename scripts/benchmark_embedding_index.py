@@ -0,0 +1,79 @@
+"""
+Recall and latency of the IVF tweet embedding index (built by create_tweet_embeddings.py).
+
+A sample of the tweets is used as queries. For each nprobe, the script reports the recall@k of
+the index against the exact search and the latency per query, batched and one query at a time,
+next to the latency of the exact search.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append('..')
+from src import io
+from src.embedding_index import IVFIndex, exact_search, load_embeddings, recall_at_k
+from src.hash_sampler import HashSampler
+from src.paths_handler import PathsHandler
+
+
+SEED = 1729405311
+
+
+def main():
+    config = PathsHandler()
+    embeddings_folder = config.get_path('tweet-embeddings-folder')
+    index_file = config.get_path('tweet-embedding-index')
+    output_file = config.get_path('embedding-index-benchmark-output')
+
+    io.info('Starting script benchmark_embedding_index.py ...')
+    parser = argparse.ArgumentParser(description="Benchmark the recall and latency of the tweet embedding index.")
+    parser.add_argument("--nprobe", type=str, default="1,2,4,8,16,32,64", help="Comma-separated nprobe values to compare.")
+    parser.add_argument("--queries", type=int, default=1000, help="Number of tweets used as queries.")
+    parser.add_argument("--k", type=int, default=10, help="Number of neighbours.")
+    args = parser.parse_args()
+
+    ids, vectors = load_embeddings(embeddings_folder)
+    index = IVFIndex.load(index_file, vectors)
+    rows = np.sort(HashSampler(key=SEED).sample(range(len(ids)), k=args.queries, id_of=lambda row: ids[row]))
+    queries = np.asarray(vectors[rows], dtype=np.float32)
+    io.info(f'{len(ids):,} vectors, {index.n_lists:,} lists, {len(queries):,} queries.')
+
+    start = time.monotonic()
+    _, exact = exact_search(vectors, queries, args.k)
+    exact_ms = (time.monotonic() - start) * 1000 / len(queries)
+    io.info(f'Exact search: {exact_ms:.2f} ms/query (batched).')
+
+    results = []
+    for nprobe in (int(value) for value in args.nprobe.split(',')):
+        start = time.monotonic()
+        _, found = index.search(queries, args.k, nprobe=nprobe)
+        batched_ms = (time.monotonic() - start) * 1000 / len(queries)
+        latencies = []
+        for query in queries[:100]:
+            start = time.monotonic()
+            index.search(query[np.newaxis], args.k, nprobe=nprobe)
+            latencies.append((time.monotonic() - start) * 1000)
+        result = {
+            'nprobe': nprobe,
+            'k': args.k,
+            'queries': len(queries),
+            'recall_at_k': recall_at_k(found, exact),
+            'batched_ms_per_query': batched_ms,
+            'single_query_p50_ms': float(np.percentile(latencies, 50)),
+            'single_query_p99_ms': float(np.percentile(latencies, 99)),
+            'exact_ms_per_query': exact_ms,
+        }
+        io.info(f'nprobe={nprobe:>4}  recall@{args.k}={result["recall_at_k"]:.3f}  {batched_ms:.2f} ms/query batched  '
+                f'p50={result["single_query_p50_ms"]:.2f} ms  p99={result["single_query_p99_ms"]:.2f} ms')
+        results.append(result)
+
+    pd.DataFrame(results).to_csv(output_file, index=False)
+    io.info(f'Results saved to {output_file}')
+    io.info('Finishing script benchmark_embedding_index.py ...')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Accuracy and throughput of the quantized variants of the local StanceDetector on CPU.
+
+A held-out sample of tweets labeled by OpenAIStanceDetector is scored by each variant (the first
+one, full precision by default, is the reference). For each variant the script reports the
+tweets per second, the agreement of its scores with the reference, and the agreement of its
+stance (scores mapped to left/neutral/right) with the OpenAI labels.
+"""
+import argparse
+import sys
+import time
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+sys.path.append('..')
+from src import io
+from src.convoy_protest_dataset import ConvoyProtestDataset, DatasetType
+from src.hash_sampler import HashSampler
+from src.paths_handler import PathsHandler
+from src.stance_result_store import StanceResultStore
+from core.llms import StanceDetector
+
+
+SEED = 2203958417
+
+
+def score_to_stance(score: Union[int, str]) -> str:
+    """
+    Maps a 0 (far left) to 10 (far right) score to the labels of OpenAIStanceDetector (-1, no
+    political stance, is neutral). Scores that are not numbers (score-labels such as left,
+    neutral and right) are already stances.
+    """
+    if isinstance(score, str):
+        return score
+    if 0 <= score <= 3:
+        return 'left'
+    if score >= 7:
+        return 'right'
+    return 'neutral'
+
+
+def load_labeled_sample(store_file: str, sample_size: int) -> tuple[list[str], list[str]]:
+    """
+    Sanitized texts and OpenAI labels of a sample of the tweets labeled by the LLM (labels copied
+    from near-duplicates or predicted by the cascade classifier are left out).
+    """
+    with StanceResultStore(store_file) as store:
+        id2label = {result['tweet_id']: result['llm_response'] for result in store.iter_tweet_results()
+                    if result.get('label_source', 'llm') == 'llm'}
+    _, tweets, _ = ConvoyProtestDataset.get_dataset(data_type=DatasetType.ALL, removed_repeated=True)
+    sample = HashSampler(key=SEED).sample((tweet for tweet in tweets if tweet.id in id2label), k=sample_size,
+                                          id_of=lambda tweet: tweet.id)
+    return [tweet.sanitized_text for tweet in sample], [id2label[tweet.id] for tweet in sample]
+
+
+def main():
+    config = PathsHandler()
+    store_file = config.get_path('stance-result-store')
+    output_file = config.get_path('local-detector-benchmark-output')
+
+    io.info('Starting script benchmark_local_stance_detector.py ...')
+    parser = argparse.ArgumentParser(description="Benchmark the quantized variants of the local StanceDetector on CPU.")
+    parser.add_argument("--quantization", type=str, default="none,dynamic-int8", help="Comma-separated variants to compare, the first one is the reference.")
+    parser.add_argument("--sample-size", type=int, default=500, help="Number of held-out labeled tweets.")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Intra-op threads of torch (default from the configuration).")
+    args = parser.parse_args()
+
+    texts, llm_labels = load_labeled_sample(store_file, args.sample_size)
+    io.info(f'Held-out sample: {len(texts):,} tweets labeled by the LLM.')
+
+    results, reference_scores = [], None
+    for quantization in args.quantization.split(','):
+        detector = StanceDetector(device='cpu', torch_threads=args.torch_threads, quantization=quantization)
+        start = time.monotonic()
+        scores = np.array(detector.evaluate_batch(texts))
+        elapsed = time.monotonic() - start
+        del detector
+
+        if reference_scores is None:
+            reference_scores = scores
+        stances = np.array([score_to_stance(score) for score in scores])
+        result = {
+            'quantization': quantization,
+            'tweets': len(texts),
+            'elapsed_seconds': elapsed,
+            'tweets_per_second': len(texts) / elapsed,
+            'reference_agreement': float(np.mean(scores == reference_scores)),
+            'reference_mean_absolute_difference': (float(np.mean(np.abs(scores - reference_scores)))
+                                                   if scores.dtype.kind in 'iuf' else None),
+            'llm_stance_agreement': float(np.mean(stances == np.array(llm_labels))),
+        }
+        mad = result['reference_mean_absolute_difference']
+        io.info(f'{quantization:>13}  {result["tweets_per_second"]:7.2f} tweets/s  '
+                f'agreement with {args.quantization.split(",")[0]}={result["reference_agreement"]:.1%}  '
+                + (f'MAD={mad:.2f}  ' if mad is not None else '') +
+                f'agreement with LLM={result["llm_stance_agreement"]:.1%}')
+        results.append(result)
+
+    pd.DataFrame(results).to_csv(output_file, index=False)
+    io.info(f'Results saved to {output_file}')
+    io.info('Finishing script benchmark_local_stance_detector.py ...')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,6 @@ import pandas as pd
 import os
 import sys
 from pathlib import Path
-import json
-from collections import Counter
 from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -16,12 +14,37 @@ sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 from src.paths_handler import PathsHandler
 from src.convoy_protest_dataset import ConvoyProtestDataset, DatasetType
+from src.result_log import ResultLog
+from src.stance_result_store import StanceResultStore
 from src.tweet import Tweet
 
 from src import io
 import argparse
 
 
+def load_id2tweet() -> dict[str, Tweet]:
+    _, tweets, _ = ConvoyProtestDataset.get_dataset(data_type=DatasetType.ALL, removed_repeated=True)
+    return {tweet.id: tweet for tweet in tweets}
+
+
+def reconcile_store() -> None:
+    """
+    Adds to the result store the results of the evaluation logs it is missing (as --count of the
+    evaluation scripts does), so the plots do not depend on a previous --sync-store.
+    """
+    config: PathsHandler = PathsHandler()
+    store_file: str = config.get_path('stance-result-store')
+    with StanceResultStore(store_file) as store:
+        with ResultLog(config.get_path('tweet-evaluation-log'),
+                       legacy_filepath=config.get_path('tweet-evaluation-output')) as result_log:
+            _, added = store.reconcile_tweet_log(result_log, load_id2tweet)
+            io.info(f"Added {added:,} tweet results from the log to {store_file}")
+        with ResultLog(config.get_path('user-evaluation-log'),
+                       legacy_filepath=config.get_path('user-evaluation-output')) as result_log:
+            _, added = store.reconcile_user_log(result_log)
+            io.info(f"Added {added:,} user results from the log to {store_file}")
+
+
 def user_histogram() -> None:
     """
     Create a histogram of the user stance scores.
@@ -29,25 +52,23 @@ def user_histogram() -> None:
     io.info("Initializing PathsHandler and loading output paths.")
     config: PathsHandler = PathsHandler()
     output_plot: str = config.get_path('user-stance-plot')
-    json_file: str = config.get_path('user-evaluation-output')
+    store_file: str = config.get_path('stance-result-store')
 
-    io.info(f"Loading user evaluation data from {json_file}")
-    with open(json_file, 'r', encoding='utf-8') as file:
-        data: dict = json.load(file)
+    io.info(f"Loading user score counts from {store_file}")
+    with StanceResultStore(store_file) as store:
+        score_counts: dict[tuple, int] = store.user_counts_by('score')
 
-    io.info(f"Loaded {len(data)} user evaluation records.")
-    scores: list[int] = [int(results['llm_response']['score'])
-                         for results in data
-                         if results['llm_response']['score'] != 'Not enough information']
+    io.info(f"Loaded {sum(score_counts.values())} user evaluation records.")
+    # Scores that are not numbers (e.g. 'Not enough information') are stored as NULL.
+    histogram: list[tuple[float, int]] = [(score, freq)
+                                          for (score,), freq in score_counts.items()
+                                          if score is not None]
 
-    io.info(f"Number of valid user scores (removing not enough information): {len(scores)}")
+    io.info(f"Number of valid user scores (removing not enough information): {sum(freq for _, freq in histogram)}")
     # Create Histogram of scores
     sns.set_style(style="whitegrid")
     fig, ax = plt.subplots(figsize=(6, 4))
 
-    histogram: list[tuple[int, int]] = [(score, freq)
-                                        for score, freq in Counter(scores).items()]
-
     histogram.sort(key=lambda x: x[0])
     io.info(f"Histogram bins: {histogram}")
 
@@ -58,7 +79,7 @@ def user_histogram() -> None:
 
     # add numbers on top of the bars
     for i, (score, freq) in enumerate(histogram):
-        ax.text(i+1, freq + 0.5, str(freq), ha='center', va='bottom')
+        ax.text(score, freq + 0.5, str(freq), ha='center', va='bottom')
 
     ax.set_xlabel('Score')
     ax.set_ylabel('Number of Users')
@@ -68,39 +89,39 @@ def user_histogram() -> None:
 
 
 
-def full_tweet_plot() -> None:
+def full_tweet_plot(label_sources: tuple[str, ...] = StanceResultStore.LLM_LABEL_SOURCES) -> None:
     config: PathsHandler = PathsHandler()
     output_plot: str = config.get_path('tweet-stance-plot')
     _, tweets, _ = ConvoyProtestDataset.get_dataset(data_type=DatasetType.ALL, removed_repeated=True)
 
-    tweet_plot(tweets=tweets, output_plot=output_plot)
+    tweet_plot(tweets=tweets, output_plot=output_plot, label_sources=label_sources)
 
-def tweet_plot(tweets: list[Tweet], output_plot: str) -> None:
+def tweet_plot(tweets: list[Tweet], output_plot: str,
+               label_sources: tuple[str, ...] = StanceResultStore.LLM_LABEL_SOURCES) -> None:
     """
     Create a plot of the number of right-wing, left-wing, and neutral tweets per day.
+
+    Only the tweets labeled by one of `label_sources` are plotted (by default the labels given
+    by the LLM, not those of the local classifier).
     """
 
     io.info("Initializing PathsHandler and loading output paths.")
     config: PathsHandler = PathsHandler()
 
-    json_file: str = config.get_path('tweet-evaluation-output')
+    store_file: str = config.get_path('stance-result-store')
 
-    io.info(f"Loading tweet evaluation data from {json_file}")
-    with open(json_file, 'r', encoding='utf-8') as file:
-        data: dict = json.load(file)
+    io.info(f"Total tweets in dataset: {len(tweets):,}")
 
-    io.info(f"Loaded {len(data)} tweet evaluation records.")
+    io.info(f"Loading the stance of the dataset tweets from {store_file} (label sources: {', '.join(label_sources)})")
+    with StanceResultStore(store_file) as store:
+        id2stance: dict[str, str] = store.get_many((tweet.id for tweet in tweets), label_sources=label_sources)
 
+    io.info(f"Loaded {len(id2stance)} tweet evaluation records.")
 
-    io.info(f"Total tweets in dataset: {len(tweets):,}")
-
-    computed_tweet_ids: set[str] = {item['tweet_id'] for item in data}
-    tweets: list[Tweet] = [tweet for tweet in tweets if tweet.id in computed_tweet_ids]
+    tweets: list[Tweet] = [tweet for tweet in tweets if tweet.id in id2stance]
 
     io.info(f"Tweets after filtering by evaluated IDs: {len(tweets):,}")
 
-    id2stance: dict[str, str] = {item['tweet_id']: item['llm_response'] for item in data }
-
     neutral_tweet_counts_per_day: dict[datetime.date, int] = {}
     right_tweet_counts_per_day: dict[datetime.date, int] = {}
     left_tweet_counts_per_day: dict[datetime.date, int] = {}
@@ -256,7 +277,7 @@ def tweet_plot(tweets: list[Tweet], output_plot: str) -> None:
 #     fig.savefig(output_plot, dpi=300)
 
 
-def hashtag_plots() -> None:
+def hashtag_plots(label_sources: tuple[str, ...] = StanceResultStore.LLM_LABEL_SOURCES) -> None:
     config: PathsHandler = PathsHandler()
     base_output: str = config.get_path('tweet-stance-plot')
     base, ext = os.path.splitext(base_output)
@@ -271,20 +292,17 @@ def hashtag_plots() -> None:
         # _, tweets, _ = ConvoyProtestDataset.get_dataset(data_type=dataset_type, removed_repeated=True)
         tweets = ConvoyProtestDataset.get_hashtag_tweets(dataset_type)
         output_plot = f"{base}_{dataset_type.value}{ext}"
-        tweet_plot(tweets=tweets, output_plot=output_plot)
+        tweet_plot(tweets=tweets, output_plot=output_plot, label_sources=label_sources)
 
-def histogram_tweets_per_hashtag() -> None:
+def histogram_tweets_per_hashtag(label_sources: tuple[str, ...] = StanceResultStore.LLM_LABEL_SOURCES) -> None:
     config: PathsHandler = PathsHandler()
 
-    json_file: str = config.get_path('tweet-evaluation-output')
+    store_file: str = config.get_path('stance-result-store')
 
     output_plot: str = config.get_path('hashtag-histogram-stance-plot')
 
-    io.info(f"Loading tweet evaluation data from {json_file}")
-    with open(json_file, 'r', encoding='utf-8') as file:
-        data: dict = json.load(file)
-
-    id2stance: dict[str, str] = {item['tweet_id']: item['llm_response'] for item in data}
+    io.info(f"Loading tweet evaluation data from {store_file}")
+    store = StanceResultStore(store_file)
 
     plot_data = {
         'count': [],
@@ -299,6 +317,7 @@ def histogram_tweets_per_hashtag() -> None:
                          ]:
         _, tweets, _ = ConvoyProtestDataset.get_dataset(data_type=dataset_type, removed_repeated=True)
 
+        id2stance: dict[str, str] = store.get_many((tweet.id for tweet in tweets), label_sources=label_sources)
         tweets = [tweet for tweet in tweets if tweet.id in id2stance]
 
         right_count = len([tweet for tweet in tweets if id2stance[tweet.id] == 'right'])
@@ -313,6 +332,7 @@ def histogram_tweets_per_hashtag() -> None:
         plot_data['stance'].append('right')
         plot_data['stance'].append('left')
         plot_data['stance'].append('neutral')
+    store.close()
     io.info("Preparing data for plotting.")
     fig, ax = plt.subplots(figsize=(12, 6))
     plot_data = pd.DataFrame(plot_data)
@@ -336,16 +356,22 @@ def main() -> None:
     parser.add_argument('--proportion-plot', action='store_true', help='Create tweet left/right proportion plot')  # Added argument
     parser.add_argument('--hashtag-plots', action='store_true', help='Create tweet stance plot')
     parser.add_argument('--hashtag-histogram', action='store_true', help='Create hashtag histogram plot')
+    parser.add_argument('--label-sources', nargs='+', choices=['llm', 'near_duplicate', 'cascade'],
+                        default=list(StanceResultStore.LLM_LABEL_SOURCES),
+                        help='Label sources of the tweet stances plotted (default: the labels given by the LLM).')
     args = parser.parse_args()
+    label_sources = tuple(args.label_sources)
 
+    if args.user_plot or args.tweet_plot or args.hashtag_plots or args.hashtag_histogram:
+        reconcile_store()
     if args.user_plot:
         user_histogram()
     if args.tweet_plot:
-        full_tweet_plot()
+        full_tweet_plot(label_sources)
     if args.hashtag_plots:
-        hashtag_plots()
+        hashtag_plots(label_sources)
     if args.hashtag_histogram:
-        histogram_tweets_per_hashtag()
+        histogram_tweets_per_hashtag(label_sources)
 
 
 
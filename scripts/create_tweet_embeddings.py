@@ -0,0 +1,56 @@
+"""
+Embeds the sanitized text of every tweet on CPU and builds the IVF index used for similarity
+search (see src/embedding_index.py).
+
+The embeddings are written to a memory-mapped float16 matrix (row i is the tweet on line i of
+tweet_ids.txt) in the tweet-embeddings-folder, and the index to tweet-embedding-index.
+"""
+import argparse
+import sys
+import time
+
+sys.path.append('..')
+from src import io
+from src.convoy_protest_dataset import ConvoyProtestDataset, DatasetType
+from src.embedding_index import IVFIndex, TweetEmbedder, load_embeddings, write_embeddings
+from src.paths_handler import PathsHandler
+
+
+def main():
+    config = PathsHandler()
+    embedding_config = config.get_variable('embedding-index-configuration')
+    embeddings_folder = config.get_path('tweet-embeddings-folder')
+    index_file = config.get_path('tweet-embedding-index')
+
+    io.info('Starting script create_tweet_embeddings.py ...')
+    parser = argparse.ArgumentParser(description="Embed the tweets and build the similarity search index.")
+    parser.add_argument("--index-only", action="store_true", help="Rebuild the index from the existing embeddings.")
+    args = parser.parse_args()
+
+    if not args.index_only:
+        _, tweets, _ = ConvoyProtestDataset.get_dataset(data_type=DatasetType.ALL, removed_repeated=True)
+        tweets = list({tweet.id: tweet for tweet in tweets}.values())
+        io.info(f'{len(tweets):,} tweets retrieved.')
+
+        embedder = TweetEmbedder(embedding_config['model-name'], batch_size=embedding_config['batch-size'],
+                                 torch_threads=embedding_config['torch-threads'])
+        start = time.monotonic()
+        write_embeddings(embeddings_folder, [tweet.id for tweet in tweets], [tweet.sanitized_text for tweet in tweets],
+                         embedder.embed, embedder.dimension)
+        elapsed = time.monotonic() - start
+        io.info(f'Embedded {len(tweets):,} tweets in {elapsed:.0f} s ({len(tweets) / elapsed:.0f} tweets/s).')
+
+    _, vectors = load_embeddings(embeddings_folder)
+    start = time.monotonic()
+    index = IVFIndex(embedding_config['n-lists'], embedding_config['nprobe'], seed=embedding_config['seed'])
+    index.train(vectors).add(vectors)
+    index.save(index_file)
+    sizes = index.list_sizes()
+    io.info(f'Index of {len(vectors):,} vectors built in {time.monotonic() - start:.0f} s '
+            f'({index.n_lists:,} lists of {sizes.min():,} to {sizes.max():,} vectors).')
+    io.info(f'Embeddings saved to {embeddings_folder}, index saved to {index_file}')
+    io.info('Finishing script create_tweet_embeddings.py ...')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,99 @@
 import numpy as np
 import argparse
 
-import json
+import multiprocessing
 import os
+import shutil
+import socket
 import sys
+import time
 sys.path.append('..')
 from datetime import datetime
+from typing import Optional
 from src import io
 from src.convoy_protest_dataset import DatasetType
 from src.convoy_protest_dataset import ConvoyProtestDataset
+from src.dead_letter_queue import DeadLetterQueue
+from src.hash_sampler import HashSampler
+from src.near_duplicates import NearDuplicateClusterer
+from src.pipeline import Pipeline, Stage
+from src.ngram_classifier import HashedNgramClassifier
 from src.paths_handler import PathsHandler
+from src.result_log import ResultLog
+from src.stance_result_store import StanceResultStore
+from src.stratified_sampler import StratifiedSampler
 from src.tweet import Tweet
+from src.work_queue import WorkQueue
+from core.cassette import run_filepath
 from core.llms import OpenAIStanceDetector
+from core.retry import FATAL_ERRORS
+from core.usage_metrics import BudgetExceededError
 
 
 
-def clean(output_file: str):
-    # Ask for confirmation before removing the file
-    confirmation = input(f"Are you sure you want to delete '{output_file}'? [y/N]: ").strip().lower()
+def clean(output_file: str, log_file: str, store_file: str):
+    # Ask for confirmation before removing the files
+    confirmation = input(f"Are you sure you want to delete '{output_file}', '{log_file}' and the tweet results in '{store_file}'? [y/N]: ").strip().lower()
     if confirmation == 'y':
         io.info("Cleaning up files...")
-        os.remove(output_file)
-        io.info(f"'{output_file}' has been deleted.")
+        for filename in [output_file, log_file]:
+            if os.path.exists(filename):
+                os.remove(filename)
+                io.info(f"'{filename}' has been deleted.")
+        with StanceResultStore(store_file) as store:
+            store.clear_tweet_results()
+        io.info(f"Tweet results in '{store_file}' have been deleted.")
     else:
         io.info("Cleanup aborted by user.")
 
 
 
-def run_main(output_file: str, sample_size: int) -> None:
-    BATCH_SIZE = 200
+def start_replay_run(output_file: str, log_file: str, store_file: str, queue_file: str, dead_letter_file: str) -> None:
+    """
+    Removes the results of the previous replay runs and copies the dead-letter queue of the record
+    run, so a replay evaluates the tweets the record run evaluated (given the same arguments). The
+    paths are those of the real outputs (see `run_filepath`).
+    """
+    for filename in (output_file, log_file, dead_letter_file):
+        if os.path.exists(run_filepath(filename, 'replay')):
+            os.remove(run_filepath(filename, 'replay'))
+    with StanceResultStore(run_filepath(store_file, 'replay')) as store:
+        store.clear_tweet_results()
+    with WorkQueue(run_filepath(queue_file, 'replay'), queue_name='tweets') as queue:
+        queue.clear()
+    if os.path.exists(run_filepath(dead_letter_file, 'record')):
+        shutil.copyfile(run_filepath(dead_letter_file, 'record'), run_filepath(dead_letter_file, 'replay'))
+    io.info(f'Replay run: results are written to {run_filepath(log_file, "replay")}')
+
+
+def compact(output_file: str, log_file: str) -> None:
+    with ResultLog(log_file, legacy_filepath=output_file) as result_log:
+        count_no = result_log.compact(output_file)
+    io.info(f'Compacted {count_no:,} results from {log_file} into {output_file}')
+
+
+def load_id2tweet() -> dict[str, Tweet]:
+    """
+    Loads every tweet of the dataset indexed by id (to store the day and hashtags of results).
+    """
+    _, tweets, _ = ConvoyProtestDataset.get_dataset(data_type=DatasetType.ALL, removed_repeated=True)
+    return {tweet.id: tweet for tweet in tweets}
 
-    SEED = 172027145
-    io.info(f'Using sample size: {sample_size}')
-    io.info(f'Script will store results in {output_file}')
 
+def sync_store(output_file: str, log_file: str, store_file: str) -> None:
+    """
+    Loads every result of the log into the result store (with the day and hashtags of each tweet).
+    """
+    id2tweet = load_id2tweet()
+    with StanceResultStore(store_file) as store:
+        count_no = store.add_tweet_results(ResultLog(log_file, legacy_filepath=output_file), id2tweet=id2tweet)
+    io.info(f'Synchronized {count_no:,} results from {log_file} into {store_file}')
 
+
+def load_tweets() -> list[Tweet]:
+    """
+    Loads the tweets eligible for evaluation (in the date range, no retweets, no URLs).
+    """
     # ========== Retrieve all tweets: ==========
     _, tweets, _ = ConvoyProtestDataset.get_dataset(data_type=DatasetType.ALL, removed_repeated=True)
     io.info(f'Len unique tweets:                         {len(tweets):,}')
@@ -54,80 +113,631 @@ def run_main(output_file: str, sample_size: int) -> None:
     tweets = [tweet for tweet in tweets if len(tweet.urls)==0]
     io.info(f'Tweet count with tweets with urls removed: {len(tweets):,}')
 
-
-    detector = OpenAIStanceDetector()
-
+    return tweets
+
+
+def is_eligible(tweet: Tweet) -> bool:
+    """
+    Whether a tweet is evaluated (same criteria as `load_tweets`).
+    """
+    return (datetime(2022, 1, 1) <= tweet.created_at <= datetime(2022, 3, 31)
+            and not tweet.is_retweet and len(tweet.urls)==0)
+
+
+def evaluate_or_dead_letter(detector: OpenAIStanceDetector, tweet: Tweet, dead_letters: DeadLetterQueue) -> Optional[dict]:
+    """
+    Evaluates a tweet. If it still fails after retrying, the tweet is recorded in the dead-letter
+    queue (to be reprocessed later with --reprocess-dead-letters) and None is returned.
+    """
+    try:
+        return detector.evaluate_tweet(tweet)
+    except FATAL_ERRORS:
+        raise
+    except Exception as error:
+        io.error(f'Evaluation of tweet {tweet.id} failed ({type(error).__name__}: {error}), added to the dead-letter queue.')
+        dead_letters.add(tweet.id, error)
+        return None
+
+
+def reconcile_results(result_log: ResultLog, store: StanceResultStore) -> None:
+    """
+    Brings the log and the result store back in sync (see `StanceResultStore.reconcile_tweet_log`).
+    """
+    appended, added = store.reconcile_tweet_log(result_log, load_id2tweet)
+    if appended:
+        io.info(f'Appended {appended:,} results from the result store to the log.')
+    if added:
+        io.info(f'Added {added:,} results from the log to the result store.')
+
+
+def worker_main(worker_id: str, worker: int, id2tweet: dict[str, Tweet], queue_file: str, store_file: str,
+                dead_letter_file: str, budget_usd: Optional[float] = None, backend: Optional[str] = None) -> None:
+    """
+    Evaluates tweets claimed from the work queue until the queue is empty (or the budget of the
+    worker is spent, in which case its unevaluated tweets are given back to the queue).
+
+    Results are written to the result store before the claimed tweets are marked as done, so a
+    worker killed at any point leaves its tweets to be claimed again once its leases expire.
+    Tweets already found in the store are not sent to the LLM again, and tweets that fail are
+    completed after being recorded in the dead-letter queue. The dead-letter queue, usage log and
+    cassette of the worker are written to its own shard of these files (see `merge_worker_logs`).
+    """
+    CLAIM_SIZE = 20
+    LEASE_SECONDS = 600
+    POLL_SECONDS = 30
+
+    detector = OpenAIStanceDetector(budget_usd=budget_usd, backend=backend, worker=worker)
+    queue = WorkQueue(queue_file, queue_name='tweets')
+    store = StanceResultStore(store_file)
+    dead_letters = DeadLetterQueue(ResultLog.shard_filepath(dead_letter_file, worker), id_key='tweet_id')
+
+    while True:
+        tweet_ids = queue.claim(worker_id, max_items=CLAIM_SIZE, lease_seconds=LEASE_SECONDS)
+        if not tweet_ids:
+            if queue.remaining() == 0:
+                break
+            # Remaining tweets are leased by other workers, wait until they finish or their leases expire.
+            time.sleep(POLL_SECONDS)
+            continue
+
+        already_stored = store.get_many(tweet_ids)
+        results = []
+        processed_ids = []
+        budget_exceeded = False
+        for k, tweet_id in enumerate(tweet_ids):
+            # Extends the lease of the tweets still to evaluate, so a slow worker keeps them. A
+            # tweet whose lease expired and was claimed by another worker is left to that worker.
+            if tweet_id not in queue.renew(worker_id, tweet_ids[k:], lease_seconds=LEASE_SECONDS):
+                io.warning(f'[{worker_id}] tweet {tweet_id} was claimed by another worker, skipping it.')
+                continue
+            if tweet_id not in already_stored:
+                try:
+                    result = evaluate_or_dead_letter(detector, id2tweet[tweet_id], dead_letters)
+                except BudgetExceededError as error:
+                    io.warning(f'[{worker_id}] {error} Stopping dispatch.')
+                    budget_exceeded = True
+                    break
+                if result is not None:
+                    results.append(result)
+            processed_ids.append(tweet_id)
+        store.add_tweet_results(results, id2tweet=id2tweet)
+        queue.complete(worker_id, processed_ids)
+        io.info(f'[{worker_id}] evaluated {len(results)} tweets, {queue.remaining():,} left in the queue.')
+        if budget_exceeded:
+            queue.release(worker_id, tweet_ids)
+            break
+
+    detector.log_usage_summary()
+    queue.close()
+    store.close()
+    dead_letters.close()
+
+
+def merge_worker_logs(dead_letter_file: str) -> None:
+    """
+    Merges the shards of the dead-letter queue, usage log and cassette written by the worker
+    processes (each worker appends to its own shard, see `ResultLog.shard_filepath`).
+    """
+    config = PathsHandler()
+    for filepath in (dead_letter_file, config.get_path('llm-usage-log'), config.get_path('llm-cassette')):
+        with ResultLog(filepath, fsync_every=1000) as log:
+            merged = log.merge_shards()
+        if merged:
+            io.info(f'Merged {merged:,} entries of the worker shards into {filepath}')
+
+
+def run_workers(sample: list[Tweet], eligible_tweets: list[Tweet], queue_file: str, store_file: str,
+                dead_letter_file: str, workers: int, budget_usd: Optional[float] = None,
+                backend: Optional[str] = None) -> None:
+    """
+    Evaluates a sample of tweets with several worker processes sharing a work queue. The budget
+    (if any) is split evenly between the workers.
+
+    If the queue still holds unfinished tweets (a previous run was interrupted), those are
+    resumed instead of enqueuing the new sample.
+    """
+    queue = WorkQueue(queue_file, queue_name='tweets')
+    if queue.remaining() == 0:
+        queue.purge_done()
+        enqueued = queue.enqueue(tweet.id for tweet in sample)
+        io.info(f'Enqueued {enqueued:,} tweets.')
+    else:
+        io.info(f'Resuming {queue.remaining():,} unfinished tweets found in {queue_file}.')
+
+    remaining_ids = set(queue.remaining_ids())
+    id2tweet = {tweet.id: tweet for tweet in eligible_tweets if tweet.id in remaining_ids}
+    assert len(id2tweet) == len(remaining_ids), 'Work queue contains tweets that are not eligible for evaluation.'
+
+    run_id = f'{socket.gethostname()}-{os.getpid()}'
+    context = multiprocessing.get_context('spawn')
+    worker_budget_usd = budget_usd / workers if budget_usd is not None else None
+    processes = [context.Process(target=worker_main,
+                                 args=(f'{run_id}-{k}', k, id2tweet, queue_file, store_file, dead_letter_file, worker_budget_usd,
+                                       backend))
+                 for k in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    merge_worker_logs(dead_letter_file)
+
+    if queue.remaining() == 0:
+        queue.purge_done()
+    else:
+        io.warning(f'{queue.remaining():,} tweets were not evaluated, run the script again to resume them.')
+    queue.close()
+
+
+def reprocess_dead_letters(output_file: str, log_file: str, store_file: str, dead_letter_file: str,
+                           budget_usd: Optional[float] = None, backend: Optional[str] = None) -> None:
+    """
+    Evaluates again the tweets of the dead-letter queue. Tweets evaluated successfully are
+    removed from the queue; tweets that fail again stay in it.
+    """
+    dead_letters = DeadLetterQueue(dead_letter_file, id_key='tweet_id')
+    failed_ids = dead_letters.ids()
+    io.info(f'Tweets in the dead-letter queue: {len(failed_ids):,}')
+
+    id2tweet = {tweet.id: tweet for tweet in load_tweets()}
+    result_log = ResultLog(log_file, legacy_filepath=output_file)
+    store = StanceResultStore(store_file)
+    already_processed_tweet_ids = {result_item['tweet_id'] for result_item in result_log}
+
+    detector = OpenAIStanceDetector(budget_usd=budget_usd, backend=backend)
     results = []
+    for tweet_id in failed_ids:
+        if tweet_id in already_processed_tweet_ids:
+            continue
+        try:
+            result = evaluate_or_dead_letter(detector, id2tweet[tweet_id], dead_letters)
+        except BudgetExceededError as error:
+            io.warning(f'{error} Stopping dispatch.')
+            break
+        if result is not None:
+            result_log.append(result)
+            results.append(result)
+    store.add_tweet_results(results, id2tweet=id2tweet)
+    detector.log_usage_summary()
+
+    dead_letters.remove(already_processed_tweet_ids.union(result['tweet_id'] for result in results))
+    io.info(f'Recovered {len(results):,} tweets, {len(dead_letters):,} left in the dead-letter queue.')
+    dead_letters.close()
+    result_log.close()
+    store.close()
+
+    compact(output_file, log_file)
+
+
+def near_duplicate_clusters(tweets: list[Tweet], threshold: float) -> dict[str, list[Tweet]]:
+    """
+    Groups near-identical tweets (by `sanitized_text`). Returns the members of each cluster
+    indexed by the id of its representative, the member with the smallest id.
+    """
+    tweets = sorted(tweets, key=lambda tweet: tweet.id)
+    representatives = NearDuplicateClusterer(threshold=threshold).cluster([tweet.sanitized_text for tweet in tweets])
+    clusters = {}
+    for tweet, representative in zip(tweets, representatives):
+        clusters.setdefault(tweets[representative].id, []).append(tweet)
+    io.info(f'Near-duplicate clusters: {len(clusters):,} for {len(tweets):,} tweets '
+            f'({sum(len(members) > 1 for members in clusters.values()):,} with more than one tweet).')
+    return clusters
+
+
+def propagate_label(result: dict, members: list[Tweet], skip_ids: set[str]) -> list[dict]:
+    """
+    Copies the label of an evaluated tweet to the other members of its near-duplicate cluster
+    (except those in `skip_ids`), recording where the label comes from.
+    """
+    source_id = result.get('propagated_from', result['tweet_id'])
+    return [{**result,
+             'tweet_id': member.id,
+             'author_id': member.author_id,
+             'label_source': 'near_duplicate',
+             'propagated_from': source_id,
+             'cluster_size': len(members)}
+            for member in members
+            if member.id != result['tweet_id'] and member.id not in skip_ids]
+
+
+def cascade_labels(tweets: list[Tweet], eligible_tweets: list[Tweet], result_log: ResultLog,
+                   min_confidence: float, seed: int) -> tuple[list[dict], list[Tweet], dict[str, str]]:
+    """
+    First stage of the cascade. A hashed n-gram classifier is trained on the LLM labels of the
+    log (its agreement with them is reported on a held-out fifth) and labels the tweets it is
+    confident about.
+
+    Returns:
+        The classifier results, the tweets left to the LLM and the classifier label of those tweets.
+    """
+    id2tweet = {tweet.id: tweet for tweet in eligible_tweets}
+    labeled = [(id2tweet[result_item['tweet_id']].sanitized_text, result_item['llm_response'])
+               for result_item in result_log
+               if result_item.get('label_source', 'llm') == 'llm' and result_item['tweet_id'] in id2tweet]
+    assert len(labeled) >= 100, f'Only {len(labeled)} LLM labels found, not enough to train the cascade classifier.'
+    texts = [text for text, _ in labeled]
+    labels = [label for _, label in labeled]
+
+    order = np.random.default_rng(seed=seed).permutation(len(labeled))
+    held_out, training = order[:len(order) // 5], order[len(order) // 5:]
+    classifier = HashedNgramClassifier().fit([texts[k] for k in training], [labels[k] for k in training])
+    predicted, confidences = classifier.predict([texts[k] for k in held_out])
+    agree = np.array(predicted) == np.array([labels[k] for k in held_out])
+    confident = confidences >= min_confidence
+    io.info(f'Cascade classifier agreement with the LLM on {len(held_out):,} held-out tweets: {agree.mean():.1%} '
+            f'({agree[confident].mean() if confident.any() else float("nan"):.1%} on the {confident.mean():.1%} '
+            f'labeled with confidence >= {min_confidence}).')
+
+    classifier.fit(texts, labels)
+    predicted, confidences = classifier.predict([tweet.sanitized_text for tweet in tweets])
+    results, uncertain_tweets, uncertain_predictions = [], [], {}
+    for tweet, label, confidence in zip(tweets, predicted, confidences):
+        if confidence >= min_confidence:
+            results.append({
+                'llm_response': label,
+                'tweet_id': tweet.id,
+                'author_id': tweet.author_id,
+                'model': 'hashed-ngram-classifier',
+                'label_source': 'cascade',
+                'confidence': float(confidence),
+            })
+        else:
+            uncertain_tweets.append(tweet)
+            uncertain_predictions[tweet.id] = label
+    io.info(f'Cascade classifier labeled {len(results):,} of {len(tweets):,} tweets, '
+            f'LLM calls saved: {len(results) / max(1, len(tweets)):.1%}.')
+    return results, uncertain_tweets, uncertain_predictions
+
+
+# Hashtags of the per-hashtag plots of create_stance_plots.py, used to stratify the adaptive sample.
+STRATIFICATION_HASHTAGS = ['flutruxklan', 'holdtheline', 'honkhonk', 'truckerconvoy2022', 'istandwithtruckers']
+
+
+def tweet_stratum(tweet: Tweet) -> tuple[str, str]:
+    """
+    Stratum of a tweet for the adaptive sample: (day, first plotted hashtag of the tweet or 'other').
+    """
+    hashtags = set(tweet.hashtags)
+    hashtag = next((hashtag for hashtag in STRATIFICATION_HASHTAGS if hashtag in hashtags), 'other')
+    return tweet.created_at.date().isoformat(), hashtag
+
+
+def adaptive_batches(sampler: StratifiedSampler, id2tweet: dict[str, Tweet], max_calls: int, batch_size: int):
+    """
+    Yields the batches chosen by the sampler until every stratum converged or `max_calls`
+    tweets were scheduled.
+    """
+    calls = 0
+    while calls < max_calls and not sampler.converged:
+        batch = sampler.next_batch(min(batch_size, max_calls - calls))
+        if not batch:
+            break
+        calls += len(batch)
+        yield [id2tweet[tweet_id] for tweet_id in batch]
+
+    open_strata = [row for row in sampler.report() if not sampler.is_converged(row[0])]
+    io.info(f'Adaptive sample: {calls:,} tweets scheduled, {len(sampler.strata) - len(open_strata):,} of '
+            f'{len(sampler.strata):,} strata under the target interval width of {sampler.target_width}.')
+    for stratum, labeled, population, width in open_strata[:10]:
+        io.info(f'    {stratum}: {labeled:,} of {population:,} tweets labeled, interval width {width:.3f}')
+
+
+def run_main(output_file: str, log_file: str, store_file: str, queue_file: str, dead_letter_file: str,
+             sample_size: int, workers: int, budget_usd: Optional[float] = None,
+             dedupe_threshold: Optional[float] = None, cascade_confidence: Optional[float] = None,
+             target_width: Optional[float] = None, backend: Optional[str] = None) -> None:
+    BATCH_SIZE = 200
 
-    if os.path.exists(output_file):
-        with open(output_file, 'r', encoding='utf-8') as file:
-            results = json.load(file)
-
-    already_processed_tweet_ids = {result_item['tweet_id'] for result_item in results}
-    io.info(f'already processed elements:  {len(already_processed_tweet_ids)}')
+    SEED = 172027145
+    io.info(f'Using sample size: {sample_size}')
+    io.info(f'Script will store results in {log_file}')
 
+    eligible_tweets = load_tweets()
 
-    tweets = [tweet for tweet in tweets if tweet.id not in already_processed_tweet_ids]
-    io.info(f'Elements left to process:    {len(tweets)}')
+    # Results are checkpointed to an append-only log (fsync'ed once per batch). A JSON output
+    # from previous versions of the script is imported the first time the log is created.
+    result_log = ResultLog(log_file, fsync_every=BATCH_SIZE, legacy_filepath=output_file)
+    store = StanceResultStore(store_file)
+    reconcile_results(result_log, store)
 
+    already_processed_tweet_ids = {result_item['tweet_id'] for result_item in result_log}
+    io.info(f'already processed elements:  {len(already_processed_tweet_ids)}')
 
-    rng = np.random.default_rng(seed=SEED)
+    # Failed tweets are only retried with --reprocess-dead-letters.
+    dead_letters = DeadLetterQueue(dead_letter_file, id_key='tweet_id')
+    dead_letter_ids = set(dead_letters.ids())
+    io.info(f'elements in dead-letter queue: {len(dead_letter_ids)}')
 
-    rng.shuffle(tweets)
 
+    tweets = [tweet for tweet in eligible_tweets
+              if tweet.id not in already_processed_tweet_ids and tweet.id not in dead_letter_ids]
+    io.info(f'Elements left to process:    {len(tweets)}')
 
+    # With --dedupe only one representative per near-duplicate cluster is sent to the LLM, and
+    # its label is copied to the rest of the cluster. Tweets already labeled (or dead-lettered)
+    # are never given a propagated label: `skip_ids` is built once and grows as results are written.
+    clusters = {}
+    skip_ids = set()
+    if dedupe_threshold is not None:
+        assert workers == 1, 'Near-duplicate deduplication is only available with a single process.'
+        clusters = near_duplicate_clusters(eligible_tweets, dedupe_threshold)
+        tweet2representative = {member.id: representative for representative, members in clusters.items() for member in members}
+
+        # Clusters with a member evaluated by the LLM (e.g. from runs without --dedupe) get its label.
+        labeled_clusters = {}
+        for result_item in result_log:
+            if result_item.get('label_source', 'llm') != 'llm':
+                continue
+            representative = tweet2representative.get(result_item['tweet_id'])
+            if representative is not None and len(clusters[representative]) > 1:
+                labeled_clusters.setdefault(representative, result_item)
+        skip_ids = already_processed_tweet_ids | dead_letter_ids
+        propagated = [result
+                      for representative, result_item in labeled_clusters.items()
+                      for result in propagate_label(result_item, clusters[representative], skip_ids)]
+        for result in propagated:
+            result_log.append(result)
+            already_processed_tweet_ids.add(result['tweet_id'])
+            skip_ids.add(result['tweet_id'])
+        store.add_tweet_results(propagated, id2tweet={tweet.id: tweet for tweet in eligible_tweets})
+        io.info(f'Labels propagated from already evaluated tweets: {len(propagated):,}')
+
+        tweets = [tweet for tweet in tweets
+                  if tweet.id in clusters and tweet.id not in labeled_clusters and tweet.id not in already_processed_tweet_ids]
+        io.info(f'Cluster representatives left to process: {len(tweets)}')
+
+    # With --cascade a local classifier labels the tweets it is confident about, and only the
+    # uncertain ones are sent to the LLM.
+    uncertain_predictions = {}
+    if cascade_confidence is not None:
+        assert dedupe_threshold is None, '--cascade and --dedupe cannot be combined.'
+        cascade_results, tweets, uncertain_predictions = cascade_labels(tweets, eligible_tweets, result_log,
+                                                                        cascade_confidence, seed=SEED)
+        for result in cascade_results:
+            result_log.append(result)
+        result_log.sync()
+        store.add_tweet_results(cascade_results, id2tweet={tweet.id: tweet for tweet in eligible_tweets})
+
+    # The sample is the tweets with the smallest keyed hashes of their id, so it does not depend
+    # on the load order and extends the samples of previous runs. The adaptive sampler takes the
+    # tweets of each stratum in that order.
     sample_size=min(sample_size, len(tweets))
-    for i in range(0, sample_size, BATCH_SIZE):
-        batch = tweets[i:min(i+BATCH_SIZE, sample_size)]
-        io.info(f'len(batch)={len(batch)}       ({i} - {min(i+BATCH_SIZE, sample_size)})')
-        for tweet in batch:
-            result = detector.evaluate_tweet(tweet)
-            results.append(result)
+    tweets = HashSampler(key=SEED).sample(tweets, k=sample_size if target_width is None else None,
+                                          id_of=lambda tweet: tweet.id)
+    if workers > 1:
+        assert target_width is None, 'Adaptive sampling is only available with a single process.'
+        io.info(f'Evaluating tweets with {workers} worker processes.')
+        run_workers(tweets[:sample_size], eligible_tweets, queue_file, store_file, dead_letter_file, workers, budget_usd,
+                    backend)
+        reconcile_results(result_log, store)
+    else:
+        detector = OpenAIStanceDetector(budget_usd=budget_usd, backend=backend)
+        budget_exceeded = False
+        cascade_agreements = []
+        sampler = None
+        if target_width is not None:
+            # Adaptive sample: batches go to the day x hashtag strata with the widest intervals,
+            # and the run stops once they all are under the target (--sample-size caps the calls).
+            id2tweet = {tweet.id: tweet for tweet in eligible_tweets}
+            sampler = StratifiedSampler(
+                item2stratum={tweet.id: tweet_stratum(tweet) for tweet in tweets},
+                labeled_strata=[(tweet_stratum(id2tweet[result_item['tweet_id']]), result_item['llm_response'])
+                                for result_item in result_log
+                                if result_item['tweet_id'] in id2tweet and result_item.get('label_source') != 'cascade'],
+                target_width=target_width,
+            )
+            batches = adaptive_batches(sampler, id2tweet, sample_size, BATCH_SIZE)
+        else:
+            batches = (tweets[i:min(i+BATCH_SIZE, sample_size)] for i in range(0, sample_size, BATCH_SIZE))
+
+        for batch in batches:
+            io.info(f'len(batch)={len(batch)}')
+            batch_results = []
+            for tweet in batch:
+                try:
+                    result = evaluate_or_dead_letter(detector, tweet, dead_letters)
+                except BudgetExceededError as error:
+                    io.warning(f'{error} Stopping dispatch.')
+                    budget_exceeded = True
+                    break
+                if result is not None and sampler is not None:
+                    sampler.add_label(tweet_stratum(tweet), result['llm_response'])
+                if result is not None and tweet.id in uncertain_predictions:
+                    cascade_agreements.append(result['llm_response'] == uncertain_predictions[tweet.id])
+                if result is not None:
+                    if tweet.id in clusters and len(clusters[tweet.id]) > 1:
+                        result = {**result, 'label_source': 'llm', 'cluster_size': len(clusters[tweet.id])}
+                        propagated = propagate_label(result, clusters[tweet.id], skip_ids)
+                    else:
+                        propagated = []
+                    for item in [result] + propagated:
+                        result_log.append(item)
+                        batch_results.append(item)
+                        skip_ids.add(item['tweet_id'])
+
+            batch_tweets = [member for tweet in batch for member in clusters.get(tweet.id, [tweet])]
+            store.add_tweet_results(batch_results, id2tweet={tweet.id: tweet for tweet in batch_tweets})
+            if budget_exceeded:
+                break
+        if cascade_agreements:
+            io.info(f'Cascade classifier agreement with the LLM on {len(cascade_agreements):,} uncertain tweets: '
+                    f'{np.mean(cascade_agreements):.1%}')
+        detector.log_usage_summary()
+
+    result_log.close()
+    store.close()
+    dead_letters.close()
+    io.info('Results saved to disk.')
 
-        # Save results after each batch
-        with open(output_file, "w", encoding='utf-8') as f:
-            json.dump(results, f, indent=4)
+    compact(output_file, log_file)
 
-    io.info('Results saved to disk.')
+def run_pipeline(output_file: str, log_file: str, store_file: str, dead_letter_file: str, sample_size: int,
+                 sample_rate: Optional[float], concurrency: int, budget_usd: Optional[float] = None,
+                 backend: Optional[str] = None) -> None:
+    """
+    Evaluates tweets with a staged pipeline (load -> filter -> sanitize -> prompt -> LLM -> write)
+    connected by bounded queues, so the LLM calls start as soon as the first dataset file is read.
 
-def count(output_file: str) -> None:
-    count_no = 0
-    neutral_count = 0
-    right_count = 0
-    left_count = 0
-    if os.path.exists(output_file):
-
-        with open(output_file, 'r', encoding='utf-8') as file:
-            results = json.load(file)
-        count_no = len(results)
-        right_count = len([result for result in results if result['llm_response'] == 'right'])
-        neutral_count = len([result for result in results if result['llm_response'] == 'neutral'])
-        left_count = len([result for result in results if result['llm_response'] == 'left'])
+    The sample is streamed: the eligible tweets whose keyed hash falls below `sample_rate` are
+    evaluated, in the order they are read, up to `sample_size` tweets. Without `sample_rate`, the
+    rate is derived from `sample_size` and the eligible tweets left (counted in a first pass over
+    the dataset), so the sample is the same as without --pipeline.
+    """
+    SEED = 172027145
+
+    result_log = ResultLog(log_file, fsync_every=200, legacy_filepath=output_file)
+    store = StanceResultStore(store_file)
+    reconcile_results(result_log, store)
+    skip_ids = {result_item['tweet_id'] for result_item in result_log}
+    dead_letters = DeadLetterQueue(dead_letter_file, id_key='tweet_id')
+    skip_ids.update(dead_letters.ids())
+    io.info(f'Tweets already processed or dead-lettered: {len(skip_ids):,}')
+
+    hash_sampler = HashSampler(key=SEED)
+    if sample_rate is None:
+        # The sample without --pipeline is the `sample_size` eligible tweets left with the smallest
+        # keyed hashes: the rate keeps every tweet up to the hash fraction of the last of them.
+        eligible_ids = {tweet.id for tweet in ConvoyProtestDataset.iter_tweets(data_type=DatasetType.ALL, removed_repeated=True)
+                        if tweet.id not in skip_ids and is_eligible(tweet)}
+        sample_rate = hash_sampler.rate(eligible_ids, k=sample_size)
+        io.info(f'Eligible tweets left: {len(eligible_ids):,}, sample rate: {sample_rate:.6g}')
+
+    detector = OpenAIStanceDetector(budget_usd=budget_usd, backend=backend)
+    accepted = [0]
+
+    def select(tweet: Tweet) -> Optional[Tweet]:
+        # Single worker: the count of accepted tweets needs no lock.
+        if accepted[0] >= sample_size or tweet.id in skip_ids or not is_eligible(tweet):
+            return None
+        if hash_sampler.fraction(tweet.id) >= sample_rate:
+            return None
+        skip_ids.add(tweet.id)
+        accepted[0] += 1
+        return tweet
+
+    def evaluate(item: tuple[Tweet, str]) -> tuple[Tweet, object]:
+        # Failures are passed on to the writer, which owns the dead-letter queue.
+        tweet, user_content = item
+        try:
+            return tweet, detector.evaluate_tweet(tweet, user_content=user_content)
+        except FATAL_ERRORS:
+            raise
+        except Exception as error:
+            return tweet, error
+
+    evaluated = [0]
+
+    def write(item: tuple[Tweet, object]) -> None:
+        tweet, result = item
+        if isinstance(result, Exception):
+            io.error(f'Evaluation of tweet {tweet.id} failed ({type(result).__name__}: {result}), added to the dead-letter queue.')
+            dead_letters.add(tweet.id, result)
+            return
+        result_log.append(result)
+        store.add_tweet_results([result], id2tweet={tweet.id: tweet})
+        evaluated[0] += 1
+        if evaluated[0] % 200 == 0:
+            io.info(f'Evaluated {evaluated[0]:,} tweets.')
+
+    pipeline = Pipeline([
+        Stage('filter', select),
+        Stage('sanitize', lambda tweet: (tweet, tweet.sanitized_text)),
+        Stage('prompt', lambda item: (item[0], OpenAIStanceDetector.format_evaluate_tweet_text_prompt(item[1]))),
+        Stage('llm', evaluate, workers=concurrency),
+    ], queue_size=4 * concurrency)
+    try:
+        stats = pipeline.run(ConvoyProtestDataset.iter_tweets(data_type=DatasetType.ALL, removed_repeated=True), sink=write)
+        io.info(f'Pipeline: {stats.get("source", 0):,} tweets read, {stats.get("filter", 0):,} selected, '
+                f'{stats["sink"]:,} written, first result after {stats["first_item_seconds"] or 0:.1f}s.')
+    except BudgetExceededError as error:
+        io.warning(f'{error} Stopped the pipeline.')
+    detector.log_usage_summary()
+
+    result_log.close()
+    store.close()
+    dead_letters.close()
+    io.info(f'Finished processing tweets, computed {evaluated[0]} results.')
+
+    compact(output_file, log_file)
+
+
+def count(output_file: str, log_file: str, store_file: str) -> None:
+    with StanceResultStore(store_file) as store:
+        with ResultLog(log_file, legacy_filepath=output_file) as result_log:
+            reconcile_results(result_log, store)
+        counts = store.counts_by('label_source', 'stance')
+    count_no = sum(counts.values())
     io.info(f'No of results found: {count_no}')
-    io.info(f'No of left found:    {left_count}')
-    io.info(f'No of neutral found: {neutral_count}')
-    io.info(f'No of right found:   {right_count}')
+    # Labels propagated to near-duplicates or given by the local classifier are reported apart
+    # from those of the LLM.
+    for label_source in sorted({label_source for label_source, _ in counts}):
+        source_count = sum(count for (source, _), count in counts.items() if source == label_source)
+        io.info(f'Labels from {label_source}: {source_count}')
+        io.info(f'    No of left found:    {counts.get((label_source, "left"), 0)}')
+        io.info(f'    No of neutral found: {counts.get((label_source, "neutral"), 0)}')
+        io.info(f'    No of right found:   {counts.get((label_source, "right"), 0)}')
 
 def main():
     config = PathsHandler()
     output_file = config.get_path('tweet-evaluation-output')
+    log_file = config.get_path('tweet-evaluation-log')
+    store_file = config.get_path('stance-result-store')
+    queue_file = config.get_path('stance-work-queue')
+    dead_letter_file = config.get_path('tweet-dead-letter-queue')
     io.info('Starting script evaluate_stance_users.py ...')
     parser = argparse.ArgumentParser(description="A script with a --clean option.")
     parser.add_argument("--clean", action="store_true", help="Clean up files instead of running main logic.")
     parser.add_argument("--count", action="store_true", help="Count how many response we have stored in the output file.")
     parser.add_argument("--compute", action="store_true", help="Compute the stance of the tweets.")
+    parser.add_argument("--compact", action="store_true", help="Rewrite the JSONL result log as the JSON output file.")
+    parser.add_argument("--sync-store", action="store_true", help="Load the JSONL result log into the stance result store.")
+    parser.add_argument("--reprocess-dead-letters", action="store_true", help="Evaluate again the tweets that failed in previous runs.")
     parser.add_argument("--sample-size", type=int, default=1000, help="Number of tweets to sample for computation (used with --compute).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes sharing a work queue (used with --compute).")
+    parser.add_argument("--dedupe", action="store_true", help="Send one tweet per near-duplicate cluster to the LLM and copy its label to the cluster (used with --compute).")
+    parser.add_argument("--dedupe-threshold", type=float, default=0.8, help="Minimum estimated Jaccard similarity of near-duplicate tweets (used with --dedupe).")
+    parser.add_argument("--cascade", action="store_true", help="Label confident tweets with a local classifier trained on the LLM labels, and send only the rest to the LLM (used with --compute).")
+    parser.add_argument("--cascade-confidence", type=float, default=0.9, help="Minimum classifier probability to accept its label (used with --cascade).")
+    parser.add_argument("--target-width", type=float, default=None, help="Sample adaptively by day x hashtag until every stance proportion has a 95%% interval narrower than this (--sample-size caps the calls, used with --compute).")
+    parser.add_argument("--pipeline", action="store_true", help="Stream the dataset through a staged pipeline, evaluating the tweets while they are loaded (used with --compute).")
+    parser.add_argument("--sample-rate", type=float, default=None, help="Fraction of the eligible tweets sampled by their keyed hash (used with --pipeline, derived from --sample-size by default to match the sample without --pipeline).")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent LLM calls (used with --pipeline).")
+    parser.add_argument("--budget-usd", type=float, default=None, help="Stop sending requests before spending more than this amount (overrides the configured budget).")
+    parser.add_argument("--llm-backend", choices=['openai', 'record', 'replay', 'mock'], default=None, help="Backend of the LLM calls, overrides the configured llm-backend (record and replay runs write to their own output files).")
 
     args = parser.parse_args()
+    if args.pipeline and (args.dedupe or args.cascade or args.target_width is not None or args.workers != 1):
+        parser.error('--pipeline cannot be combined with --dedupe, --cascade, --target-width or --workers.')
+
+    # Record and replay runs keep their own results, log, store, queue and dead-letter queue.
+    backend = args.llm_backend or config.get_variable('openai-tweet-stance-detector-configuration')['llm-backend']
+    if args.compute and backend == 'replay':
+        start_replay_run(output_file, log_file, store_file, queue_file, dead_letter_file)
+    output_file, log_file, store_file, queue_file, dead_letter_file = (
+        run_filepath(filepath, backend) for filepath in (output_file, log_file, store_file, queue_file, dead_letter_file))
 
     if args.clean:
-        clean(output_file)
+        clean(output_file, log_file, store_file)
     elif args.count:
-        count(output_file)
+        count(output_file, log_file, store_file)
+    elif args.compute and args.pipeline:
+        run_pipeline(output_file, log_file, store_file, dead_letter_file, sample_size=args.sample_size,
+                     sample_rate=args.sample_rate, concurrency=args.concurrency, budget_usd=args.budget_usd,
+                     backend=backend)
     elif args.compute:
-        run_main(output_file, sample_size=args.sample_size)
+        run_main(output_file, log_file, store_file, queue_file, dead_letter_file,
+                 sample_size=args.sample_size, workers=args.workers, budget_usd=args.budget_usd,
+                 dedupe_threshold=args.dedupe_threshold if args.dedupe else None,
+                 cascade_confidence=args.cascade_confidence if args.cascade else None,
+                 target_width=args.target_width, backend=backend)
+    elif args.compact:
+        compact(output_file, log_file)
+    elif args.sync_store:
+        sync_store(output_file, log_file, store_file)
+    elif args.reprocess_dead_letters:
+        reprocess_dead_letters(output_file, log_file, store_file, dead_letter_file, budget_usd=args.budget_usd,
+                               backend=backend)
     else:
-        raise ValueError("Please provide --clean, --count, or --compute argument.")
+        raise ValueError("Please provide --clean, --count, --compute, --compact, --sync-store or --reprocess-dead-letters argument.")
     
     io.info('Finishing script evaluate_stance_users.py ...')
 
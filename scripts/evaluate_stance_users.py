@@ -1,35 +1,86 @@
 import argparse
+import multiprocessing
 import numpy as np
-import json
 import os
+import shutil
+import socket
 import sys
+import time
 sys.path.append('..')
 from datetime import datetime
+from typing import Optional
 from src import io
 from src.convoy_protest_dataset import DatasetType
 from src.convoy_protest_dataset import ConvoyProtestDataset
+from src.dead_letter_queue import DeadLetterQueue
+from src.hash_sampler import HashSampler
 from src.paths_handler import PathsHandler
+from src.result_log import ResultLog
+from src.stance_result_store import StanceResultStore
 from src.tweet import Tweet
+from src.work_queue import WorkQueue
 from collections import Counter
+from core.cassette import run_filepath
+from core.concurrent_evaluation import evaluate_concurrently
 from core.llms import OpenAIStanceDetector
+from core.retry import FATAL_ERRORS
+from core.usage_metrics import BudgetExceededError
 
 
-def clean(output_file: str):
-    # Ask for confirmation before removing the file
-    confirmation = input(f"Are you sure you want to delete '{output_file}'? [y/N]: ").strip().lower()
+def clean(output_file: str, log_file: str, store_file: str):
+    # Ask for confirmation before removing the files
+    confirmation = input(f"Are you sure you want to delete '{output_file}', '{log_file}' and the user results in '{store_file}'? [y/N]: ").strip().lower()
     if confirmation == 'y':
         io.info("Cleaning up files...")
-        os.remove(output_file)
-        io.info(f"'{output_file}' has been deleted.")
+        for filename in [output_file, log_file]:
+            if os.path.exists(filename):
+                os.remove(filename)
+                io.info(f"'{filename}' has been deleted.")
+        with StanceResultStore(store_file) as store:
+            store.clear_user_results()
+        io.info(f"User results in '{store_file}' have been deleted.")
     else:
         io.info("Cleanup aborted by user.")
 
 
 
-def run_main(output_file: str):
-    SAMPLE_SIZE = 100
-    SEED=2916376554
-
+def start_replay_run(output_file: str, log_file: str, store_file: str, queue_file: str, dead_letter_file: str) -> None:
+    """
+    Removes the results of the previous replay runs and copies the dead-letter queue of the record
+    run, so a replay evaluates the users the record run evaluated (given the same arguments). The
+    paths are those of the real outputs (see `run_filepath`).
+    """
+    for filename in (output_file, log_file, dead_letter_file):
+        if os.path.exists(run_filepath(filename, 'replay')):
+            os.remove(run_filepath(filename, 'replay'))
+    with StanceResultStore(run_filepath(store_file, 'replay')) as store:
+        store.clear_user_results()
+    with WorkQueue(run_filepath(queue_file, 'replay'), queue_name='users') as queue:
+        queue.clear()
+    if os.path.exists(run_filepath(dead_letter_file, 'record')):
+        shutil.copyfile(run_filepath(dead_letter_file, 'record'), run_filepath(dead_letter_file, 'replay'))
+    io.info(f'Replay run: results are written to {run_filepath(log_file, "replay")}')
+
+
+def compact(output_file: str, log_file: str) -> None:
+    with ResultLog(log_file, legacy_filepath=output_file) as result_log:
+        count_no = result_log.compact(output_file)
+    io.info(f'Compacted {count_no:,} results from {log_file} into {output_file}')
+
+
+def sync_store(output_file: str, log_file: str, store_file: str) -> None:
+    """
+    Loads every result of the log into the result store.
+    """
+    with StanceResultStore(store_file) as store:
+        count_no = store.add_user_results(ResultLog(log_file, legacy_filepath=output_file))
+    io.info(f'Synchronized {count_no:,} results from {log_file} into {store_file}')
+
+
+def load_tweets() -> list[Tweet]:
+    """
+    Loads the tweets used to evaluate users (in the date range, no retweets, no URLs).
+    """
     # ========== Retrieve all tweets: ==========
     _, tweets, _ = ConvoyProtestDataset.get_dataset(data_type=DatasetType.ALL, removed_repeated=True)
     io.info(f'Len unique tweets:                         {len(tweets):,}')
@@ -49,57 +100,278 @@ def run_main(output_file: str):
     tweets = [tweet for tweet in tweets if len(tweet.urls)==0]
     io.info(f'Tweet count with tweets with urls removed: {len(tweets):,}')
 
+    return tweets
+
 
-    detector = OpenAIStanceDetector()
+def group_by_author(tweets: list[Tweet], author_ids: Optional[set[str]] = None) -> dict[str, list[Tweet]]:
+    """
+    Groups the tweets by author in one pass (only the tweets of `author_ids`, if given).
+    """
+    author2tweets = {}
+    for tweet in tweets:
+        if author_ids is None or tweet.author_id in author_ids:
+            author2tweets.setdefault(tweet.author_id, []).append(tweet)
+    return author2tweets
 
 
-    author_ids = {author_id for author_id, count in
-                  Counter([tweet.author_id for tweet in tweets ]).items()
-                  if count>=detector.max_tweet_count}
+def evaluate_or_dead_letter(detector: OpenAIStanceDetector, tweets_from_user: list[Tweet],
+                            dead_letters: DeadLetterQueue) -> Optional[dict]:
+    """
+    Evaluates a user. If it still fails after retrying, the user is recorded in the dead-letter
+    queue (to be reprocessed later with --reprocess-dead-letters) and None is returned.
+    """
+    author_id = tweets_from_user[0].author_id
+    try:
+        result = detector.evaluate_user(tweets_from_user)
+    except FATAL_ERRORS:
+        raise
+    except Exception as error:
+        io.error(f'Evaluation of user {author_id} failed ({type(error).__name__}: {error}), added to the dead-letter queue.')
+        dead_letters.add(author_id, error)
+        return None
+    assert result['author_id'] == author_id
+    return result
+
+
+def reconcile_results(result_log: ResultLog, store: StanceResultStore) -> None:
+    """
+    Brings the log and the result store back in sync (see `StanceResultStore.reconcile_user_log`).
+    """
+    appended, added = store.reconcile_user_log(result_log)
+    if appended:
+        io.info(f'Appended {appended:,} results from the result store to the log.')
+    if added:
+        io.info(f'Added {added:,} results from the log to the result store.')
+
+
+def worker_main(worker_id: str, worker: int, author2tweets: dict[str, list[Tweet]], queue_file: str, store_file: str,
+                dead_letter_file: str, budget_usd: Optional[float] = None, backend: Optional[str] = None) -> None:
+    """
+    Evaluates users claimed from the work queue until the queue is empty (or the budget of the
+    worker is spent, in which case its unevaluated users are given back to the queue).
+
+    Results are written to the result store before the claimed users are marked as done, so a
+    worker killed at any point leaves its users to be claimed again once its leases expire.
+    Users already found in the store are not sent to the LLM again, and users that fail are
+    completed after being recorded in the dead-letter queue. The dead-letter queue, usage log and
+    cassette of the worker are written to its own shard of these files (see `merge_worker_logs`).
+    """
+    CLAIM_SIZE = 2
+    LEASE_SECONDS = 600
+    POLL_SECONDS = 30
+
+    detector = OpenAIStanceDetector(budget_usd=budget_usd, backend=backend, worker=worker)
+    queue = WorkQueue(queue_file, queue_name='users')
+    store = StanceResultStore(store_file)
+    dead_letters = DeadLetterQueue(ResultLog.shard_filepath(dead_letter_file, worker), id_key='author_id')
+
+    while True:
+        author_ids = queue.claim(worker_id, max_items=CLAIM_SIZE, lease_seconds=LEASE_SECONDS)
+        if not author_ids:
+            if queue.remaining() == 0:
+                break
+            # Remaining users are leased by other workers, wait until they finish or their leases expire.
+            time.sleep(POLL_SECONDS)
+            continue
+
+        already_stored = store.get_many_users(author_ids)
+        results = []
+        processed_ids = []
+        budget_exceeded = False
+        for k, author_id in enumerate(author_ids):
+            # Extends the lease of the users still to evaluate, so a slow worker keeps them. A
+            # user whose lease expired and was claimed by another worker is left to that worker.
+            if author_id not in queue.renew(worker_id, author_ids[k:], lease_seconds=LEASE_SECONDS):
+                io.warning(f'[{worker_id}] user {author_id} was claimed by another worker, skipping it.')
+                continue
+            if author_id not in already_stored:
+                try:
+                    result = evaluate_or_dead_letter(detector, author2tweets[author_id], dead_letters)
+                except BudgetExceededError as error:
+                    io.warning(f'[{worker_id}] {error} Stopping dispatch.')
+                    budget_exceeded = True
+                    break
+                if result is not None:
+                    results.append(result)
+            processed_ids.append(author_id)
+        store.add_user_results(results)
+        queue.complete(worker_id, processed_ids)
+        io.info(f'[{worker_id}] evaluated {len(results)} users, {queue.remaining():,} left in the queue.')
+        if budget_exceeded:
+            queue.release(worker_id, author_ids)
+            break
+
+    detector.log_usage_summary()
+    queue.close()
+    store.close()
+    dead_letters.close()
+
+
+def merge_worker_logs(dead_letter_file: str) -> None:
+    """
+    Merges the shards of the dead-letter queue, usage log and cassette written by the worker
+    processes (each worker appends to its own shard, see `ResultLog.shard_filepath`).
+    """
+    config = PathsHandler()
+    for filepath in (dead_letter_file, config.get_path('llm-usage-log'), config.get_path('llm-cassette')):
+        with ResultLog(filepath, fsync_every=1000) as log:
+            merged = log.merge_shards()
+        if merged:
+            io.info(f'Merged {merged:,} entries of the worker shards into {filepath}')
+
+
+def run_workers(sample: list[str], tweets: list[Tweet], queue_file: str, store_file: str, dead_letter_file: str,
+                workers: int, budget_usd: Optional[float] = None, backend: Optional[str] = None) -> None:
+    """
+    Evaluates a sample of users with several worker processes sharing a work queue. The budget
+    (if any) is split evenly between the workers.
+
+    If the queue still holds unfinished users (a previous run was interrupted), those are
+    resumed instead of enqueuing the new sample.
+    """
+    queue = WorkQueue(queue_file, queue_name='users')
+    if queue.remaining() == 0:
+        queue.purge_done()
+        enqueued = queue.enqueue(sample)
+        io.info(f'Enqueued {enqueued:,} users.')
+    else:
+        io.info(f'Resuming {queue.remaining():,} unfinished users found in {queue_file}.')
+
+    remaining_ids = set(queue.remaining_ids())
+    author2tweets = group_by_author(tweets, remaining_ids)
+    assert len(author2tweets) == len(remaining_ids), 'Work queue contains users without tweets.'
+
+    run_id = f'{socket.gethostname()}-{os.getpid()}'
+    context = multiprocessing.get_context('spawn')
+    worker_budget_usd = budget_usd / workers if budget_usd is not None else None
+    processes = [context.Process(target=worker_main,
+                                 args=(f'{run_id}-{k}', k, author2tweets, queue_file, store_file, dead_letter_file, worker_budget_usd,
+                                       backend))
+                 for k in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    merge_worker_logs(dead_letter_file)
+
+    if queue.remaining() == 0:
+        queue.purge_done()
+    else:
+        io.warning(f'{queue.remaining():,} users were not evaluated, run the script again to resume them.')
+    queue.close()
 
-    io.info(f'Number of users with more than {detector.max_tweet_count} tweets = {len(author_ids)}.')
 
-    results = []
+def reprocess_dead_letters(output_file: str, log_file: str, store_file: str, dead_letter_file: str,
+                           budget_usd: Optional[float] = None, backend: Optional[str] = None) -> None:
+    """
+    Evaluates again the users of the dead-letter queue. Users evaluated successfully are
+    removed from the queue; users that fail again stay in it.
+    """
+    dead_letters = DeadLetterQueue(dead_letter_file, id_key='author_id')
+    failed_ids = set(dead_letters.ids())
+    io.info(f'Users in the dead-letter queue: {len(failed_ids):,}')
 
-    if os.path.exists(output_file):
-        with open(output_file, 'r', encoding='utf-8') as file:
-            results = json.load(file)
+    author2tweets = group_by_author(load_tweets(), failed_ids)
 
-    already_proccessed_ids = {result_item['author_id'] for result_item in results}
-    
-    io.info(f'elements to process:         {len(author_ids)}')
-    io.info(f'already processed elements:  {len(already_proccessed_ids)}')
-    author_ids = list(author_ids.difference(already_proccessed_ids))
-    io.info(f'Elements left to process:    {len(author_ids)}')
+    result_log = ResultLog(log_file, fsync_every=10, legacy_filepath=output_file)
+    store = StanceResultStore(store_file)
+    already_proccessed_ids = {result_item['author_id'] for result_item in result_log}
 
+    detector = OpenAIStanceDetector(budget_usd=budget_usd, backend=backend)
+    results = []
+    for author_id in dead_letters.ids():
+        if author_id in already_proccessed_ids:
+            continue
+        try:
+            result = evaluate_or_dead_letter(detector, author2tweets[author_id], dead_letters)
+        except BudgetExceededError as error:
+            io.warning(f'{error} Stopping dispatch.')
+            break
+        if result is not None:
+            result_log.append(result)
+            store.add_user_results([result])
+            results.append(result)
+    detector.log_usage_summary()
+
+    dead_letters.remove(already_proccessed_ids.union(result['author_id'] for result in results))
+    io.info(f'Recovered {len(results):,} users, {len(dead_letters):,} left in the dead-letter queue.')
+    dead_letters.close()
+    result_log.close()
+    store.close()
+
+    compact(output_file, log_file)
+
+
+def run_main(output_file: str, log_file: str, store_file: str, queue_file: str, dead_letter_file: str, workers: int,
+             sample_size: int = 100, concurrency: int = 1, budget_usd: Optional[float] = None,
+             backend: Optional[str] = None):
+    SEED=2916376554
 
-    rng = np.random.default_rng(seed=SEED)
+    tweets = load_tweets()
+    author2tweets = group_by_author(tweets)
 
-    rng.shuffle(author_ids)
+    # The detector is only built by the process that calls the LLM (each worker builds its own).
+    max_tweet_count = PathsHandler().get_variable('openai-tweet-stance-detector-configuration')['user-timeline-max-tweet-count']
+    author_ids = {author_id for author_id, tweets_from_user in author2tweets.items()
+                  if len(tweets_from_user)>=max_tweet_count}
 
-    SAMPLE_SIZE=min(SAMPLE_SIZE, len(author_ids))
-    for author_id in author_ids[:SAMPLE_SIZE]:
-        tweets_from_user = [tweet for tweet in tweets if tweet.author_id==author_id]
-        result = detector.evaluate_user(tweets_from_user)
-        assert result['author_id'] == author_id
-        results.append(result)
+    io.info(f'Number of users with more than {max_tweet_count} tweets = {len(author_ids)}.')
 
-    io.info(f'Finished processing users, computed {len(results)} results.')
-    with open(output_file, "w", encoding='utf-8') as f:
-        json.dump(results, f, indent=4)
+    # Every user result is appended to the log as soon as it is computed, so a crash only
+    # loses the user being evaluated. Results from an older JSON output are imported first.
+    result_log = ResultLog(log_file, fsync_every=10, legacy_filepath=output_file)
+    store = StanceResultStore(store_file)
+    reconcile_results(result_log, store)
 
-    io.info('Results saved to disk.')
+    already_proccessed_ids = {result_item['author_id'] for result_item in result_log}
+
+    # Failed users are only retried with --reprocess-dead-letters.
+    dead_letters = DeadLetterQueue(dead_letter_file, id_key='author_id')
+    dead_letter_ids = set(dead_letters.ids())
+    
+    io.info(f'elements to process:         {len(author_ids)}')
+    io.info(f'already processed elements:  {len(already_proccessed_ids)}')
+    io.info(f'elements in dead-letter queue: {len(dead_letter_ids)}')
+    author_ids = author_ids.difference(already_proccessed_ids).difference(dead_letter_ids)
+    io.info(f'Elements left to process:    {len(author_ids)}')
 
-def count(output_file: str) -> None:
-    counter = {}
-    length = 0
-    if os.path.exists(output_file):
+    # Users with the smallest keyed hashes of their id (independent of the set order). An
+    # interrupted run is resumed by running it again: evaluated users are skipped and the sample
+    # is completed with the next users in the same order.
+    sample_size=min(sample_size, len(author_ids))
+    author_ids = HashSampler(key=SEED).sample(author_ids, k=sample_size)
+    computed = 0
+    if workers > 1:
+        io.info(f'Evaluating users with {workers} worker processes.')
+        run_workers(author_ids, tweets, queue_file, store_file, dead_letter_file, workers, budget_usd, backend)
+        reconcile_results(result_log, store)
+        computed = len(author_ids)
+    else:
+        # Results are written as soon as they arrive, so an interruption only loses the calls in flight.
+        io.info(f'Evaluating users with {concurrency} concurrent calls.')
+        detector = OpenAIStanceDetector(budget_usd=budget_usd, backend=backend)
+        for result in evaluate_concurrently(detector, author_ids, author2tweets, dead_letters, concurrency):
+            result_log.append(result)
+            store.add_user_results([result])
+            computed += 1
+            if computed % 100 == 0:
+                io.info(f'Evaluated {computed:,} of {sample_size:,} users.')
+        detector.log_usage_summary()
+
+    result_log.close()
+    store.close()
+    dead_letters.close()
+    io.info(f'Finished processing users, computed {computed} results.')
+    io.info('Results saved to disk.')
 
-        with open(output_file, 'r', encoding='utf-8') as file:
-            results = json.load(file)
+    compact(output_file, log_file)
 
-        counter = Counter([result['llm_response']['score'] for result in results])
-        length = len(results)
+def count(output_file: str, log_file: str, store_file: str) -> None:
+    with StanceResultStore(store_file) as store:
+        with ResultLog(log_file, legacy_filepath=output_file) as result_log:
+            reconcile_results(result_log, store)
+        counter = Counter({score: count for (score,), count in store.user_counts_by('score').items()})
+    length = sum(counter.values())
     io.info(f'Count of results: {length}')
     io.info(f'Count of results: {counter}')
         
@@ -107,7 +379,10 @@ def main():
     config = PathsHandler()
 
     output_file = config.get_path('user-evaluation-output')
-    io.info(f'Script will store results in {output_file}')
+    log_file = config.get_path('user-evaluation-log')
+    store_file = config.get_path('stance-result-store')
+    queue_file = config.get_path('stance-work-queue')
+    dead_letter_file = config.get_path('user-dead-letter-queue')
 
     io.info('Starting script evaluate_stance_users.py ...')
     parser = argparse.ArgumentParser(description="A script with a --clean option.")
@@ -115,17 +390,42 @@ def main():
     parser.add_argument("--clean", action="store_true", help="Clean up files instead of running main logic.")
     parser.add_argument("--count", action="store_true", help="Count how many response we have stored in the output file.")
     parser.add_argument("--compute", action="store_true", help="Compute the stance of the tweets.")
+    parser.add_argument("--compact", action="store_true", help="Rewrite the JSONL result log as the JSON output file.")
+    parser.add_argument("--sync-store", action="store_true", help="Load the JSONL result log into the stance result store.")
+    parser.add_argument("--reprocess-dead-letters", action="store_true", help="Evaluate again the users that failed in previous runs.")
+    parser.add_argument("--sample-size", type=int, default=100, help="Number of users to evaluate (used with --compute).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes sharing a work queue (used with --compute).")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent LLM calls of a single process (used with --compute).")
+    parser.add_argument("--budget-usd", type=float, default=None, help="Stop sending requests before spending more than this amount (overrides the configured budget).")
+    parser.add_argument("--llm-backend", choices=['openai', 'record', 'replay', 'mock'], default=None, help="Backend of the LLM calls, overrides the configured llm-backend (record and replay runs write to their own output files).")
 
     args = parser.parse_args()
 
+    # Record and replay runs keep their own results, log, store, queue and dead-letter queue.
+    backend = args.llm_backend or config.get_variable('openai-tweet-stance-detector-configuration')['llm-backend']
+    if args.compute and backend == 'replay':
+        start_replay_run(output_file, log_file, store_file, queue_file, dead_letter_file)
+    output_file, log_file, store_file, queue_file, dead_letter_file = (
+        run_filepath(filepath, backend) for filepath in (output_file, log_file, store_file, queue_file, dead_letter_file))
+    io.info(f'Script will store results in {log_file}')
+
     if args.clean:
-        clean(output_file)
+        clean(output_file, log_file, store_file)
     elif args.compute:
-        run_main(output_file)
+        run_main(output_file, log_file, store_file, queue_file, dead_letter_file, workers=args.workers,
+                 sample_size=args.sample_size, concurrency=args.concurrency, budget_usd=args.budget_usd,
+                 backend=backend)
     elif args.count:
-        count(output_file)
+        count(output_file, log_file, store_file)
+    elif args.compact:
+        compact(output_file, log_file)
+    elif args.sync_store:
+        sync_store(output_file, log_file, store_file)
+    elif args.reprocess_dead_letters:
+        reprocess_dead_letters(output_file, log_file, store_file, dead_letter_file, budget_usd=args.budget_usd,
+                               backend=backend)
     else:
-        raise ValueError("Invalid argument. Use --clean, --count, or --compute.")
+        raise ValueError("Invalid argument. Use --clean, --count, --compute, --compact, --sync-store or --reprocess-dead-letters.")
     
     io.info('Finishing script evaluate_stance_users.py ...')
 
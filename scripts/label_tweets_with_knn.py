@@ -0,0 +1,81 @@
+"""
+Labels every tweet of the corpus with the kNN vote of its nearest LLM-labeled tweets in the
+embedding space (embeddings built by create_tweet_embeddings.py, see src/knn_classifier.py).
+
+A held-out share of the tweets labeled by OpenAIStanceDetector is left out of the neighbours to
+report the agreement of the kNN labels with the LLM labels (overall and per LLM label). The
+label and confidence of every tweet are then predicted from all the LLM labels, in batches read
+from the memory-mapped embeddings, and saved to a CSV file.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append('..')
+from src import io
+from src.embedding_index import load_embeddings
+from src.hash_sampler import HashSampler
+from src.knn_classifier import KNNStanceClassifier
+from src.paths_handler import PathsHandler
+from src.stance_result_store import StanceResultStore
+
+
+SEED = 2890175563
+
+
+def main():
+    config = PathsHandler()
+    embedding_config = config.get_variable('embedding-index-configuration')
+    embeddings_folder = config.get_path('tweet-embeddings-folder')
+    store_file = config.get_path('stance-result-store')
+    output_file = config.get_path('knn-stance-output')
+
+    io.info('Starting script label_tweets_with_knn.py ...')
+    parser = argparse.ArgumentParser(description="Label the corpus by kNN vote of the LLM-labeled tweets.")
+    parser.add_argument("--k", type=int, default=embedding_config['knn-neighbours'], help="Number of neighbours voting.")
+    parser.add_argument("--holdout", type=float, default=0.1, help="Share of the LLM labels held out to measure the agreement.")
+    parser.add_argument("--n-lists", type=int, default=None, help="Search the labeled tweets with an IVF index of this many lists (exact search by default).")
+    parser.add_argument("--batch-size", type=int, default=4096, help="Tweets labeled per batch.")
+    args = parser.parse_args()
+
+    ids, vectors = load_embeddings(embeddings_folder)
+    id2row = {tweet_id: row for row, tweet_id in enumerate(ids)}
+    with StanceResultStore(store_file) as store:
+        id2label = {result['tweet_id']: result['llm_response'] for result in store.iter_tweet_results()
+                    if result.get('label_source', 'llm') == 'llm' and result['tweet_id'] in id2row}
+    io.info(f'{len(ids):,} embedded tweets, {len(id2label):,} labeled by the LLM.')
+
+    def classifier(labeled_ids):
+        rows = np.sort([id2row[tweet_id] for tweet_id in labeled_ids])
+        return KNNStanceClassifier(k=args.k, n_lists=args.n_lists, nprobe=embedding_config['nprobe'],
+                                   batch_size=args.batch_size, seed=embedding_config['seed']).fit(
+            vectors[rows], [id2label[ids[row]] for row in rows])
+
+    sampler = HashSampler(key=SEED)
+    held_out = [tweet_id for tweet_id in id2label if sampler.fraction(tweet_id) < args.holdout]
+    held_out_set = set(held_out)
+    if held_out:
+        predicted, _ = classifier([tweet_id for tweet_id in id2label if tweet_id not in held_out_set]).predict(
+            vectors[np.array([id2row[tweet_id] for tweet_id in held_out])])
+        truth = np.array([id2label[tweet_id] for tweet_id in held_out])
+        predicted = np.array(predicted)
+        io.info(f'Held-out LLM labels: {len(held_out):,}, agreement {np.mean(predicted == truth):.1%}.')
+        for label in np.unique(truth):
+            io.info(f'    {label:>8}: {np.sum(truth == label):,} tweets, agreement {np.mean(predicted[truth == label] == label):.1%}.')
+
+    start = time.monotonic()
+    labels, confidences = classifier(id2label).predict(vectors)
+    elapsed = time.monotonic() - start
+    io.info(f'Labeled {len(ids):,} tweets in {elapsed:.0f} s ({len(ids) / elapsed:.0f} tweets/s).')
+
+    pd.DataFrame({'tweet_id': ids, 'stance': labels, 'confidence': confidences,
+                  'llm_label': [id2label.get(tweet_id) for tweet_id in ids]}).to_csv(output_file, index=False)
+    io.info(f'Results saved to {output_file}')
+    io.info('Finishing script label_tweets_with_knn.py ...')
+
+
+if __name__ == '__main__':
+    main()
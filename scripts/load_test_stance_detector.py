@@ -0,0 +1,145 @@
+"""
+Load test of OpenAIStanceDetector against a local mock of the OpenAI Responses API.
+
+For each concurrency level, the same tweets are evaluated by that many threads sharing one
+detector (and so one client pool, retry policy and circuit breaker). The throughput, latency
+percentiles, retries and 429 responses of each level are saved to a CSV file and plotted.
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import matplotlib.pyplot as plt
+import pandas as pd
+
+sys.path.append('..')
+from datetime import datetime
+from src import io
+from src.convoy_protest_dataset import ConvoyProtestDataset, DatasetType
+from src.paths_handler import PathsHandler
+from src.tweet import Tweet
+from core.llms import OpenAIStanceDetector
+from core.mock_openai_server import MockOpenAIServer
+
+
+def load_tweets(tweet_count: int) -> list[Tweet]:
+    """
+    Loads the first `tweet_count` tweets (by id) that the evaluation scripts would consider.
+    """
+    _, tweets, _ = ConvoyProtestDataset.get_dataset(data_type=DatasetType.ALL, removed_repeated=True)
+    tweets = Tweet.filter_tweets_by_date(tweets, start=datetime(2022, 1, 1), end=datetime(2022, 3, 31))
+    tweets = [tweet for tweet in tweets if not tweet.is_retweet and len(tweet.urls)==0]
+    tweets.sort(key=lambda tweet: tweet.id)
+    return tweets[:tweet_count]
+
+
+def run_level(tweets: list[Tweet], concurrency: int, server: MockOpenAIServer) -> dict:
+    """
+    Evaluates `tweets` with `concurrency` threads and returns the measurements of the run.
+    """
+    detector = OpenAIStanceDetector(backend='mock')
+    server_stats_before = server.stats()
+
+    def evaluate(tweet: Tweet) -> bool:
+        try:
+            detector.evaluate_tweet(tweet)
+            return True
+        except Exception as error:
+            io.warning(f'Evaluation of tweet {tweet.id} failed ({type(error).__name__}: {error}).')
+            return False
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        failures = sum(not success for success in executor.map(evaluate, tweets))
+    elapsed = time.monotonic() - start
+
+    summary = detector.metrics.summary()
+    server_stats = server.stats()
+    # Logs the usage of the level and closes the detector (and its prompt watcher).
+    detector.log_usage_summary()
+    return {
+        'concurrency': concurrency,
+        'tweets': len(tweets),
+        'failures': failures,
+        'elapsed_seconds': elapsed,
+        'tweets_per_second': len(tweets) / elapsed,
+        'latency_p50_seconds': summary['latency_p50_seconds'],
+        'latency_p95_seconds': summary['latency_p95_seconds'],
+        'mean_retries': summary['mean_retries'],
+        'rate_limited_responses': server_stats['rate_limited'] - server_stats_before['rate_limited'],
+        'server_requests': server_stats['requests'] - server_stats_before['requests'],
+    }
+
+
+def plot(results: pd.DataFrame, output_plot: str) -> None:
+    fig, (throughput_ax, latency_ax) = plt.subplots(1, 2, figsize=(10, 4))
+
+    throughput_ax.plot(results['concurrency'], results['tweets_per_second'], marker='o')
+    throughput_ax.set_xscale('log', base=2)
+    throughput_ax.set_xlabel('Concurrency')
+    throughput_ax.set_ylabel('Tweets per second')
+
+    latency_ax.plot(results['concurrency'], results['latency_p50_seconds'], marker='o', label='p50')
+    latency_ax.plot(results['concurrency'], results['latency_p95_seconds'], marker='o', label='p95')
+    latency_ax.set_xscale('log', base=2)
+    latency_ax.set_xlabel('Concurrency')
+    latency_ax.set_ylabel('Latency per tweet (s)')
+    latency_ax.legend()
+
+    fig.tight_layout()
+    fig.savefig(output_plot, dpi=300)
+    io.info(f'Plot saved to {output_plot}')
+
+
+def main():
+    config = PathsHandler()
+    output_file = config.get_path('load-test-output')
+    output_plot = config.get_path('load-test-plot')
+    mock_server_url = config.get_variable('openai-tweet-stance-detector-configuration')['mock-server-url']
+
+    io.info('Starting script load_test_stance_detector.py ...')
+    parser = argparse.ArgumentParser(description="Load test OpenAIStanceDetector against a local mock server.")
+    parser.add_argument("--concurrency", type=str, default="1,2,4,8,16,32", help="Comma-separated concurrency levels to test.")
+    parser.add_argument("--tweet-count", type=int, default=200, help="Number of tweets evaluated at each concurrency level.")
+    parser.add_argument("--latency", type=float, default=0.3, help="Median latency of the mock server in seconds.")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Spread of the (log-normal) latency of the mock server.")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="Fraction of requests answered with a 500 error.")
+    parser.add_argument("--malformed-rate", type=float, default=0.01, help="Fraction of requests answered with an unparsable output.")
+    parser.add_argument("--rate-limit-rpm", type=float, default=None, help="Requests per minute accepted by the mock server before answering 429.")
+    parser.add_argument("--seed", type=int, default=1706457371, help="Seed of the mock server.")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',')]
+    tweets = load_tweets(args.tweet_count)
+    io.info(f'Evaluating {len(tweets)} tweets at concurrency levels {levels}.')
+
+    url = urlparse(mock_server_url)
+    with MockOpenAIServer(host=url.hostname, port=url.port,
+                          latency_seconds=args.latency,
+                          latency_sigma=args.latency_sigma,
+                          error_rate=args.error_rate,
+                          malformed_rate=args.malformed_rate,
+                          rate_limit_rpm=args.rate_limit_rpm,
+                          seed=args.seed) as server:
+        io.info(f'Mock server listening on {server.url}')
+        results = []
+        for concurrency in levels:
+            result = run_level(tweets, concurrency, server)
+            io.info(f'concurrency={concurrency:>3}  {result["tweets_per_second"]:7.2f} tweets/s  '
+                    f'p50={result["latency_p50_seconds"]:.2f}s  p95={result["latency_p95_seconds"]:.2f}s  '
+                    f'retries/tweet={result["mean_retries"]:.2f}  429s={result["rate_limited_responses"]}  '
+                    f'failures={result["failures"]}')
+            results.append(result)
+
+    results = pd.DataFrame(results)
+    results.to_csv(output_file, index=False)
+    io.info(f'Results saved to {output_file}')
+    plot(results, output_plot)
+
+    io.info('Finishing script load_test_stance_detector.py ...')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Corpus-wide stance estimates by label propagation, without further API calls.
+
+The tweets labeled by OpenAIStanceDetector are the seeds of a graph of tweets, authors and
+conversations (see src/stance_propagation.py). A held-out share of the seeds is hidden from the
+propagation to measure the agreement of the propagated labels with the LLM labels. The label and
+confidence of every tweet reached by the propagation are saved to a CSV file.
+"""
+import argparse
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append('..')
+from src import io
+from src.convoy_protest_dataset import ConvoyProtestDataset, DatasetType
+from src.hash_sampler import HashSampler
+from src.paths_handler import PathsHandler
+from src.stance_propagation import TweetGraph, propagate_labels
+from src.stance_result_store import StanceResultStore
+
+
+SEED = 3361204877
+
+
+def username_to_author_id() -> dict[str, str]:
+    """
+    Lowercase username to user id, leaving out the usernames used by more than one user.
+    """
+    username2author_ids = {}
+    for author_id, usernames in ConvoyProtestDataset.get_userid_to_username_map().items():
+        for username in usernames:
+            username2author_ids.setdefault(username.lower(), set()).add(author_id)
+    return {username: next(iter(ids)) for username, ids in username2author_ids.items() if len(ids) == 1}
+
+
+def main():
+    config = PathsHandler()
+    store_file = config.get_path('stance-result-store')
+    output_file = config.get_path('stance-propagation-output')
+
+    io.info('Starting script propagate_stance.py ...')
+    parser = argparse.ArgumentParser(description="Propagate the LLM stance labels over the tweet graph.")
+    parser.add_argument("--alpha", type=float, default=0.9, help="Weight of the neighbours against the seed labels.")
+    parser.add_argument("--holdout", type=float, default=0.1, help="Share of the seeds held out to measure the agreement.")
+    parser.add_argument("--no-mentions", action="store_true", help="Do not connect tweets to the users they mention.")
+    args = parser.parse_args()
+
+    with StanceResultStore(store_file) as store:
+        seeds = {result['tweet_id']: result['llm_response'] for result in store.iter_tweet_results()
+                 if result.get('label_source', 'llm') == 'llm'}
+    _, tweets, _ = ConvoyProtestDataset.get_dataset(data_type=DatasetType.ALL, removed_repeated=True)
+
+    start = time.monotonic()
+    graph = TweetGraph(tweets, None if args.no_mentions else username_to_author_id())
+    io.info(f'Graph: {len(graph):,} nodes, {len(graph.rows) // 2:,} edges ({time.monotonic() - start:.1f} s).')
+
+    sampler = HashSampler(key=SEED)
+    held_out = {tweet_id: label for tweet_id, label in seeds.items() if sampler.fraction(tweet_id) < args.holdout}
+    training = {tweet_id: label for tweet_id, label in seeds.items() if tweet_id not in held_out}
+    start = time.monotonic()
+    predictions = propagate_labels(graph, training, alpha=args.alpha)
+    io.info(f'Propagated {len(training):,} seeds to {len(predictions):,} tweets in {time.monotonic() - start:.1f} s.')
+
+    reached = [tweet_id for tweet_id in held_out if tweet_id in predictions]
+    if reached:
+        agreement = sum(predictions[tweet_id][0] == held_out[tweet_id] for tweet_id in reached) / len(reached)
+        io.info(f'Held-out seeds: {len(held_out):,}, reached {len(reached):,}, agreement with the LLM {agreement:.1%}.')
+
+    # Final estimates use every seed.
+    predictions = propagate_labels(graph, seeds, alpha=args.alpha)
+    pd.DataFrame([{'tweet_id': tweet_id, 'stance': label, 'confidence': confidence, 'seed': tweet_id in seeds}
+                  for tweet_id, (label, confidence) in predictions.items()]).to_csv(output_file, index=False)
+    io.info(f'Results saved to {output_file}')
+    io.info('Finishing script propagate_stance.py ...')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,7 @@ import json
 from enum import Enum
 from src import paths_handler
 from itertools import chain
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional
 
 from src.tweet import Tweet
 from src.user import User
@@ -127,12 +127,12 @@ class ConvoyProtestDataset:
         return users, tweets, places
 
     @staticmethod
-    def get_dataset(data_type: DatasetType, removed_repeated=False):
+    def _json_filenames(data_type: DatasetType) -> Iterable[str]:
+        """
+        JSON files of a dataset type (every type but ISTANDWITHTRUCKERS, stored as an Excel file).
+        """
         paths = paths_handler.PathsHandler()
-
-        # Map dataset types to respective folder paths
         folder_map = {
-            DatasetType.ISTANDWITHTRUCKERS: 'istandwithtruckers_file',
             DatasetType.MENTIONERS: 'mentioners_path',
             DatasetType.POSTERS: 'posters_path',
             DatasetType.RETWEETERS: 'retweeters_path',
@@ -141,46 +141,62 @@ class ConvoyProtestDataset:
             DatasetType.HONKHONK: 'honkhonk_path',
             DatasetType.TRUCKERCONVOY2022: 'truckerconvoy2022_path',
         }
+        type_map = {
+            DatasetType.ALL_TIMELINES: [DatasetType.MENTIONERS, DatasetType.POSTERS, DatasetType.RETWEETERS],
+            DatasetType.ALL_HASHTAGS: [DatasetType.FLUTRUXKLAN, DatasetType.HOLDTHELINE,
+                                       DatasetType.HONKHONK, DatasetType.TRUCKERCONVOY2022],
+            DatasetType.ALL: [DatasetType.MENTIONERS, DatasetType.POSTERS, DatasetType.RETWEETERS,
+                              DatasetType.FLUTRUXKLAN, DatasetType.HOLDTHELINE,
+                              DatasetType.HONKHONK, DatasetType.TRUCKERCONVOY2022],
+        }
+        if data_type in folder_map:
+            return paths.get_json_filenames_from_folder(folder_map[data_type])
+        if data_type in type_map:
+            return chain.from_iterable(paths.get_json_filenames_from_folder(folder_map[folder_type])
+                                       for folder_type in type_map[data_type])
+        raise ValueError(f"Invalid DatasetType: {data_type}")
+
+    @staticmethod
+    def iter_tweets(data_type: DatasetType, removed_repeated=False) -> Iterator[Tweet]:
+        """
+        Streams the tweets of a dataset one JSON file at a time (same tweets as `get_dataset`),
+        so that they can be processed while the rest of the files are read.
+        """
+        if data_type == DatasetType.ISTANDWITHTRUCKERS:
+            yield from ConvoyProtestDataset.get_dataset(data_type=data_type)[1]
+            return
+
+        visited = set()
+        files = ConvoyProtestDataset._json_filenames(data_type)
+        if data_type == DatasetType.ALL or data_type == DatasetType.ALL_HASHTAGS:
+            files = chain(files, [None])
+        for filename in files:
+            if filename is None:
+                # IStandWithTruckers tweets come after the JSON files (as in get_dataset).
+                tweets = ConvoyProtestDataset.get_dataset(data_type=DatasetType.ISTANDWITHTRUCKERS)[1]
+            else:
+                tweets = [Tweet.from_dict(tweet_dict) for tweet_dict in ConvoyProtestDataset._process_json_file(filename)[1]]
+            for tweet in tweets:
+                if removed_repeated:
+                    id_ = (tweet.id, tweet.text, tweet.author_id)
+                    if id_ in visited:
+                        continue
+                    visited.add(id_)
+                yield tweet
+
+    @staticmethod
+    def get_dataset(data_type: DatasetType, removed_repeated=False):
+        paths = paths_handler.PathsHandler()
 
         # Handle dataset types and combine files as necessary
         if data_type == DatasetType.ISTANDWITHTRUCKERS:
             tweets = ConvoyProtestDataset._transform_xlsx_to_tweets(
-                paths.get_path(folder_map[DatasetType.ISTANDWITHTRUCKERS])
+                paths.get_path('istandwithtruckers_file')
             )
             
             return [], [tweet for tweet in tweets if tweet.is_valid], []
 
-        elif data_type in folder_map:
-            files = paths.get_json_filenames_from_folder(folder_map[data_type])
-
-        elif data_type == DatasetType.ALL_TIMELINES:
-            files = chain(
-                paths.get_json_filenames_from_folder('mentioners_path'),
-                paths.get_json_filenames_from_folder('posters_path'),
-                paths.get_json_filenames_from_folder('retweeters_path')
-            )
-
-        elif data_type == DatasetType.ALL_HASHTAGS:
-            files = chain(
-                paths.get_json_filenames_from_folder('flutruxklan_path'),
-                paths.get_json_filenames_from_folder('holdtheline_path'),
-                paths.get_json_filenames_from_folder('honkhonk_path'),
-                paths.get_json_filenames_from_folder('truckerconvoy2022_path')
-            )
-
-        elif data_type == DatasetType.ALL:
-            files = chain(
-                paths.get_json_filenames_from_folder('mentioners_path'),
-                paths.get_json_filenames_from_folder('posters_path'),
-                paths.get_json_filenames_from_folder('retweeters_path'),
-                paths.get_json_filenames_from_folder('flutruxklan_path'),
-                paths.get_json_filenames_from_folder('holdtheline_path'),
-                paths.get_json_filenames_from_folder('honkhonk_path'),
-                paths.get_json_filenames_from_folder('truckerconvoy2022_path')
-            )
-        
-        else:
-            raise ValueError(f"Invalid DatasetType: {data_type}")
+        files = ConvoyProtestDataset._json_filenames(data_type)
 
         # Process JSON files
         all_tweets = []
@@ -0,0 +1,77 @@
+"""
+dead_letter_queue.py
+
+This module defines the `DeadLetterQueue` class, a persisted list of the items (tweet ids or
+author ids) whose evaluation failed even after retrying. Failed items are recorded instead of
+aborting the run, and can be reprocessed later.
+
+The queue is stored as an append-only JSONL file (see `ResultLog`), one entry per failure:
+    {"tweet_id": "...", "error": "LLMResponseError: ...", "failed_at": "2022-02-01T10:00:00"}
+"""
+
+import os
+from datetime import datetime
+from typing import Iterable, List
+
+from src.result_log import ResultLog
+
+
+class DeadLetterQueue:
+    """
+    Persisted list of failed items.
+
+    Attributes:
+        filepath (str): Path to the JSONL file.
+        id_key (str): Name of the id field of the entries ('tweet_id' or 'author_id').
+    """
+
+    def __init__(self, filepath: str, id_key: str):
+        self.filepath = filepath
+        self.id_key = id_key
+        self._log = ResultLog(filepath, fsync_every=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        self._log.close()
+
+    def add(self, item_id: str, error: BaseException) -> None:
+        """
+        Records the failure of an item.
+        """
+        self._log.append({
+            self.id_key: item_id,
+            'error': f'{type(error).__name__}: {error}',
+            'failed_at': datetime.now().isoformat(timespec='seconds'),
+        })
+
+    def entries(self) -> List[dict]:
+        return list(self._log)
+
+    def ids(self) -> List[str]:
+        """
+        Returns the ids of the failed items (each id once, in order of first failure).
+        """
+        return list(dict.fromkeys(entry[self.id_key] for entry in self._log))
+
+    def __len__(self) -> int:
+        return len(self.ids())
+
+    def remove(self, item_ids: Iterable[str]) -> None:
+        """
+        Removes every entry of the given items (e.g. after they were reprocessed successfully).
+        """
+        item_ids = set(item_ids)
+        self._log.close()
+        tmp_filename = f'{self.filepath}.tmp'
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        with ResultLog(tmp_filename, fsync_every=1000) as tmp_log:
+            for entry in self._log:
+                if entry[self.id_key] not in item_ids:
+                    tmp_log.append(entry)
+        os.replace(tmp_filename, self.filepath)
@@ -0,0 +1,241 @@
+"""
+embedding_index.py
+
+This module computes sentence embeddings of tweets on CPU, stores them on disk, and searches
+them for nearest neighbours (few-shot example selection, near-duplicates, kNN labeling).
+
+    - `TweetEmbedder` embeds texts in batches with sentence-transformers (optional dependency),
+      as L2-normalized vectors, so the inner product is the cosine similarity.
+    - `write_embeddings` streams the embeddings into a memory-mapped float16 matrix
+      (`embeddings.npy`), whose row i is the tweet on line i of `tweet_ids.txt`, and
+      `load_embeddings` opens it without reading it into memory.
+    - `IVFIndex` is an inverted-file index: a spherical k-means splits the vectors into `n_lists`
+      lists, and a query only scores the vectors of the `nprobe` lists with the closest centroids.
+      `nprobe` trades recall for latency; `exact_search` gives the exact neighbours to measure it.
+
+Usage:
+    embedder = TweetEmbedder('sentence-transformers/all-MiniLM-L6-v2')
+    vectors = write_embeddings('data/generated/embeddings/', ids, texts, embedder.embed, embedder.dimension)
+    index = IVFIndex(n_lists=1024, nprobe=16).train(vectors).add(vectors)
+    scores, rows = index.search(embedder.embed(['Freedom convoy arrives in Ottawa']), k=10)
+"""
+
+import os
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+
+class TweetEmbedder:
+    """
+    Batched CPU sentence embeddings.
+
+    Attributes:
+        model_name (str): sentence-transformers model.
+        batch_size (int): Texts encoded per forward pass.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 256, device: str = 'cpu', torch_threads: Optional[int] = None):
+        if SentenceTransformer is None:
+            raise ImportError('TweetEmbedder requires sentence-transformers (pip install sentence-transformers).')
+        if torch_threads is not None:
+            import torch
+            torch.set_num_threads(torch_threads)
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name, device=device)
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        L2-normalized float32 embeddings of the texts, one row per text.
+        """
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                 normalize_embeddings=True, show_progress_bar=False).astype(np.float32)
+
+
+def _batches(items: Sequence, batch_size: int) -> Iterator[Tuple[int, Sequence]]:
+    for start in range(0, len(items), batch_size):
+        yield start, items[start:start + batch_size]
+
+
+def write_embeddings(folder: str, ids: Sequence[str], texts: Sequence[str], embed: Callable[[List[str]], np.ndarray],
+                     dimension: int, batch_size: int = 4096) -> np.memmap:
+    """
+    Embeds the texts in batches into `folder`/embeddings.npy (float16, one row per text) and writes
+    their ids to `folder`/tweet_ids.txt. Only one batch is held in memory.
+
+    Returns:
+        np.memmap: The matrix, opened read-only.
+    """
+    assert len(ids) == len(texts), 'Every text needs an id.'
+    os.makedirs(folder, exist_ok=True)
+    matrix = np.lib.format.open_memmap(os.path.join(folder, 'embeddings.npy'), mode='w+', dtype=np.float16,
+                                       shape=(len(texts), dimension))
+    for start, batch in _batches(texts, batch_size):
+        matrix[start:start + len(batch)] = embed(list(batch))
+    matrix.flush()
+    del matrix
+    with open(os.path.join(folder, 'tweet_ids.txt'), 'w', encoding='utf-8') as writer:
+        writer.writelines(f'{tweet_id}\n' for tweet_id in ids)
+    return load_embeddings(folder)[1]
+
+
+def load_embeddings(folder: str) -> Tuple[List[str], np.memmap]:
+    """
+    Ids and memory-mapped embeddings written by `write_embeddings` (row i is the tweet ids[i]).
+    """
+    with open(os.path.join(folder, 'tweet_ids.txt'), 'r', encoding='utf-8') as reader:
+        ids = reader.read().splitlines()
+    return ids, np.load(os.path.join(folder, 'embeddings.npy'), mmap_mode='r')
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores of each row, best first.
+    """
+    if k < scores.shape[1]:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(scores.shape[1]), (scores.shape[0], scores.shape[1]))
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+
+def exact_search(vectors: np.ndarray, queries: np.ndarray, k: int, chunk_size: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact k nearest neighbours (highest inner product) of each query, reading `vectors` in chunks.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Scores and rows of the neighbours, shape (queries, k), best
+        first (score -inf and row -1 when there are fewer than k vectors).
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        scores = np.concatenate([best_scores, queries @ chunk.T], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(chunk)), (len(queries), len(chunk)))], axis=1)
+        top = _top_k(scores, k)
+        best_scores, best_rows = np.take_along_axis(scores, top, axis=1), np.take_along_axis(rows, top, axis=1)
+    return best_scores, best_rows
+
+
+def recall_at_k(found: np.ndarray, exact: np.ndarray) -> float:
+    """
+    Mean share of the exact neighbours of each query found by an approximate search.
+    """
+    hits = [len(set(row[row >= 0]) & set(true_row[true_row >= 0])) / max((true_row >= 0).sum(), 1)
+            for row, true_row in zip(found, exact)]
+    return float(np.mean(hits)) if hits else 0.0
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index over L2-normalized vectors.
+
+    Attributes:
+        n_lists (int): Number of k-means lists (about 1-4 times the square root of the vectors).
+        nprobe (int): Lists scored per query by default.
+        centroids (np.ndarray): (n_lists, dimension) normalized centroids, once trained.
+    """
+
+    def __init__(self, n_lists: int, nprobe: int = 8, seed: int = 0):
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.vectors = None
+        self._rows: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+
+    def _assign(self, vectors: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+        return np.concatenate([np.argmax(np.asarray(vectors[start:start + chunk_size], dtype=np.float32) @ self.centroids.T, axis=1)
+                               for start in range(0, len(vectors), chunk_size)])
+
+    def train(self, vectors: np.ndarray, iterations: int = 20, sample_size: Optional[int] = None) -> 'IVFIndex':
+        """
+        Spherical k-means on a sample of the vectors (`256 * n_lists` at most by default).
+        """
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(vectors), sample_size or 256 * self.n_lists)
+        assert sample_size >= self.n_lists, 'Training needs at least one vector per list.'
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))], dtype=np.float32)
+        self.centroids = sample[rng.choice(len(sample), self.n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = self._assign(sample)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, sample)
+            empty = np.bincount(assignments, minlength=self.n_lists) == 0
+            sums[empty] = sample[rng.choice(len(sample), empty.sum(), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            self.centroids = sums / np.maximum(norms, 1e-12)
+        return self
+
+    def add(self, vectors: np.ndarray) -> 'IVFIndex':
+        """
+        Assigns every vector to its list. The index keeps a reference to `vectors` (e.g. the
+        memory-mapped matrix) to score the candidates of a query.
+        """
+        assert self.centroids is not None, 'The index must be trained first.'
+        assignments = self._assign(vectors)
+        # Stable sort: rows of a list stay increasing, so candidates are read in disk order.
+        self._rows = np.argsort(assignments, kind='stable')
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=self.n_lists))])
+        self.vectors = vectors
+        return self
+
+    def list_sizes(self) -> np.ndarray:
+        return np.diff(self._offsets)
+
+    def search(self, queries: np.ndarray, k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate k nearest neighbours of each query among the vectors of its `nprobe` closest
+        lists.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Scores and rows of the neighbours, shape (queries, k),
+            best first (score -inf and row -1 when the lists hold fewer than k vectors).
+        """
+        assert self._rows is not None, 'Vectors must be added before searching.'
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        queries = np.asarray(queries, dtype=np.float32)
+        probes = _top_k(queries @ self.centroids.T, nprobe)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for q, query in enumerate(queries):
+            candidates = np.concatenate([self._rows[self._offsets[list_id]:self._offsets[list_id + 1]] for list_id in probes[q]])
+            if len(candidates) == 0:
+                continue
+            candidates.sort()
+            candidate_scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+            top = _top_k(candidate_scores[np.newaxis], k)[0]
+            scores[q, :len(top)] = candidate_scores[top]
+            rows[q, :len(top)] = candidates[top]
+        return scores, rows
+
+    def save(self, filename: str) -> None:
+        np.savez(filename, centroids=self.centroids, rows=self._rows, offsets=self._offsets,
+                 settings=np.array([self.n_lists, self.nprobe, self.seed]))
+
+    @staticmethod
+    def load(filename: str, vectors: np.ndarray) -> 'IVFIndex':
+        """
+        Index saved by `save`, over the same `vectors` it was built with.
+        """
+        with np.load(filename) as data:
+            n_lists, nprobe, seed = (int(value) for value in data['settings'])
+            index = IVFIndex(n_lists, nprobe, seed)
+            index.centroids, index._rows, index._offsets = data['centroids'], data['rows'], data['offsets']
+        assert index._offsets[-1] == len(vectors), 'The vectors do not match the index.'
+        index.vectors = vectors
+        return index
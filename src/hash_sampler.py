@@ -0,0 +1,81 @@
+"""
+hash_sampler.py
+
+This module defines the `HashSampler` class, which draws deterministic samples of items (tweets,
+users) by ranking them with a keyed hash of their id: the sample of size k is the k items with the
+smallest hashes.
+
+Unlike shuffling the list with a seeded generator, the sample does not depend on the order in
+which the items were loaded nor on which items were already processed: removing the processed
+items from the input leaves the rank of the others unchanged, so a larger sample extends a
+smaller one. The smallest k hashes are found in one streaming pass with a bounded heap, without
+materializing or shuffling the input.
+
+Usage:
+    sampler = HashSampler(key=172027145)
+    sample = sampler.sample(tweets, k=1000, id_of=lambda tweet: tweet.id)
+"""
+
+import hashlib
+import heapq
+import math
+from typing import Callable, Iterable, List, Optional, TypeVar, Union
+
+T = TypeVar('T')
+
+
+class HashSampler:
+    """
+    Order-independent sampler ranking items by a keyed BLAKE2b hash of their id.
+
+    Attributes:
+        key (bytes): Key of the hash. Different keys give independent samples.
+    """
+
+    def __init__(self, key: Union[int, str, bytes]):
+        if isinstance(key, int):
+            key = key.to_bytes(16, 'big')
+        elif isinstance(key, str):
+            key = key.encode('utf-8')
+        self.key = key
+
+    def rank(self, item_id: str) -> int:
+        """
+        Position of an item in the sampling order (a 64-bit hash of its id).
+        """
+        digest = hashlib.blake2b(str(item_id).encode('utf-8'), key=self.key, digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+
+    def fraction(self, item_id: str) -> float:
+        """
+        Rank of an item scaled to [0, 1). Keeping the items below a rate gives a streaming
+        sample of that rate, consistent with the order of `sample`.
+        """
+        return self.rank(item_id) / 2 ** 64
+
+    def rate(self, item_ids: Iterable[str], k: int) -> float:
+        """
+        Rate of the streaming sample (the items with `fraction(id) < rate`) that keeps the same
+        items as `sample(items, k)`: just above the fraction of the k-th smallest hash (1.0 when
+        there are at most k items).
+        """
+        fractions = sorted(self.fraction(item_id) for item_id in set(item_ids))
+        if k >= len(fractions):
+            return 1.0
+        if k <= 0:
+            return 0.0
+        return math.nextafter(fractions[k - 1], 1.0)
+
+    def sample(self, items: Iterable[T], k: Optional[int] = None,
+               id_of: Callable[[T], str] = lambda item: item) -> List[T]:
+        """
+        The `k` items with the smallest hashes (all of them if `k` is None), in sampling order.
+
+        Args:
+            items (Iterable[T]): Items to sample from, consumed once.
+            id_of (Callable[[T], str]): Id of an item (the item itself by default).
+        """
+        ranked = ((self.rank(id_of(item)), index, item) for index, item in enumerate(items))
+        if k is None:
+            return [item for _, _, item in sorted(ranked)]
+        return [item for _, _, item in heapq.nsmallest(k, ranked)]
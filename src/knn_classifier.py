@@ -0,0 +1,93 @@
+"""
+knn_classifier.py
+
+This module defines the `KNNStanceClassifier` class, which transfers the stance labels of the
+LLM-labeled tweets to unlabeled tweets by a vote of their nearest labeled neighbours in the
+embedding space of `src/embedding_index.py`.
+
+Each neighbour votes for its label with a weight equal to its cosine similarity (votes are
+unweighted with `weighted=False`); the confidence of a prediction is the share of the votes of
+the winning label. Queries are processed in batches of `batch_size` vectors: the neighbours of a
+batch are found with one matrix product against the labeled vectors (exact search), or with an
+`IVFIndex` over them when `n_lists` is set, for large labeled sets.
+
+Usage:
+    classifier = KNNStanceClassifier(k=15).fit(vectors[labeled_rows], labels)
+    labels, confidences = classifier.predict(vectors)
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.embedding_index import IVFIndex, exact_search
+
+
+class KNNStanceClassifier:
+    """
+    k-nearest-neighbours vote over L2-normalized embeddings.
+
+    Attributes:
+        labels (Tuple[str]): The classes, in the order of the columns of `predict_proba`.
+        k (int): Number of neighbours voting.
+        n_lists (Optional[int]): Lists of the IVF index over the labeled vectors (None for exact
+            search).
+    """
+
+    def __init__(self, labels: Sequence[str] = ('left', 'neutral', 'right'), k: int = 15, weighted: bool = True,
+                 n_lists: Optional[int] = None, nprobe: int = 16, batch_size: int = 4096, seed: int = 0):
+        self.labels = tuple(labels)
+        self.k = k
+        self.weighted = weighted
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.batch_size = batch_size
+        self.seed = seed
+        self.vectors: Optional[np.ndarray] = None
+        self.label_ids: Optional[np.ndarray] = None
+        self.index: Optional[IVFIndex] = None
+
+    def fit(self, vectors: np.ndarray, labels: Sequence[str]) -> 'KNNStanceClassifier':
+        """
+        Stores the labeled vectors (rows with a label not in `labels` are left out).
+        """
+        known = np.array([label in self.labels for label in labels], dtype=bool)
+        self.vectors = np.asarray(vectors, dtype=np.float32)[known]
+        self.label_ids = np.array([self.labels.index(label) for label in labels if label in self.labels], dtype=np.int64)
+        assert len(self.vectors) >= self.k, 'The classifier needs at least k labeled vectors.'
+        self.index = None
+        if self.n_lists is not None:
+            self.index = IVFIndex(self.n_lists, self.nprobe, seed=self.seed).train(self.vectors).add(self.vectors)
+        return self
+
+    def neighbours(self, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Similarities and rows (in the labeled vectors) of the k nearest labeled neighbours.
+        """
+        if self.index is not None:
+            return self.index.search(queries, self.k)
+        return exact_search(self.vectors, queries, self.k)
+
+    def predict_proba(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Share of the votes of each label, for each vector (read in batches, e.g. from a memmap).
+        """
+        assert self.vectors is not None, 'The classifier must be fitted first.'
+        probabilities = np.zeros((len(vectors), len(self.labels)), dtype=np.float32)
+        for start in range(0, len(vectors), self.batch_size):
+            scores, rows = self.neighbours(np.asarray(vectors[start:start + self.batch_size], dtype=np.float32))
+            found = rows >= 0
+            weights = np.maximum(scores, 1e-6) if self.weighted else np.ones_like(scores)
+            votes = np.zeros((len(rows), len(self.labels)), dtype=np.float32)
+            np.add.at(votes, (np.nonzero(found)[0], self.label_ids[rows[found]]), weights[found])
+            totals = votes.sum(axis=1, keepdims=True)
+            probabilities[start:start + len(rows)] = votes / np.maximum(totals, 1e-12)
+        return probabilities
+
+    def predict(self, vectors: np.ndarray) -> Tuple[List[str], np.ndarray]:
+        """
+        Most voted label and its share of the votes (the confidence), for each vector.
+        """
+        probabilities = self.predict_proba(vectors)
+        best = probabilities.argmax(axis=1)
+        return [self.labels[index] for index in best], probabilities[np.arange(len(best)), best]
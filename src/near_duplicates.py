@@ -0,0 +1,122 @@
+"""
+near_duplicates.py
+
+This module defines the `NearDuplicateClusterer` class, which groups near-identical texts (e.g.
+the copy-paste campaigns of the convoy corpus) with MinHash signatures and locality-sensitive
+hashing (LSH), so that only one representative per group needs to be sent to the LLM.
+
+Each text is turned into its set of character k-shingles. The MinHash signature of the set
+(`num_perm` values) estimates the Jaccard similarity between two texts as the fraction of equal
+values. Signatures are split into `bands` bands: texts sharing at least one band are candidate
+pairs, and candidates whose estimated similarity reaches `threshold` are merged (union-find).
+
+Usage:
+    clusterer = NearDuplicateClusterer(threshold=0.8)
+    cluster_ids = clusterer.cluster([tweet.sanitized_text for tweet in tweets])
+    # cluster_ids[i] is the index of the representative (first member) of the cluster of text i.
+"""
+
+import re
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+
+class _UnionFind:
+    """
+    Disjoint sets over 0..n-1, whose root is always the smallest index of the set.
+    """
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, item: int) -> int:
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, first: int, second: int) -> None:
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parent[max(first, second)] = min(first, second)
+
+
+class NearDuplicateClusterer:
+    """
+    MinHash/LSH clustering of near-duplicate texts.
+
+    Attributes:
+        threshold (float): Minimum estimated Jaccard similarity of two texts in the same cluster.
+        num_perm (int): Length of the MinHash signatures.
+        bands (int): Number of LSH bands (must divide `num_perm`). More bands find pairs with a
+            lower similarity, at the cost of more candidate pairs to verify.
+        shingle_size (int): Length of the character shingles.
+    """
+    _PRIME = (1 << 31) - 1
+    _WHITESPACES = re.compile(r'\s+')
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, bands: int = 16, shingle_size: int = 5,
+                 seed: Optional[int] = 2745861873):
+        assert num_perm % bands == 0, 'The number of bands must divide the signature length.'
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed=seed)
+        self._a = rng.integers(1, NearDuplicateClusterer._PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, NearDuplicateClusterer._PRIME, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        """
+        Hashes of the character shingles of the (lowercase, whitespace-normalized) text.
+        """
+        text = NearDuplicateClusterer._WHITESPACES.sub(' ', text.lower()).strip()
+        if len(text) < self.shingle_size:
+            return np.array([zlib.crc32(text.encode('utf-8'))] if text else [], dtype=np.uint64)
+        return np.unique(np.array([zlib.crc32(text[i:i + self.shingle_size].encode('utf-8'))
+                                   for i in range(len(text) - self.shingle_size + 1)], dtype=np.uint64))
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """
+        MinHash signature of a text (None for empty texts, which are never clustered).
+        """
+        shingles = self.shingles(text)
+        if len(shingles) == 0:
+            return None
+        shingles = shingles % NearDuplicateClusterer._PRIME
+        # (a * x + b) mod p for every permutation (rows) and shingle (columns), below 2**63.
+        hashes = (self._a[:, None] * shingles[None, :] + self._b[:, None]) % NearDuplicateClusterer._PRIME
+        return hashes.min(axis=1)
+
+    @staticmethod
+    def similarity(first: np.ndarray, second: np.ndarray) -> float:
+        """
+        Estimated Jaccard similarity of two signatures.
+        """
+        return float(np.mean(first == second))
+
+    def cluster(self, texts: List[str]) -> List[int]:
+        """
+        Clusters the texts.
+
+        Returns:
+            List[int]: For each text, the index of the representative of its cluster (the first
+            text of the cluster in the given order). Singletons are their own representative.
+        """
+        signatures = [self.signature(text) for text in texts]
+        clusters = _UnionFind(len(texts))
+        rows = self.num_perm // self.bands
+        for band in range(self.bands):
+            buckets = {}
+            for index, signature in enumerate(signatures):
+                if signature is None:
+                    continue
+                key = signature[band * rows:(band + 1) * rows].tobytes()
+                first = buckets.setdefault(key, index)
+                if first != index and NearDuplicateClusterer.similarity(signatures[first], signature) >= self.threshold:
+                    clusters.union(first, index)
+        return [clusters.find(index) for index in range(len(texts))]
@@ -0,0 +1,113 @@
+"""
+ngram_classifier.py
+
+This module defines the `HashedNgramClassifier` class, a fast CPU stance classifier used as the
+first stage of the labeling cascade: it is trained on the labels already produced by the LLM,
+labels the tweets it is confident about, and leaves the rest to `OpenAIStanceDetector`.
+
+Texts are represented by their word unigrams and bigrams, hashed into `n_features` buckets
+(the "hashing trick", so no vocabulary is stored) and L2-normalized. The model is a multinomial
+logistic regression trained with mini-batch SGD, written with numpy only.
+
+Usage:
+    classifier = HashedNgramClassifier().fit(texts, labels)
+    labels, confidences = classifier.predict(other_texts)
+"""
+
+import re
+import zlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class HashedNgramClassifier:
+    """
+    Multinomial logistic regression over hashed word n-grams.
+
+    Attributes:
+        labels (Tuple[str]): The classes, in the order of the columns of `predict_proba`.
+        n_features (int): Number of hash buckets.
+    """
+    _TOKENS = re.compile(r'[#@]?\w+')
+
+    def __init__(self, labels: Sequence[str] = ('left', 'neutral', 'right'), n_features: int = 2 ** 18,
+                 epochs: int = 10, learning_rate: float = 0.5, l2: float = 1e-6, batch_size: int = 64,
+                 seed: Optional[int] = 3912470537):
+        self.labels = tuple(labels)
+        self.n_features = n_features
+        self.epochs = epochs
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.batch_size = batch_size
+        self.seed = seed
+        self.weights = np.zeros((n_features, len(self.labels)), dtype=np.float32)
+        self.bias = np.zeros(len(self.labels), dtype=np.float32)
+
+    def _ngram_ids(self, text: str) -> np.ndarray:
+        tokens = HashedNgramClassifier._TOKENS.findall(text.lower())
+        ngrams = tokens + [f'{first} {second}' for first, second in zip(tokens, tokens[1:])]
+        return np.array([zlib.crc32(ngram.encode('utf-8')) % self.n_features for ngram in ngrams], dtype=np.int64)
+
+    def featurize(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Sparse (CSR) representation of the texts: (indices, values, indptr).
+        """
+        indices, values, indptr = [], [], [0]
+        for text in texts:
+            ids, counts = np.unique(self._ngram_ids(text), return_counts=True)
+            norm = np.sqrt((counts ** 2).sum()) if len(counts) > 0 else 1.0
+            indices.append(ids)
+            values.append((counts / norm).astype(np.float32))
+            indptr.append(indptr[-1] + len(ids))
+        return (np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64),
+                np.concatenate(values) if values else np.zeros(0, dtype=np.float32),
+                np.array(indptr, dtype=np.int64))
+
+    def _scores(self, indices: np.ndarray, values: np.ndarray, indptr: np.ndarray) -> np.ndarray:
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        scores = np.zeros((len(indptr) - 1, len(self.labels)), dtype=np.float32)
+        np.add.at(scores, rows, self.weights[indices] * values[:, None])
+        return scores + self.bias
+
+    @staticmethod
+    def _softmax(scores: np.ndarray) -> np.ndarray:
+        scores = scores - scores.max(axis=1, keepdims=True)
+        exp_scores = np.exp(scores)
+        return exp_scores / exp_scores.sum(axis=1, keepdims=True)
+
+    def fit(self, texts: Sequence[str], labels: Sequence[str]) -> 'HashedNgramClassifier':
+        indices, values, indptr = self.featurize(texts)
+        targets = np.array([self.labels.index(label) for label in labels])
+        rng = np.random.default_rng(seed=self.seed)
+        self.weights[:] = 0
+        self.bias[:] = 0
+        for _ in range(self.epochs):
+            order = rng.permutation(len(targets))
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                batch_indices = np.concatenate([indices[indptr[row]:indptr[row + 1]] for row in batch])
+                batch_values = np.concatenate([values[indptr[row]:indptr[row + 1]] for row in batch])
+                batch_indptr = np.concatenate([[0], np.cumsum([indptr[row + 1] - indptr[row] for row in batch])])
+
+                # Gradient of the mean cross-entropy with respect to the scores.
+                gradient = HashedNgramClassifier._softmax(self._scores(batch_indices, batch_values, batch_indptr))
+                gradient[np.arange(len(batch)), targets[batch]] -= 1
+                gradient /= len(batch)
+
+                rows = np.repeat(np.arange(len(batch)), np.diff(batch_indptr))
+                self.weights *= (1 - self.learning_rate * self.l2)
+                np.add.at(self.weights, batch_indices, -self.learning_rate * batch_values[:, None] * gradient[rows])
+                self.bias -= self.learning_rate * gradient.sum(axis=0)
+        return self
+
+    def predict_proba(self, texts: Sequence[str]) -> np.ndarray:
+        return HashedNgramClassifier._softmax(self._scores(*self.featurize(texts)))
+
+    def predict(self, texts: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+        """
+        Returns the most likely label of each text and its probability (the confidence).
+        """
+        probabilities = self.predict_proba(texts)
+        best = probabilities.argmax(axis=1)
+        return [self.labels[k] for k in best], probabilities[np.arange(len(best)), best]
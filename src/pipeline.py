@@ -0,0 +1,173 @@
+"""
+pipeline.py
+
+This module defines the `Pipeline` class, a producer/consumer pipeline of stages connected by
+bounded queues, used to overlap the CPU stages of the stance evaluation (loading, filtering,
+sanitizing, prompt formatting) with the network-bound LLM calls.
+
+Each stage runs in its own thread(s) and applies a function to the items of its input queue:
+the result goes to the next queue, or is dropped if the function returns None. Queues are
+bounded, so a fast stage blocks (backpressure) instead of buffering the whole corpus, and the
+first items reach the last stage while the source is still being read. The source is read by
+a producer thread and the sink runs in the calling thread.
+
+If a stage raises an exception, the pipeline stops and `run` raises it once every thread exited.
+
+Usage:
+    pipeline = Pipeline([Stage('sanitize', sanitize), Stage('llm', evaluate, workers=8)])
+    stats = pipeline.run(iter_tweets(), sink=write_result)
+"""
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class _Stopped(Exception):
+    """
+    Raised in the pipeline threads when another thread failed.
+    """
+
+
+_END = object()
+
+
+class Stage:
+    """
+    A step of the pipeline.
+
+    Attributes:
+        name (str): Name of the stage in the statistics.
+        function (Callable[[Any], Any]): Maps an item to the next item (None to drop it).
+        workers (int): Number of threads running the function (items may be reordered if > 1).
+    """
+
+    def __init__(self, name: str, function: Callable[[Any], Any], workers: int = 1):
+        assert workers >= 1, 'A stage needs at least one worker.'
+        self.name = name
+        self.function = function
+        self.workers = workers
+
+
+class Pipeline:
+    """
+    Stages connected by bounded queues.
+
+    Attributes:
+        stages (List[Stage]): The stages, in order.
+        queue_size (int): Capacity of each queue between two stages.
+    """
+    _POLL_SECONDS = 0.1
+
+    def __init__(self, stages: List[Stage], queue_size: int = 256):
+        self.stages = stages
+        self.queue_size = queue_size
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+
+    def _put(self, target: queue.Queue, item: Any) -> None:
+        while True:
+            try:
+                target.put(item, timeout=Pipeline._POLL_SECONDS)
+                return
+            except queue.Full:
+                if self._stop.is_set():
+                    raise _Stopped()
+
+    def _get(self, source: queue.Queue) -> Any:
+        while True:
+            try:
+                return source.get(timeout=Pipeline._POLL_SECONDS)
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise _Stopped()
+
+    def _fail(self, error: BaseException) -> None:
+        with self._lock:
+            self._errors.append(error)
+        self._stop.set()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def _produce(self, items: Iterable[Any], target: queue.Queue) -> None:
+        try:
+            for item in items:
+                self._count('source')
+                self._put(target, item)
+            self._put(target, _END)
+        except _Stopped:
+            pass
+        except BaseException as error:
+            self._fail(error)
+
+    def _work(self, stage: Stage, source: queue.Queue, target: queue.Queue, running: List[int]) -> None:
+        try:
+            while True:
+                item = self._get(source)
+                if item is _END:
+                    # Let the other workers of the stage see the end, the last one forwards it.
+                    self._put(source, _END)
+                    with self._lock:
+                        running[0] -= 1
+                        last = running[0] == 0
+                    if last:
+                        self._put(target, _END)
+                    return
+                result = stage.function(item)
+                if result is not None:
+                    self._count(stage.name)
+                    self._put(target, result)
+        except _Stopped:
+            pass
+        except BaseException as error:
+            self._fail(error)
+
+    def run(self, source: Iterable[Any], sink: Callable[[Any], None]) -> Dict[str, Any]:
+        """
+        Runs the pipeline until the source is exhausted and every item reached the sink.
+
+        Returns:
+            Dict[str, Any]: Items output by the source and by each stage, items written by the
+            sink, and the seconds until the first item reached the sink.
+        """
+        self._stop.clear()
+        self._errors.clear()
+        self._counts.clear()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._produce, args=(source, queues[0]), daemon=True)]
+        for k, stage in enumerate(self.stages):
+            running = [stage.workers]
+            threads.extend(threading.Thread(target=self._work, args=(stage, queues[k], queues[k + 1], running), daemon=True)
+                           for _ in range(stage.workers))
+
+        start = time.monotonic()
+        first_item_seconds: Optional[float] = None
+        written = 0
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _END:
+                    break
+                sink(item)
+                written += 1
+                if first_item_seconds is None:
+                    first_item_seconds = time.monotonic() - start
+        except _Stopped:
+            pass
+        except BaseException as error:
+            self._fail(error)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+        return {**self._counts, 'sink': written, 'first_item_seconds': first_item_seconds}
@@ -0,0 +1,222 @@
+"""
+result_log.py
+
+This module defines the `ResultLog` class, an append-only JSON Lines (JSONL) log used to
+checkpoint the results produced by the stance evaluation scripts.
+
+Each result is written as a single JSON object per line as soon as it is appended, so a
+crash of the process loses nothing that was already appended. The file is fsync'ed every
+`fsync_every` results, which bounds what could be lost on a power failure while keeping the
+checkpointing cost constant per result (instead of rewriting the whole output file).
+
+Each line is written with a single `write` under an exclusive `fcntl` lock, so lines appended by
+several threads or processes never interleave. Worker processes still write to their own shard
+of the log (`shard_filepath`), which the parent merges once they exit (`merge_shards`).
+
+Classes:
+    - ResultLog: Append-only JSONL log with streaming reads and compaction to JSON.
+
+Usage:
+    with ResultLog('results.jsonl', fsync_every=200) as log:
+        already_processed = {item['tweet_id'] for item in log}
+        log.append({'tweet_id': '1', 'llm_response': 'neutral'})
+
+    ResultLog('results.jsonl').compact('results.json')
+"""
+
+import fcntl
+import glob
+import json
+import os
+import threading
+from typing import Iterator, Optional
+
+
+class ResultLog:
+    """
+    Append-only JSONL log of evaluation results.
+
+    Attributes:
+        filepath (str): Path to the JSONL file backing the log.
+        fsync_every (int): Number of appended results between two calls to `os.fsync`.
+    """
+
+    def __init__(self, filepath: str, fsync_every: int = 200, legacy_filepath: Optional[str] = None):
+        """
+        Opens (or creates) the log located at `filepath`.
+
+        If the log does not exist yet and `legacy_filepath` points to an existing JSON file
+        (a list of results, as written by previous versions of the evaluation scripts), the
+        log is seeded with its content so runs can resume from it.
+
+        A partial trailing line, left behind by a crash in the middle of a write, is removed
+        when the log is first opened for writing (readers never modify the file).
+        """
+        assert fsync_every > 0, 'fsync_every must be a positive number of results.'
+        self.filepath = filepath
+        self.fsync_every = fsync_every
+        self._fd = None
+        self._pending_fsync = 0
+        self._lock = threading.Lock()
+
+        if not os.path.exists(filepath) and legacy_filepath is not None and os.path.exists(legacy_filepath):
+            ResultLog._import_json(legacy_filepath, filepath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def shard_filepath(filepath: str, worker: int) -> str:
+        """
+        Path of the shard of the log at `filepath` written by worker process `worker`.
+        """
+        root, extension = os.path.splitext(filepath)
+        return f'{root}.worker-{worker}{extension}'
+
+    @staticmethod
+    def _repair_tail(fd: int) -> None:
+        """
+        Truncates the file after its last newline, dropping a partially written record. The
+        caller holds the exclusive lock of the file.
+        """
+        size = os.fstat(fd).st_size
+        if size == 0 or os.pread(fd, 1, size - 1) == b'\n':
+            return
+
+        # Walk backwards in blocks looking for the last complete line.
+        position = size
+        block_size = 4096
+        last_newline = -1
+        while position > 0 and last_newline < 0:
+            start = max(0, position - block_size)
+            index = os.pread(fd, position - start, start).rfind(b'\n')
+            if index >= 0:
+                last_newline = start + index
+            position = start
+        os.ftruncate(fd, last_newline + 1)
+
+    def _open_writer(self) -> None:
+        fd = os.open(self.filepath, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            ResultLog._repair_tail(fd)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+
+    @staticmethod
+    def _import_json(json_filename: str, log_filename: str) -> None:
+        """
+        Writes every result of a JSON list file as a line of a new JSONL file.
+        """
+        with open(json_filename, 'r', encoding='utf-8') as reader:
+            results = json.load(reader)
+        tmp_filename = f'{log_filename}.tmp'
+        with open(tmp_filename, 'w', encoding='utf-8') as writer:
+            for result in results:
+                writer.write(json.dumps(result) + '\n')
+            writer.flush()
+            os.fsync(writer.fileno())
+        os.replace(tmp_filename, log_filename)
+
+    def append(self, result: dict) -> None:
+        """
+        Appends a single result to the log.
+
+        The line is handed to the operating system immediately; `os.fsync` is only called
+        every `fsync_every` results.
+        """
+        line = memoryview((json.dumps(result) + '\n').encode('utf-8'))
+        with self._lock:
+            if self._fd is None:
+                self._open_writer()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                while line:
+                    line = line[os.write(self._fd, line):]
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._pending_fsync += 1
+            if self._pending_fsync >= self.fsync_every:
+                self._sync()
+
+    def _sync(self) -> None:
+        if self._fd is not None and self._pending_fsync > 0:
+            os.fsync(self._fd)
+        self._pending_fsync = 0
+
+    def sync(self) -> None:
+        """
+        Forces the appended results to stable storage.
+        """
+        with self._lock:
+            self._sync()
+
+    def close(self) -> None:
+        """
+        Syncs and closes the underlying file (if it was opened for writing).
+        """
+        with self._lock:
+            if self._fd is not None:
+                self._sync()
+                os.close(self._fd)
+                self._fd = None
+
+    def merge_shards(self) -> int:
+        """
+        Appends the results of the worker shards of the log (see `shard_filepath`) and deletes
+        the shards.
+
+        Returns:
+            int: Number of results merged.
+        """
+        root, extension = os.path.splitext(self.filepath)
+        count = 0
+        for shard_filepath in sorted(glob.glob(f'{glob.escape(root)}.worker-*{extension}')):
+            for result in ResultLog(shard_filepath):
+                self.append(result)
+                count += 1
+            self.sync()
+            os.remove(shard_filepath)
+        return count
+
+    def __iter__(self) -> Iterator[dict]:
+        """
+        Streams the results stored in the log, one dictionary at a time.
+        """
+        if not os.path.exists(self.filepath):
+            return
+        with open(self.filepath, 'r', encoding='utf-8') as reader:
+            for line in reader:
+                # A line without newline is a record still being written: ignore it.
+                if line.endswith('\n') and line.strip():
+                    yield json.loads(line)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def compact(self, output_filename: str) -> int:
+        """
+        Writes the log as a single JSON list (the format used by the consumers of the
+        evaluation output, equivalent to `json.dump(results, file, indent=4)`).
+
+        The output is streamed to a temporary file and atomically moved into place.
+
+        Returns:
+            int: Number of results written.
+        """
+        self.sync()
+        tmp_filename = f'{output_filename}.tmp'
+        count = 0
+        with open(tmp_filename, 'w', encoding='utf-8') as writer:
+            writer.write('[')
+            for result in self:
+                writer.write(',\n    ' if count > 0 else '\n    ')
+                writer.write(json.dumps(result, indent=4).replace('\n', '\n    '))
+                count += 1
+            writer.write('\n]' if count > 0 else ']')
+        os.replace(tmp_filename, output_filename)
+        return count
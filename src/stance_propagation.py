@@ -0,0 +1,156 @@
+"""
+stance_propagation.py
+
+This module defines the `TweetGraph` class, a sparse graph of the tweets of the corpus, and
+`propagate_labels`, which spreads the stance of the LLM-labeled tweets to the rest of the graph.
+
+Nodes are tweets, users and conversations. A tweet is connected to:
+    - its author (user node),
+    - the tweets it replies to, quotes or retweets (`referenced_tweets`, when in the corpus),
+    - its conversation (conversation node, for conversations with more than one tweet),
+    - the users it mentions (when the username can be mapped to a user id).
+Each type of edge has its own weight (`TweetGraph.DEFAULT_WEIGHTS`).
+
+Labels are propagated as in Zhou et al. (2004), "Learning with local and global consistency":
+    F <- alpha * S F + (1 - alpha) Y,    S = D^-1/2 W D^-1/2,
+where Y holds the one-hot labels of the seed tweets. The products S F are computed with
+`np.bincount` over the edge list, so each iteration is linear in the number of edges. Nodes not
+connected to any seed get no label.
+
+Usage:
+    graph = TweetGraph(tweets, username2author_id)
+    tweet2stance = propagate_labels(graph, seeds={'14900...': 'right', ...})
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.tweet import Tweet
+
+
+class TweetGraph:
+    """
+    Undirected weighted graph of tweets, users and conversations.
+
+    Attributes:
+        nodes (List[Tuple[str, str]]): (kind, id) of each node, kind being 'tweet', 'user' or
+            'conversation'.
+        rows, cols, weights (np.ndarray): Edge list, with both directions of every edge.
+    """
+    DEFAULT_WEIGHTS = {'author': 1.0, 'replied_to': 1.0, 'quoted': 1.0, 'retweeted': 2.0,
+                       'conversation': 0.5, 'mention': 0.5}
+
+    def __init__(self, tweets: Iterable[Tweet], username2author_id: Optional[Dict[str, str]] = None,
+                 weights: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            username2author_id (Optional[Dict[str, str]]): Lowercase username to user id, to
+                connect mentions (None to ignore mentions).
+            weights (Optional[Dict[str, float]]): Weight of each edge type (missing types use
+                `DEFAULT_WEIGHTS`, weight 0 removes a type).
+        """
+        weights = {**TweetGraph.DEFAULT_WEIGHTS, **(weights or {})}
+        tweets = list({tweet.id: tweet for tweet in tweets}.values())
+        self.nodes: List[Tuple[str, str]] = []
+        self._index: Dict[Tuple[str, str], int] = {}
+        for tweet in tweets:
+            self._node('tweet', tweet.id)
+
+        conversation_sizes = {}
+        for tweet in tweets:
+            conversation_sizes[tweet.conversation_id] = conversation_sizes.get(tweet.conversation_id, 0) + 1
+
+        rows, cols, values = [], [], []
+
+        def connect(first: int, second: int, weight: float) -> None:
+            if weight > 0 and first != second:
+                rows.extend((first, second))
+                cols.extend((second, first))
+                values.extend((weight, weight))
+
+        for tweet in tweets:
+            node = self._index[('tweet', tweet.id)]
+            connect(node, self._node('user', tweet.author_id), weights['author'])
+            for reference in tweet.referenced_tweets or []:
+                referenced = self._index.get(('tweet', str(reference.get('id'))))
+                if referenced is not None:
+                    connect(node, referenced, weights.get(reference.get('type'), 1.0))
+            if conversation_sizes[tweet.conversation_id] > 1:
+                connect(node, self._node('conversation', tweet.conversation_id), weights['conversation'])
+            if username2author_id is not None:
+                for username in set(tweet.mentions):
+                    author_id = username2author_id.get(username.lower())
+                    if author_id is not None:
+                        connect(node, self._node('user', author_id), weights['mention'])
+
+        self.rows = np.array(rows, dtype=np.int64)
+        self.cols = np.array(cols, dtype=np.int64)
+        self.weights = np.array(values, dtype=np.float64)
+        degrees = np.bincount(self.rows, weights=self.weights, minlength=len(self.nodes))
+        inverse_sqrt = np.zeros_like(degrees)
+        inverse_sqrt[degrees > 0] = 1 / np.sqrt(degrees[degrees > 0])
+        # Edge weights of S = D^-1/2 W D^-1/2.
+        self._normalized = self.weights * inverse_sqrt[self.rows] * inverse_sqrt[self.cols]
+
+    def _node(self, kind: str, node_id: str) -> int:
+        key = (kind, node_id)
+        index = self._index.get(key)
+        if index is None:
+            index = self._index[key] = len(self.nodes)
+            self.nodes.append(key)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def index(self, kind: str, node_id: str) -> Optional[int]:
+        return self._index.get((kind, node_id))
+
+    def tweet_ids(self) -> List[str]:
+        return [node_id for kind, node_id in self.nodes if kind == 'tweet']
+
+    def propagate(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        S @ matrix for a (nodes, columns) matrix.
+        """
+        return np.column_stack([np.bincount(self.rows, weights=self._normalized * matrix[self.cols, column],
+                                            minlength=len(self.nodes))
+                                for column in range(matrix.shape[1])])
+
+
+def propagate_labels(graph: TweetGraph, seeds: Dict[str, str], labels: Sequence[str] = ('left', 'neutral', 'right'),
+                     alpha: float = 0.9, max_iterations: int = 100, tolerance: float = 1e-6) -> Dict[str, Tuple[str, float]]:
+    """
+    Spreads the labels of the seed tweets over the graph.
+
+    Args:
+        seeds (Dict[str, str]): Label of each labeled tweet (tweets not in the graph and labels
+            not in `labels` are ignored).
+        alpha (float): Weight of the neighbours against the seed labels (0 < alpha < 1).
+
+    Returns:
+        Dict[str, Tuple[str, float]]: For each tweet connected to a seed, its most likely label
+        and the share of the propagated mass of that label (the confidence).
+    """
+    seed_matrix = np.zeros((len(graph), len(labels)))
+    for tweet_id, label in seeds.items():
+        index = graph.index('tweet', tweet_id)
+        if index is not None and label in labels:
+            seed_matrix[index, labels.index(label)] = 1.0
+
+    scores = seed_matrix.copy()
+    for _ in range(max_iterations):
+        updated = alpha * graph.propagate(scores) + (1 - alpha) * seed_matrix
+        change = np.abs(updated - scores).max()
+        scores = updated
+        if change < tolerance:
+            break
+
+    totals = scores.sum(axis=1)
+    best = scores.argmax(axis=1)
+    result = {}
+    for index, (kind, node_id) in enumerate(graph.nodes):
+        if kind == 'tweet' and totals[index] > 0:
+            result[node_id] = (labels[best[index]], float(scores[index, best[index]] / totals[index]))
+    return result
@@ -0,0 +1,451 @@
+"""
+stance_result_store.py
+
+This module defines the `StanceResultStore` class, an indexed SQLite store shared by every
+script that produces or consumes stance evaluation results.
+
+Instead of loading the whole evaluation output and building an `id2stance` dictionary, the
+consumers query only the tweets (or users) they need, and counting commands are answered with
+aggregate queries over indexed columns.
+
+Tables:
+    - tweet_stances: one row per evaluated tweet (tweet_id, author_id, stance, created_day,
+      model, prompt_version, label_source and the full result as JSON). The label source is
+      'llm' for tweets evaluated by the LLM, 'near_duplicate' for labels copied from a
+      near-duplicate tweet and 'cascade' for labels given by the local classifier.
+    - tweet_hashtags: one row per (tweet_id, hashtag), with the lowercase hashtags of the tweet.
+    - user_stances: one row per evaluated user (author_id, numeric score, model, prompt_version
+      and the full result as JSON). Scores that are not numbers (e.g. 'Not enough information')
+      are stored as NULL.
+
+Usage:
+    store = StanceResultStore('stance_results.sqlite')
+    store.add_tweet_results(results, id2tweet={tweet.id: tweet for tweet in tweets})
+    id2stance = store.get_many([tweet.id for tweet in tweets])
+    per_day = store.counts_by('day', 'stance')
+"""
+
+import json
+import sqlite3
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.result_log import ResultLog
+from src.tweet import Tweet
+
+
+class StanceResultStore:
+    """
+    SQLite-backed store of tweet and user stance results.
+
+    Attributes:
+        filepath (str): Path to the SQLite database file.
+    """
+    # Label sources whose stance was given by the LLM (to the tweet itself or to a near-duplicate).
+    LLM_LABEL_SOURCES = ('llm', 'near_duplicate')
+
+    # Maximum number of parameters bound in a single `IN (...)` clause.
+    _CHUNK_SIZE = 900
+
+    # Columns that can be used to group (or filter) in `counts_by`.
+    _TWEET_COLUMNS = {
+        'day': 't.created_day',
+        'stance': 't.stance',
+        'author_id': 't.author_id',
+        'model': 't.model',
+        'prompt_version': 't.prompt_version',
+        'label_source': 't.label_source',
+        'hashtag': 'h.hashtag',
+    }
+    _USER_COLUMNS = {
+        'score': 'score',
+        'model': 'model',
+        'prompt_version': 'prompt_version',
+    }
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tweet_stances (
+            tweet_id TEXT PRIMARY KEY,
+            author_id TEXT,
+            stance TEXT NOT NULL,
+            created_day TEXT,
+            model TEXT,
+            prompt_version TEXT,
+            label_source TEXT NOT NULL DEFAULT 'llm',
+            result TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tweet_stances_author_id ON tweet_stances (author_id);
+        CREATE INDEX IF NOT EXISTS idx_tweet_stances_day_stance ON tweet_stances (created_day, stance);
+        CREATE INDEX IF NOT EXISTS idx_tweet_stances_stance ON tweet_stances (stance);
+        CREATE INDEX IF NOT EXISTS idx_tweet_stances_source_stance ON tweet_stances (label_source, stance);
+
+        CREATE TABLE IF NOT EXISTS tweet_hashtags (
+            tweet_id TEXT NOT NULL,
+            hashtag TEXT NOT NULL,
+            PRIMARY KEY (tweet_id, hashtag)
+        );
+        CREATE INDEX IF NOT EXISTS idx_tweet_hashtags_hashtag ON tweet_hashtags (hashtag);
+
+        CREATE TABLE IF NOT EXISTS user_stances (
+            author_id TEXT PRIMARY KEY,
+            score REAL,
+            model TEXT,
+            prompt_version TEXT,
+            result TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_user_stances_score ON user_stances (score);
+    """
+
+    def __init__(self, filepath: str, timeout: float = 60.0):
+        """
+        Opens (and creates if needed) the database located at `filepath`.
+
+        The database uses write-ahead logging so that several processes can read while one
+        of them writes.
+        """
+        self.filepath = filepath
+        self._connection = sqlite3.connect(filepath, timeout=timeout)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._migrate_label_sources()
+        self._migrate_user_scores()
+        self._connection.executescript(StanceResultStore._SCHEMA)
+        self._connection.commit()
+
+    def _migrate_user_scores(self) -> None:
+        """
+        Rebuilds a `user_stances` table created with a TEXT score column (older versions) from
+        the stored results, so scores are numbers.
+        """
+        columns = {name: declared_type for _, name, declared_type, *_ in
+                   self._connection.execute('PRAGMA table_info(user_stances)')}
+        if columns.get('score', 'REAL') == 'REAL':
+            return
+        results = [json.loads(result) for (result,) in
+                   self._connection.execute('SELECT result FROM user_stances ORDER BY rowid')]
+        with self._connection:
+            self._connection.execute('DROP TABLE user_stances')
+        self._connection.executescript(StanceResultStore._SCHEMA)
+        self.add_user_results(results)
+
+    def _migrate_label_sources(self) -> None:
+        """
+        Adds the `label_source` column to a `tweet_stances` table created by older versions,
+        filling it from the stored results.
+        """
+        columns = {name for _, name, *_ in self._connection.execute('PRAGMA table_info(tweet_stances)')}
+        if not columns or 'label_source' in columns:
+            return
+        rows = self._connection.execute('SELECT tweet_id, result FROM tweet_stances').fetchall()
+        with self._connection:
+            self._connection.execute("ALTER TABLE tweet_stances ADD COLUMN label_source TEXT NOT NULL DEFAULT 'llm'")
+            self._connection.executemany(
+                'UPDATE tweet_stances SET label_source = ? WHERE tweet_id = ?',
+                [(json.loads(result).get('label_source', 'llm'), tweet_id) for tweet_id, result in rows]
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    # ========== Writing: ==========
+    def add_tweet_results(self, results: Iterable[dict], id2tweet: Optional[Dict[str, Tweet]] = None) -> int:
+        """
+        Inserts (or replaces) tweet results in a single transaction.
+
+        Args:
+            results (Iterable[dict]): Results as returned by `OpenAIStanceDetector.evaluate_tweet`.
+            id2tweet (Optional[Dict[str, Tweet]]): Tweets indexed by id, used to store the day
+                and the hashtags of each result. Results without a tweet keep them empty.
+
+        Returns:
+            int: Number of results written.
+        """
+        id2tweet = id2tweet or {}
+        count = 0
+        with self._connection:
+            for result in results:
+                tweet = id2tweet.get(result['tweet_id'])
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO tweet_stances '
+                    '(tweet_id, author_id, stance, created_day, model, prompt_version, label_source, result) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (result['tweet_id'],
+                     result.get('author_id'),
+                     result['llm_response'],
+                     tweet.created_at.date().isoformat() if tweet is not None else None,
+                     result.get('model'),
+                     result.get('prompt_version'),
+                     result.get('label_source', 'llm'),
+                     json.dumps(result))
+                )
+                if tweet is not None:
+                    self._connection.execute('DELETE FROM tweet_hashtags WHERE tweet_id = ?', (tweet.id,))
+                    self._connection.executemany(
+                        'INSERT OR IGNORE INTO tweet_hashtags (tweet_id, hashtag) VALUES (?, ?)',
+                        [(tweet.id, hashtag) for hashtag in set(tweet.hashtags)]
+                    )
+                count += 1
+        return count
+
+    @staticmethod
+    def numeric_score(score) -> Optional[float]:
+        """
+        The score of a user result as a number (None if the LLM did not give a number).
+        """
+        if isinstance(score, bool):
+            return None
+        try:
+            return float(score)
+        except (TypeError, ValueError):
+            return None
+
+    def add_user_results(self, results: Iterable[dict]) -> int:
+        """
+        Inserts (or replaces) user results, as returned by `OpenAIStanceDetector.evaluate_user`,
+        in a single transaction.
+
+        Returns:
+            int: Number of results written.
+        """
+        count = 0
+        with self._connection:
+            for result in results:
+                score = result['llm_response'].get('score') if isinstance(result['llm_response'], dict) else None
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO user_stances (author_id, score, model, prompt_version, result) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (result['author_id'],
+                     StanceResultStore.numeric_score(score),
+                     result.get('model'),
+                     result.get('prompt_version'),
+                     json.dumps(result))
+                )
+                count += 1
+        return count
+
+    def reconcile_tweet_log(self, result_log: ResultLog,
+                            load_id2tweet: Callable[[], Dict[str, Tweet]]) -> Tuple[int, int]:
+        """
+        Brings a tweet result log and the store back in sync. Results that workers wrote only to
+        the store are appended to the log, and results that reached the log but not the store (a
+        crash in the middle of a batch, or a JSON output imported from an older version) are
+        stored.
+
+        Args:
+            load_id2tweet (Callable[[], Dict[str, Tweet]]): Loads the tweets indexed by id, to
+                store the day and hashtags of the results (only called if results are missing).
+
+        Returns:
+            Tuple[int, int]: Results appended to the log and results added to the store.
+        """
+        stored_ids = self.tweet_ids()
+        logged_ids = set()
+        unstored = []
+        for result_item in result_log:
+            logged_ids.add(result_item['tweet_id'])
+            if result_item['tweet_id'] not in stored_ids:
+                unstored.append(result_item)
+
+        missing = [result for result in self.iter_tweet_results() if result['tweet_id'] not in logged_ids]
+        for result in missing:
+            result_log.append(result)
+        result_log.sync()
+        if unstored:
+            self.add_tweet_results(unstored, id2tweet=load_id2tweet())
+        return len(missing), len(unstored)
+
+    def reconcile_user_log(self, result_log: ResultLog) -> Tuple[int, int]:
+        """
+        Same as `reconcile_tweet_log`, for a user result log.
+        """
+        stored_ids = self.user_ids()
+        logged_ids = set()
+        unstored = []
+        for result_item in result_log:
+            logged_ids.add(result_item['author_id'])
+            if result_item['author_id'] not in stored_ids:
+                unstored.append(result_item)
+
+        missing = [result for result in self.iter_user_results() if result['author_id'] not in logged_ids]
+        for result in missing:
+            result_log.append(result)
+        result_log.sync()
+        if unstored:
+            self.add_user_results(unstored)
+        return len(missing), len(unstored)
+
+    def clear_tweet_results(self) -> None:
+        """
+        Removes every tweet result (and their hashtags) from the store.
+        """
+        with self._connection:
+            self._connection.execute('DELETE FROM tweet_hashtags')
+            self._connection.execute('DELETE FROM tweet_stances')
+
+    def clear_user_results(self) -> None:
+        """
+        Removes every user result from the store.
+        """
+        with self._connection:
+            self._connection.execute('DELETE FROM user_stances')
+
+    # ========== Reading: ==========
+    def _chunks(self, ids: Iterable[str]) -> Iterator[List[str]]:
+        chunk = []
+        for id_ in ids:
+            chunk.append(id_)
+            if len(chunk) == StanceResultStore._CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def get_many(self, tweet_ids: Iterable[str], label_sources: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """
+        Retrieves the stance of the given tweets.
+
+        Args:
+            tweet_ids (Iterable[str]): Ids of the tweets.
+            label_sources (Optional[Iterable[str]]): When given, only the tweets labeled by one
+                of these sources (e.g. ('llm', 'near_duplicate')) are returned.
+
+        Returns:
+            Dict[str, str]: Stance indexed by tweet id, only for the tweets found in the store.
+        """
+        source_filter, source_parameters = '', []
+        if label_sources is not None:
+            source_parameters = list(label_sources)
+            source_filter = f' AND label_source IN ({",".join("?" * len(source_parameters))})'
+        id2stance = {}
+        for chunk in self._chunks(tweet_ids):
+            placeholders = ','.join('?' * len(chunk))
+            rows = self._connection.execute(
+                f'SELECT tweet_id, stance FROM tweet_stances WHERE tweet_id IN ({placeholders}){source_filter}',
+                chunk + source_parameters
+            )
+            id2stance.update(rows)
+        return id2stance
+
+    def get_many_by_author(self, author_ids: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        """
+        Retrieves the stance of every evaluated tweet written by the given authors.
+
+        Returns:
+            Dict[str, Dict[str, str]]: For each author found, the stance indexed by tweet id.
+        """
+        author2stances = {}
+        for chunk in self._chunks(author_ids):
+            placeholders = ','.join('?' * len(chunk))
+            rows = self._connection.execute(
+                f'SELECT author_id, tweet_id, stance FROM tweet_stances WHERE author_id IN ({placeholders})',
+                chunk
+            )
+            for author_id, tweet_id, stance in rows:
+                author2stances.setdefault(author_id, {})[tweet_id] = stance
+        return author2stances
+
+    def get_many_users(self, author_ids: Iterable[str]) -> Dict[str, dict]:
+        """
+        Retrieves the full results of the given users.
+
+        Returns:
+            Dict[str, dict]: Result indexed by author id, only for the users found in the store.
+        """
+        author2result = {}
+        for chunk in self._chunks(author_ids):
+            placeholders = ','.join('?' * len(chunk))
+            rows = self._connection.execute(
+                f'SELECT author_id, result FROM user_stances WHERE author_id IN ({placeholders})',
+                chunk
+            )
+            author2result.update((author_id, json.loads(result)) for author_id, result in rows)
+        return author2result
+
+    def tweet_ids(self) -> set[str]:
+        """
+        Returns the ids of every tweet stored.
+        """
+        return {row[0] for row in self._connection.execute('SELECT tweet_id FROM tweet_stances')}
+
+    def user_ids(self) -> set[str]:
+        """
+        Returns the ids of every user stored.
+        """
+        return {row[0] for row in self._connection.execute('SELECT author_id FROM user_stances')}
+
+    def iter_tweet_results(self) -> Iterator[dict]:
+        """
+        Streams the full tweet results stored (as returned by the detector).
+        """
+        for (result,) in self._connection.execute('SELECT result FROM tweet_stances ORDER BY rowid'):
+            yield json.loads(result)
+
+    def iter_user_results(self) -> Iterator[dict]:
+        """
+        Streams the full user results stored (as returned by the detector).
+        """
+        for (result,) in self._connection.execute('SELECT result FROM user_stances ORDER BY rowid'):
+            yield json.loads(result)
+
+    @staticmethod
+    def _where(columns: Dict[str, str], filters: Dict[str, str]) -> Tuple[str, list]:
+        for name in filters:
+            if name not in columns:
+                raise ValueError(f'Invalid filter column: {name}')
+        if not filters:
+            return '', []
+        clause = ' AND '.join(f'{columns[name]} = ?' for name in filters)
+        return f' WHERE {clause}', list(filters.values())
+
+    def counts_by(self, *group_by: str, **filters: str) -> Dict[Tuple, int]:
+        """
+        Counts the tweet results grouped by the given columns.
+
+        Valid columns (to group by or filter on) are 'day', 'stance', 'hashtag', 'author_id',
+        'model', 'prompt_version' and 'label_source'. When grouping or filtering by 'hashtag', a tweet is
+        counted once for each of its hashtags.
+
+        Example:
+            store.counts_by('day', 'stance', hashtag='honkhonk')
+            # {('2022-01-28', 'right'): 12, ...}
+
+        Returns:
+            Dict[Tuple, int]: Count for each combination of values of the group-by columns
+            (the empty tuple when no column is given).
+        """
+        for name in group_by:
+            if name not in StanceResultStore._TWEET_COLUMNS:
+                raise ValueError(f'Invalid group by column: {name}')
+        columns = [StanceResultStore._TWEET_COLUMNS[name] for name in group_by]
+        where, parameters = StanceResultStore._where(StanceResultStore._TWEET_COLUMNS, filters)
+
+        source = 'tweet_stances t'
+        if 'hashtag' in group_by or 'hashtag' in filters:
+            source += ' JOIN tweet_hashtags h ON h.tweet_id = t.tweet_id'
+
+        select = ', '.join(columns + ['COUNT(*)'])
+        group = f' GROUP BY {", ".join(columns)}' if columns else ''
+        rows = self._connection.execute(f'SELECT {select} FROM {source}{where}{group}', parameters)
+        return {tuple(row[:-1]): row[-1] for row in rows}
+
+    def user_counts_by(self, *group_by: str, **filters: str) -> Dict[Tuple, int]:
+        """
+        Counts the user results grouped by the given columns ('score', 'model' or 'prompt_version').
+
+        Returns:
+            Dict[Tuple, int]: Count for each combination of values of the group-by columns.
+        """
+        for name in group_by:
+            if name not in StanceResultStore._USER_COLUMNS:
+                raise ValueError(f'Invalid group by column: {name}')
+        columns = [StanceResultStore._USER_COLUMNS[name] for name in group_by]
+        where, parameters = StanceResultStore._where(StanceResultStore._USER_COLUMNS, filters)
+        select = ', '.join(columns + ['COUNT(*)'])
+        group = f' GROUP BY {", ".join(columns)}' if columns else ''
+        rows = self._connection.execute(f'SELECT {select} FROM user_stances{where}{group}', parameters)
+        return {tuple(row[:-1]): row[-1] for row in rows}
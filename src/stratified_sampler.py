@@ -0,0 +1,152 @@
+"""
+stratified_sampler.py
+
+This module defines the `StratifiedSampler` class, which schedules the tweets sent to the LLM so
+that the stance proportions of every stratum (e.g. day x hashtag, as plotted by
+create_stance_plots.py) are estimated within a target precision with as few calls as possible.
+
+For each stratum h with N_h tweets, n_h of them labeled, the proportion of each label is
+estimated with a normal-approximation interval (with finite population correction) of width
+    2 * z * sqrt(p (1 - p) / n_h) * sqrt((N_h - n_h) / (N_h - 1)).
+A stratum converges when the widest interval of its labels is below `target_width` (or when all
+its tweets are labeled). Each batch is allocated to the strata that did not converge
+proportionally to N_h * S_h (Neyman allocation, S_h = sqrt(p (1 - p)) of the most uncertain
+label), after giving every stratum `min_labeled` labels.
+
+Usage:
+    sampler = StratifiedSampler(item2stratum, labeled_strata, target_width=0.2)
+    while not sampler.converged:
+        for item_id in sampler.next_batch(200):
+            sampler.add_label(item2stratum[item_id], evaluate(item_id))
+"""
+
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+
+class StratifiedSampler:
+    """
+    Adaptive stratified sampling scheduler.
+
+    Attributes:
+        target_width (float): Maximum width of the confidence interval of every proportion.
+        z (float): Normal quantile of the confidence level (1.96 for 95%).
+        min_labeled (int): Labels required in a stratum before its interval is trusted.
+    """
+
+    def __init__(self, item2stratum: Dict[str, Hashable], labeled_strata: Iterable[Tuple[Hashable, str]],
+                 target_width: float, labels: Sequence[str] = ('left', 'neutral', 'right'),
+                 z: float = 1.96, min_labeled: int = 5):
+        """
+        Args:
+            item2stratum (Dict[str, Hashable]): Stratum of each unlabeled item. Items of a stratum
+                are sampled in the order of the dictionary.
+            labeled_strata (Iterable[Tuple[Hashable, str]]): (stratum, label) of the items
+                labeled already.
+        """
+        self.target_width = target_width
+        self.labels = tuple(labels)
+        self.z = z
+        self.min_labeled = min_labeled
+        self._pool: Dict[Hashable, List[str]] = {}
+        for item_id, stratum in item2stratum.items():
+            self._pool.setdefault(stratum, []).append(item_id)
+        for items in self._pool.values():
+            items.reverse()  # Items are popped from the end.
+        self._counts: Dict[Hashable, Counter] = {stratum: Counter() for stratum in self._pool}
+        for stratum, label in labeled_strata:
+            self._counts.setdefault(stratum, Counter())[label] += 1
+        self._population = {stratum: len(self._pool.get(stratum, [])) + sum(counts.values())
+                            for stratum, counts in self._counts.items()}
+
+    @property
+    def strata(self) -> List[Hashable]:
+        return list(self._counts)
+
+    def labeled(self, stratum: Hashable) -> int:
+        return sum(self._counts[stratum].values())
+
+    def remaining(self, stratum: Hashable) -> int:
+        return len(self._pool.get(stratum, []))
+
+    def _max_variance(self, stratum: Hashable) -> float:
+        """
+        Largest p (1 - p) among the labels, with add-one smoothing so small samples stay uncertain.
+        """
+        counts = self._counts[stratum]
+        n = sum(counts.values())
+        proportions = np.array([(counts[label] + 1) / (n + len(self.labels)) for label in self.labels])
+        return float((proportions * (1 - proportions)).max())
+
+    def interval_width(self, stratum: Hashable) -> float:
+        n = self.labeled(stratum)
+        population = self._population[stratum]
+        if n == population:
+            return 0.0
+        if n == 0:
+            return float('inf')
+        correction = np.sqrt((population - n) / (population - 1)) if population > 1 else 0.0
+        return float(2 * self.z * np.sqrt(self._max_variance(stratum) / n) * correction)
+
+    def is_converged(self, stratum: Hashable) -> bool:
+        if self.remaining(stratum) == 0:
+            return True
+        return self.labeled(stratum) >= self.min_labeled and self.interval_width(stratum) <= self.target_width
+
+    @property
+    def converged(self) -> bool:
+        return all(self.is_converged(stratum) for stratum in self._counts)
+
+    def next_batch(self, size: int) -> List[str]:
+        """
+        Picks up to `size` unlabeled items from the strata that did not converge.
+        """
+        open_strata = [stratum for stratum in self._counts if not self.is_converged(stratum)]
+        allocation = Counter()
+
+        # Every stratum first gets `min_labeled` labels.
+        for stratum in open_strata:
+            allocation[stratum] = min(max(0, self.min_labeled - self.labeled(stratum)), self.remaining(stratum))
+        budget = size - sum(allocation.values())
+        if budget < 0:
+            # Not enough room for the minimum of every stratum: smallest strata first.
+            allocation = Counter()
+            budget = size
+            for stratum in sorted(open_strata, key=lambda stratum: self.labeled(stratum)):
+                take = min(max(0, self.min_labeled - self.labeled(stratum)), self.remaining(stratum), budget)
+                allocation[stratum] = take
+                budget -= take
+            budget = 0
+
+        # The rest is split proportionally to N_h * S_h (largest remainders first).
+        while budget > 0:
+            candidates = [stratum for stratum in open_strata if self.remaining(stratum) > allocation[stratum]]
+            if not candidates:
+                break
+            weights = np.array([self._population[stratum] * np.sqrt(self._max_variance(stratum)) for stratum in candidates])
+            shares = weights / weights.sum() * budget
+            takes = np.floor(shares).astype(int)
+            for k in np.argsort(-(shares - takes))[:budget - takes.sum()]:
+                takes[k] += 1
+            for stratum, take in zip(candidates, takes):
+                take = min(int(take), self.remaining(stratum) - allocation[stratum])
+                allocation[stratum] += take
+                budget -= take
+
+        batch = []
+        for stratum, take in allocation.items():
+            batch.extend(self._pool[stratum].pop() for _ in range(take))
+        return batch
+
+    def add_label(self, stratum: Hashable, label: str) -> None:
+        self._counts[stratum][label] += 1
+
+    def report(self) -> List[Tuple[Hashable, int, int, float]]:
+        """
+        (stratum, labeled items, population, interval width) of every stratum, widest first.
+        """
+        rows = [(stratum, self.labeled(stratum), self._population[stratum], self.interval_width(stratum))
+                for stratum in self._counts]
+        return sorted(rows, key=lambda row: -row[3])
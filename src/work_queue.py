@@ -0,0 +1,207 @@
+"""
+work_queue.py
+
+This module defines the `WorkQueue` class, a crash-safe queue of item ids (tweet ids or
+author ids) shared by several local worker processes through a SQLite database.
+
+Workers claim disjoint groups of items with a lease that expires after `lease_seconds`. A
+worker that is killed stops renewing its leases, and its items become claimable again once
+the leases expire, so no item is lost. Claiming is done inside an exclusive transaction, so
+two live workers never hold the same item.
+
+Usage:
+    queue = WorkQueue('queue.sqlite', queue_name='tweets')
+    queue.enqueue(tweet_ids)
+    while (item_ids := queue.claim(owner='worker-1', max_items=20, lease_seconds=600)):
+        ...  # evaluate and store the results
+        queue.complete('worker-1', item_ids)
+"""
+
+import sqlite3
+import time
+from typing import Dict, Iterable, List
+
+
+class WorkQueue:
+    """
+    Lock-protected queue of item ids with expiring leases.
+
+    Attributes:
+        filepath (str): Path to the SQLite database file.
+        queue_name (str): Name of the queue (several queues can share a database).
+    """
+    PENDING = 'pending'
+    CLAIMED = 'claimed'
+    DONE = 'done'
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS work_items (
+            queue TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            owner TEXT,
+            lease_expires_at REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (queue, item_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_work_items_status ON work_items (queue, status, lease_expires_at);
+    """
+
+    def __init__(self, filepath: str, queue_name: str, timeout: float = 60.0):
+        self.filepath = filepath
+        self.queue_name = queue_name
+        # Transactions are managed explicitly (BEGIN IMMEDIATE) to lock the database on claims.
+        self._connection = sqlite3.connect(filepath, timeout=timeout, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(WorkQueue._SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _transaction(self, statements: Iterable[tuple]) -> None:
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, parameters in statements:
+                self._connection.execute(sql, parameters)
+            self._connection.execute('COMMIT')
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+
+    def enqueue(self, item_ids: Iterable[str]) -> int:
+        """
+        Adds items to the queue. Items already in the queue (in any status) are ignored.
+
+        Returns:
+            int: Number of new items.
+        """
+        before = self._count()
+        self._transaction(
+            ('INSERT OR IGNORE INTO work_items (queue, item_id, status) VALUES (?, ?, ?)',
+             (self.queue_name, item_id, WorkQueue.PENDING))
+            for item_id in item_ids
+        )
+        return self._count() - before
+
+    def claim(self, owner: str, max_items: int, lease_seconds: float) -> List[str]:
+        """
+        Claims up to `max_items` items that are pending or whose lease expired.
+
+        Returns:
+            List[str]: The claimed item ids (empty if nothing is claimable right now).
+        """
+        now = time.time()
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self._connection.execute(
+                'SELECT item_id FROM work_items WHERE queue = ? AND '
+                '(status = ? OR (status = ? AND lease_expires_at < ?)) ORDER BY rowid LIMIT ?',
+                (self.queue_name, WorkQueue.PENDING, WorkQueue.CLAIMED, now, max_items)
+            ).fetchall()
+            item_ids = [row[0] for row in rows]
+            self._connection.executemany(
+                'UPDATE work_items SET status = ?, owner = ?, lease_expires_at = ?, attempts = attempts + 1 '
+                'WHERE queue = ? AND item_id = ?',
+                [(WorkQueue.CLAIMED, owner, now + lease_seconds, self.queue_name, item_id) for item_id in item_ids]
+            )
+            self._connection.execute('COMMIT')
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        return item_ids
+
+    def renew(self, owner: str, item_ids: Iterable[str], lease_seconds: float) -> List[str]:
+        """
+        Extends the lease of items still held by `owner`.
+
+        Returns:
+            List[str]: The ids whose lease was renewed. Items whose lease expired and that were
+            claimed by another worker are left out.
+        """
+        expires_at = time.time() + lease_seconds
+        renewed = []
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            for item_id in item_ids:
+                cursor = self._connection.execute(
+                    'UPDATE work_items SET lease_expires_at = ? '
+                    'WHERE queue = ? AND item_id = ? AND owner = ? AND status = ?',
+                    (expires_at, self.queue_name, item_id, owner, WorkQueue.CLAIMED)
+                )
+                if cursor.rowcount > 0:
+                    renewed.append(item_id)
+            self._connection.execute('COMMIT')
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        return renewed
+
+    def complete(self, owner: str, item_ids: Iterable[str]) -> None:
+        """
+        Marks items as done. Must be called after their results are durably stored.
+        """
+        self._transaction(
+            ('UPDATE work_items SET status = ?, lease_expires_at = NULL WHERE queue = ? AND item_id = ? AND owner = ?',
+             (WorkQueue.DONE, self.queue_name, item_id, owner))
+            for item_id in item_ids
+        )
+
+    def release(self, owner: str, item_ids: Iterable[str]) -> None:
+        """
+        Gives back items held by `owner` so that other workers can claim them immediately.
+        """
+        self._transaction(
+            ('UPDATE work_items SET status = ?, owner = NULL, lease_expires_at = NULL '
+             'WHERE queue = ? AND item_id = ? AND owner = ? AND status = ?',
+             (WorkQueue.PENDING, self.queue_name, item_id, owner, WorkQueue.CLAIMED))
+            for item_id in item_ids
+        )
+
+    def purge_done(self) -> None:
+        """
+        Removes the items already done from the queue.
+        """
+        self._transaction([('DELETE FROM work_items WHERE queue = ? AND status = ?',
+                            (self.queue_name, WorkQueue.DONE))])
+
+    def clear(self) -> None:
+        """
+        Removes every item from the queue.
+        """
+        self._transaction([('DELETE FROM work_items WHERE queue = ?', (self.queue_name,))])
+
+    def _count(self) -> int:
+        return self._connection.execute('SELECT COUNT(*) FROM work_items WHERE queue = ?',
+                                        (self.queue_name,)).fetchone()[0]
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Returns the number of items in each status.
+        """
+        rows = self._connection.execute(
+            'SELECT status, COUNT(*) FROM work_items WHERE queue = ? GROUP BY status', (self.queue_name,)
+        )
+        return {WorkQueue.PENDING: 0, WorkQueue.CLAIMED: 0, WorkQueue.DONE: 0, **dict(rows)}
+
+    def remaining(self) -> int:
+        """
+        Returns the number of items not done yet (pending or claimed).
+        """
+        counts = self.counts()
+        return counts[WorkQueue.PENDING] + counts[WorkQueue.CLAIMED]
+
+    def remaining_ids(self) -> List[str]:
+        """
+        Returns the ids of the items not done yet (pending or claimed), in queue order.
+        """
+        rows = self._connection.execute(
+            'SELECT item_id FROM work_items WHERE queue = ? AND status != ? ORDER BY rowid',
+            (self.queue_name, WorkQueue.DONE)
+        )
+        return [row[0] for row in rows]
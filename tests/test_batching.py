@@ -0,0 +1,44 @@
+import unittest
+import sys
+sys.path.append('..')
+from core.batching import contiguous_shards, token_budget_batches
+
+class TestTokenBudgetBatches(unittest.TestCase):
+
+    def test_every_item_is_batched_once(self):
+        """Test that the batches are a partition of the indices."""
+        lengths = [30, 5, 120, 5, 60, 45, 8, 200, 33, 17]
+        batches = token_budget_batches(lengths, max_tokens=128)
+        self.assertEqual(sorted(index for batch in batches for index in batch), list(range(len(lengths))))
+
+    def test_padded_size_within_budget(self):
+        """Test that batches padded to their longest item fit the token budget."""
+        lengths = [30, 5, 120, 5, 60, 45, 8, 33, 17, 64, 12]
+        for batch in token_budget_batches(lengths, max_tokens=128):
+            self.assertLessEqual(len(batch) * max(lengths[index] for index in batch), 128)
+
+    def test_short_items_share_large_batches(self):
+        """Test that items are grouped by length, short items together."""
+        lengths = [100, 10, 100, 10, 10, 10]
+        self.assertEqual(token_budget_batches(lengths, max_tokens=200), [[1, 3, 4, 5], [0, 2]])
+
+    def test_max_batch_size_and_long_items(self):
+        """Test the batch size limit, and that an item over the budget is batched alone."""
+        self.assertEqual(token_budget_batches([1] * 5, max_tokens=100, max_batch_size=2), [[0, 1], [2, 3], [4]])
+        self.assertEqual(token_budget_batches([500, 10], max_tokens=100), [[1], [0]])
+
+
+class TestContiguousShards(unittest.TestCase):
+
+    def test_shards_cover_items_in_order(self):
+        """Test that the shards are contiguous, in order, and balanced."""
+        self.assertEqual(contiguous_shards(10, 3), [(0, 4), (4, 7), (7, 10)])
+
+    def test_more_shards_than_items(self):
+        """Test that empty shards are dropped."""
+        self.assertEqual(contiguous_shards(2, 4), [(0, 1), (1, 2)])
+        self.assertEqual(contiguous_shards(0, 4), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+import sys
+import numpy as np
+sys.path.append('..')
+from core.calibration import fit_temperature, negative_log_likelihood, softmax
+
+class TestCalibration(unittest.TestCase):
+
+    def test_softmax_rows_sum_to_one(self):
+        """Test that the probabilities are normalized and keep the argmax at any temperature."""
+        logits = np.array([[2.0, 1.0, -1.0], [0.0, 5.0, 4.0]])
+        for temperature in (0.5, 1.0, 3.0):
+            probabilities = softmax(logits, temperature)
+            np.testing.assert_allclose(probabilities.sum(axis=1), 1.0)
+            self.assertEqual(list(probabilities.argmax(axis=1)), [0, 1])
+
+    def test_overconfident_logits_get_a_higher_temperature(self):
+        """Test that logits right only 70% of the time are softened (T > 1)."""
+        rng = np.random.default_rng(seed=0)
+        targets = rng.integers(0, 3, size=500)
+        predicted = np.where(rng.random(500) < 0.7, targets, (targets + 1) % 3)
+        logits = np.zeros((500, 3))
+        logits[np.arange(500), predicted] = 10.0
+        temperature = fit_temperature(logits, targets)
+        self.assertGreater(temperature, 1.0)
+        self.assertLess(negative_log_likelihood(logits, targets, temperature),
+                        negative_log_likelihood(logits, targets, 1.0))
+        # The calibrated confidence matches the accuracy.
+        self.assertAlmostEqual(softmax(logits, temperature).max(axis=1).mean(), 0.7, delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
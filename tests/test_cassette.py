@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+import sys
+from types import SimpleNamespace
+sys.path.append('..')
+from core.cassette import CassetteMissError, CassettePlayer, CassetteRecorder, run_filepath
+
+class FakePool:
+    """Answers every request with the next of the given outputs."""
+
+    def __init__(self, outputs):
+        self.outputs = list(outputs)
+
+    def create_response(self, **kwargs):
+        return SimpleNamespace(output_text=self.outputs.pop(0),
+                               usage=SimpleNamespace(input_tokens=100, output_tokens=1))
+
+class TestCassette(unittest.TestCase):
+
+    def setUp(self):
+        """Create a cassette path in a temporary folder."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp_dir.name, 'cassette.jsonl')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def record(self, requests, outputs):
+        recorder = CassetteRecorder(FakePool(outputs), self.filepath)
+        for request in requests:
+            recorder.create_response(**request)
+        recorder.close()
+
+    def test_replay(self):
+        """Test that replayed responses match the recorded ones."""
+        self.record([{'model': 'm', 'input': 'a'}, {'model': 'm', 'input': 'b'}], ['left', 'right'])
+        player = CassettePlayer(self.filepath)
+        self.assertEqual(len(player), 2)
+        response = player.create_response(model='m', input='b')
+        self.assertEqual(response.output_text, 'right')
+        self.assertEqual(response.usage.input_tokens, 100)
+        self.assertEqual(player.create_response(input='a', model='m').output_text, 'left')
+
+    def test_repeated_request_replayed_in_order(self):
+        """Test that a request recorded several times is answered in the recorded order."""
+        self.record([{'input': 'a'}, {'input': 'a'}], ['???', 'neutral'])
+        player = CassettePlayer(self.filepath)
+        self.assertEqual([player.create_response(input='a').output_text for _ in range(3)],
+                         ['???', 'neutral', '???'])
+
+    def test_miss(self):
+        """Test that requests that were not recorded raise an error."""
+        self.record([{'input': 'a'}], ['left'])
+        with self.assertRaises(CassetteMissError):
+            CassettePlayer(self.filepath).create_response(input='c')
+
+    def test_run_filepath(self):
+        """Test that record and replay runs get their own output files."""
+        self.assertEqual(run_filepath('data/log.jsonl', 'record'), 'data/log.record.jsonl')
+        self.assertEqual(run_filepath('data/store.sqlite', 'replay'), 'data/store.replay.sqlite')
+        self.assertEqual(run_filepath('data/log.jsonl', 'openai'), 'data/log.jsonl')
+        self.assertEqual(run_filepath('data/log.jsonl', 'mock'), 'data/log.jsonl')
+
+if __name__ == "__main__":
+    unittest.main()
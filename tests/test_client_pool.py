@@ -0,0 +1,111 @@
+import time
+import unittest
+import sys
+from types import SimpleNamespace
+from unittest import mock
+sys.path.append('..')
+from openai import RateLimitError
+from core.client_pool import OpenAIClientPool
+
+class FakeRateLimitError(RateLimitError):
+    """429 error with an optional retry-after header, without an HTTP response."""
+
+    def __init__(self, retry_after=None):
+        Exception.__init__(self, 'Rate limit reached')
+        self.response = SimpleNamespace(headers={} if retry_after is None else {'retry-after': str(retry_after)})
+
+def rate_limit_error(retry_after=None):
+    return FakeRateLimitError(retry_after)
+
+class FakeClient:
+    """Client whose `responses.create` raises the given errors, then answers with its name."""
+
+    def __init__(self, name, errors=()):
+        self.name = name
+        self.errors = list(errors)
+        self.calls = 0
+        self.responses = self
+
+    def create(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.name
+
+class TestOpenAIClientPool(unittest.TestCase):
+
+    def pool(self, *clients):
+        pool = OpenAIClientPool([client.name for client in clients], requests_per_minute=6000,
+                                api_keys={client.name: 'sk-test' for client in clients})
+        for key, client in zip(pool._keys, clients):
+            key.client = client
+        return pool
+
+    def test_clients_do_not_retry(self):
+        """Test that the OpenAI clients leave the retries to the pool."""
+        pool = OpenAIClientPool(['project_key'], requests_per_minute=60, api_keys={'project_key': 'sk-test'})
+        self.assertEqual(pool._keys[0].client.max_retries, 0)
+
+    def test_least_loaded_key_is_selected(self):
+        """Test that a key with a request in flight is not chosen while another key is free."""
+        pool = self.pool(FakeClient('a'), FakeClient('b'))
+        first = pool._acquire()
+        second = pool._acquire()
+        self.assertNotEqual(first.name, second.name)
+        pool._release(first)
+        pool._release(second)
+        self.assertEqual(pool.stats(), {'a': {'requests': 1, 'rate_limited': 0, 'errors': 0},
+                                        'b': {'requests': 1, 'rate_limited': 0, 'errors': 0}})
+
+    def test_rate_limited_key_cools_down(self):
+        """Test that a 429 fails over to the other key and cools the key down (following retry-after)."""
+        limited, healthy = FakeClient('a', [rate_limit_error(retry_after=30)]), FakeClient('b')
+        pool = self.pool(limited, healthy)
+        pool._keys[1].in_flight = 1  # Make the pool try the first key first.
+        self.assertEqual(pool.create_response(model='m', input='x'), 'b')
+        pool._keys[1].in_flight = 0
+        self.assertGreaterEqual(pool._keys[0].cooldown_until - time.monotonic(), 29)
+        self.assertEqual(pool._keys[0].consecutive_rate_limits, 1)
+
+        for _ in range(3):
+            self.assertEqual(pool.create_response(model='m', input='x'), 'b')
+        self.assertEqual(limited.calls, 1)
+        self.assertEqual(pool.stats()['a']['rate_limited'], 1)
+
+    def test_cooldown_grows_exponentially(self):
+        """Test the exponential cool-down, capped at MAX_COOLDOWN_SECONDS, and its reset."""
+        pool = self.pool(FakeClient('a'))
+        key = pool._keys[0]
+        cooldowns = []
+        for _ in range(8):
+            key.in_flight += 1
+            pool._release(key, rate_limited=True)
+            cooldowns.append(round(key.cooldown_until - time.monotonic()))
+        self.assertEqual(cooldowns, [2, 4, 8, 16, 32, 64, 120, 120])
+        key.in_flight += 1
+        pool._release(key)
+        self.assertEqual(key.consecutive_rate_limits, 0)
+
+    def test_error_raised_when_every_key_is_rate_limited(self):
+        """Test that create_response gives up after len(keys) ** 2 rate-limited attempts."""
+        clients = [FakeClient('a', [rate_limit_error() for _ in range(5)]),
+                   FakeClient('b', [rate_limit_error() for _ in range(5)])]
+        pool = self.pool(*clients)
+        with mock.patch.object(OpenAIClientPool, 'BASE_COOLDOWN_SECONDS', 0.01), \
+             mock.patch.object(OpenAIClientPool, 'MAX_COOLDOWN_SECONDS', 0.01):
+            with self.assertRaises(RateLimitError):
+                pool.create_response(model='m', input='x')
+        self.assertEqual(sum(client.calls for client in clients), 4)
+
+    def test_other_errors_are_not_retried(self):
+        """Test that an error other than a 429 is raised at once and counted."""
+        client = FakeClient('a', [ValueError('bad request')])
+        pool = self.pool(client, FakeClient('b'))
+        pool._keys[1].in_flight = 1
+        with self.assertRaises(ValueError):
+            pool.create_response(model='m', input='x')
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(pool.stats()['a']['errors'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
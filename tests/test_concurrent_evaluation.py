@@ -0,0 +1,96 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+import sys
+from types import SimpleNamespace
+sys.path.append('..')
+from core.cassette import CassetteMissError
+from core.concurrent_evaluation import evaluate_concurrently
+from core.usage_metrics import BudgetExceededError
+from src.dead_letter_queue import DeadLetterQueue
+
+class FakeDetector:
+    """Evaluates a user after the given delay, or raises the given error."""
+
+    def __init__(self, delays=None, errors=None):
+        self.delays = delays or {}
+        self.errors = errors or {}
+        self.evaluated = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def evaluate_user(self, tweets):
+        author_id = tweets[0].author_id
+        with self._lock:
+            self.evaluated.append(author_id)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delays.get(author_id, 0.01))
+            if author_id in self.errors:
+                raise self.errors[author_id]
+            return {'author_id': author_id, 'llm_response': {'score': 5}}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+class TestEvaluateConcurrently(unittest.TestCase):
+
+    def setUp(self):
+        """Create a dead-letter queue in a temporary folder and ten users."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dead_letters = DeadLetterQueue(os.path.join(self.tmp_dir.name, 'dead_letters.jsonl'), id_key='author_id')
+        self.author_ids = [str(k) for k in range(10)]
+        self.author2tweets = {author_id: [SimpleNamespace(author_id=author_id)] for author_id in self.author_ids}
+
+    def tearDown(self):
+        self.dead_letters.close()
+        self.tmp_dir.cleanup()
+
+    def evaluate(self, detector, concurrency):
+        return [result['author_id'] for result in
+                evaluate_concurrently(detector, self.author_ids, self.author2tweets, self.dead_letters, concurrency)]
+
+    def test_results_in_completion_order(self):
+        """Test that a slow user does not hold back the users dispatched after it."""
+        detector = FakeDetector(delays={'0': 0.3})
+        evaluated = self.evaluate(detector, concurrency=3)
+        self.assertEqual(sorted(evaluated), sorted(self.author_ids))
+        self.assertEqual(evaluated[-1], '0')
+        self.assertEqual(detector.evaluated[:3], ['0', '1', '2'])
+
+    def test_concurrency_is_bounded(self):
+        """Test that at most `concurrency` calls are in flight, and that the pool is kept full."""
+        detector = FakeDetector(delays={author_id: 0.05 for author_id in self.author_ids})
+        self.evaluate(detector, concurrency=4)
+        self.assertEqual(detector.max_in_flight, 4)
+
+    def test_failures_go_to_dead_letter_queue(self):
+        """Test that failed users are dead-lettered and the others still evaluated."""
+        detector = FakeDetector(errors={'3': ValueError('malformed output'), '7': RuntimeError('timeout')})
+        evaluated = self.evaluate(detector, concurrency=2)
+        self.assertEqual(sorted(evaluated), sorted(set(self.author_ids) - {'3', '7'}))
+        self.assertEqual(sorted(self.dead_letters.ids()), ['3', '7'])
+        self.assertEqual({entry['error'].split(':')[0] for entry in self.dead_letters.entries()},
+                         {'ValueError', 'RuntimeError'})
+
+    def test_budget_stops_dispatch(self):
+        """Test that no user is dispatched once the budget is spent, and that it is not dead-lettered."""
+        detector = FakeDetector(errors={'2': BudgetExceededError('Budget reached.')})
+        evaluated = self.evaluate(detector, concurrency=1)
+        self.assertEqual(evaluated, ['0', '1'])
+        self.assertEqual(detector.evaluated, ['0', '1', '2'])
+        self.assertEqual(len(self.dead_letters), 0)
+
+    def test_fatal_errors_are_raised(self):
+        """Test that fatal errors stop the run instead of being dead-lettered."""
+        detector = FakeDetector(errors={'1': CassetteMissError('not recorded')})
+        with self.assertRaises(CassetteMissError):
+            self.evaluate(detector, concurrency=2)
+        self.assertEqual(len(self.dead_letters), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+import sys
+sys.path.append('..')
+from src.dead_letter_queue import DeadLetterQueue
+
+class TestDeadLetterQueue(unittest.TestCase):
+
+    def setUp(self):
+        """Create a dead-letter queue in a temporary folder."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp_dir.name, 'dead_letters.jsonl')
+        self.dead_letters = DeadLetterQueue(self.filepath, id_key='tweet_id')
+
+    def tearDown(self):
+        self.dead_letters.close()
+        self.tmp_dir.cleanup()
+
+    def test_add_records_error(self):
+        """Test that an entry keeps the id and the error of the failure."""
+        self.dead_letters.add('1', ValueError('Got wrong response from LLM.'))
+        entry = self.dead_letters.entries()[0]
+        self.assertEqual(entry['tweet_id'], '1')
+        self.assertEqual(entry['error'], 'ValueError: Got wrong response from LLM.')
+        self.assertIn('failed_at', entry)
+
+    def test_ids_are_unique(self):
+        """Test that an item failing several times is listed once."""
+        self.dead_letters.add('1', ValueError())
+        self.dead_letters.add('2', ValueError())
+        self.dead_letters.add('1', ValueError())
+        self.assertEqual(self.dead_letters.ids(), ['1', '2'])
+        self.assertEqual(len(self.dead_letters), 2)
+
+    def test_persisted(self):
+        """Test that entries survive reopening the queue."""
+        self.dead_letters.add('1', ValueError())
+        self.dead_letters.close()
+        self.assertEqual(DeadLetterQueue(self.filepath, id_key='tweet_id').ids(), ['1'])
+
+    def test_remove(self):
+        """Test that removed items disappear and new failures can still be added."""
+        for tweet_id in ['1', '2', '3']:
+            self.dead_letters.add(tweet_id, ValueError())
+        self.dead_letters.remove(['1', '3'])
+        self.assertEqual(self.dead_letters.ids(), ['2'])
+        self.dead_letters.add('4', ValueError())
+        self.assertEqual(self.dead_letters.ids(), ['2', '4'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import sys
+import tempfile
+import os
+sys.path.append('..')
+import numpy as np
+from src.embedding_index import IVFIndex, exact_search, load_embeddings, recall_at_k, write_embeddings
+
+class TestEmbeddingIndex(unittest.TestCase):
+
+    @staticmethod
+    def normalized(matrix):
+        return (matrix / np.linalg.norm(matrix, axis=1, keepdims=True)).astype(np.float32)
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # Clustered vectors, as sentence embeddings are.
+        centers = rng.normal(size=(20, 32))
+        self.vectors = self.normalized(centers[rng.integers(0, 20, 4000)] + 0.3 * rng.normal(size=(4000, 32)))
+        self.queries = self.normalized(centers[rng.integers(0, 20, 50)] + 0.3 * rng.normal(size=(50, 32)))
+
+    def test_exact_search_matches_brute_force(self):
+        """Test that the chunked exact search returns the highest inner products, best first."""
+        scores, rows = exact_search(self.vectors, self.queries, k=5, chunk_size=700)
+        expected = np.argsort(-(self.queries @ self.vectors.T), axis=1)[:, :5]
+        np.testing.assert_array_equal(rows, expected)
+        self.assertTrue(np.all(np.diff(scores, axis=1) <= 0))
+
+    def test_ivf_recall_grows_with_nprobe(self):
+        """Test that probing more lists finds more exact neighbours, and every list finds all of them."""
+        index = IVFIndex(n_lists=32, nprobe=2, seed=1).train(self.vectors).add(self.vectors)
+        self.assertEqual(index.list_sizes().sum(), len(self.vectors))
+        _, exact = exact_search(self.vectors, self.queries, k=10)
+        recalls = [recall_at_k(index.search(self.queries, k=10, nprobe=nprobe)[1], exact) for nprobe in (1, 4, 32)]
+        self.assertLessEqual(recalls[0], recalls[1])
+        self.assertGreater(recalls[1], 0.8)
+        self.assertEqual(recalls[2], 1.0)
+
+    def test_search_pads_missing_neighbours(self):
+        """Test that a search with fewer candidates than k pads with row -1."""
+        index = IVFIndex(n_lists=4, seed=1).train(self.vectors[:8]).add(self.vectors[:8])
+        scores, rows = index.search(self.queries[:3], k=10, nprobe=4)
+        self.assertTrue(np.all(rows[:, 8:] == -1))
+        self.assertTrue(np.all(np.isinf(scores[:, 8:])))
+
+    def test_memmap_roundtrip_and_saved_index(self):
+        """Test that embeddings are written as float16 rows aligned with the ids, and a saved index reloads."""
+        with tempfile.TemporaryDirectory() as folder:
+            ids = [str(k) for k in range(len(self.vectors))]
+            texts = list(range(len(self.vectors)))
+            matrix = write_embeddings(folder, ids, texts, lambda batch: self.vectors[batch], 32, batch_size=512)
+            loaded_ids, loaded = load_embeddings(folder)
+            self.assertEqual(loaded_ids, ids)
+            self.assertEqual(loaded.dtype, np.float16)
+            np.testing.assert_allclose(loaded, self.vectors, atol=1e-3)
+
+            index = IVFIndex(n_lists=16, nprobe=4).train(matrix).add(matrix)
+            index.save(os.path.join(folder, 'index.npz'))
+            reloaded = IVFIndex.load(os.path.join(folder, 'index.npz'), loaded)
+            np.testing.assert_array_equal(reloaded.search(self.queries, k=5)[1], index.search(self.queries, k=5)[1])
+            del matrix, loaded, reloaded, index
+
+if __name__ == '__main__':
+    unittest.main()
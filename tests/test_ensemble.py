@@ -0,0 +1,60 @@
+import unittest
+import sys
+sys.path.append('..')
+from core.ensemble import EnsembleStats, early_exit_vote
+
+class TestEarlyExitVote(unittest.TestCase):
+
+    def setUp(self):
+        self.models = ['nano', 'mini', 'full']
+
+    def _ask(self, answers):
+        asked = []
+        def ask(model):
+            asked.append(model)
+            return answers[model]
+        return ask, asked
+
+    def test_stops_when_first_models_agree(self):
+        """Test that the third model is not called when the first two agree."""
+        ask, asked = self._ask({'nano': 'left', 'mini': 'left', 'full': 'right'})
+        self.assertEqual(early_exit_vote(self.models, ask, agreement=2), ('left', {'nano': 'left', 'mini': 'left'}))
+        self.assertEqual(asked, ['nano', 'mini'])
+
+    def test_escalates_on_disagreement(self):
+        """Test that a disagreement is settled by the next model."""
+        ask, asked = self._ask({'nano': 'left', 'mini': 'neutral', 'full': 'neutral'})
+        self.assertEqual(early_exit_vote(self.models, ask, agreement=2)[0], 'neutral')
+        self.assertEqual(asked, self.models)
+
+    def test_no_agreement_falls_back_to_first_vote(self):
+        """Test that without agreement the label voted first wins the tie."""
+        ask, _ = self._ask({'nano': 'left', 'mini': 'neutral', 'full': 'right'})
+        self.assertEqual(early_exit_vote(self.models, ask, agreement=2)[0], 'left')
+
+    def test_repeated_models_are_rejected(self):
+        """Test that a model cannot be listed twice (its votes would be merged)."""
+        ask, asked = self._ask({'nano': 'left', 'mini': 'left'})
+        with self.assertRaises(AssertionError):
+            early_exit_vote(['nano', 'nano', 'mini'], ask, agreement=2)
+        self.assertEqual(asked, [])
+
+    def test_stops_when_agreement_is_impossible(self):
+        """Test that the vote stops once no label can reach the agreement."""
+        ask, asked = self._ask({'nano': 'left', 'mini': 'neutral', 'full': 'right'})
+        early_exit_vote(self.models, ask, agreement=3)
+        self.assertEqual(asked, ['nano', 'mini'])
+
+    def test_stats(self):
+        """Test the calls per item and agreement rate."""
+        stats = EnsembleStats(agreement=2)
+        stats.record({'nano': 'left', 'mini': 'left'})
+        stats.record({'nano': 'left', 'mini': 'right', 'full': 'neutral'})
+        summary = stats.summary()
+        self.assertEqual(summary['mean_calls_per_item'], 2.5)
+        self.assertEqual(summary['calls_histogram'], {2: 1, 3: 1})
+        self.assertEqual(summary['agreement_rate'], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import sys
+sys.path.append('..')
+from src.hash_sampler import HashSampler
+
+class TestHashSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.sampler = HashSampler(key=172027145)
+        self.ids = [str(1490000000000000000 + k) for k in range(1000)]
+
+    def test_sample_is_order_independent(self):
+        """Test that the sample does not depend on the order of the input."""
+        self.assertEqual(self.sampler.sample(self.ids, k=50), self.sampler.sample(reversed(self.ids), k=50))
+
+    def test_sample_is_extendable(self):
+        """Test that removing sampled items and sampling again continues the same order."""
+        first = self.sampler.sample(self.ids, k=30)
+        rest = self.sampler.sample([item_id for item_id in self.ids if item_id not in set(first)], k=20)
+        self.assertEqual(first + rest, self.sampler.sample(self.ids, k=50))
+
+    def test_full_order_and_id_of(self):
+        """Test that k=None sorts every item, and that id_of extracts the id."""
+        items = [{'id': item_id} for item_id in self.ids]
+        ordered = self.sampler.sample(items, id_of=lambda item: item['id'])
+        self.assertEqual([item['id'] for item in ordered[:50]], self.sampler.sample(self.ids, k=50))
+        self.assertEqual(len(ordered), len(items))
+
+    def test_keys_give_different_samples(self):
+        """Test that a different key draws a different sample."""
+        self.assertNotEqual(self.sampler.sample(self.ids, k=50), HashSampler(key='other').sample(self.ids, k=50))
+
+    def test_rate_matches_sample(self):
+        """Test that the streaming sample at the derived rate keeps the same items as sample(k)."""
+        for k in (1, 50, 999):
+            rate = self.sampler.rate(self.ids, k=k)
+            streamed = [item_id for item_id in self.ids if self.sampler.fraction(item_id) < rate]
+            self.assertEqual(set(streamed), set(self.sampler.sample(self.ids, k=k)))
+        self.assertEqual(self.sampler.rate(self.ids, k=1000), 1.0)
+        self.assertEqual(self.sampler.rate(self.ids, k=0), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+import sys
+sys.path.append('..')
+import numpy as np
+from src.knn_classifier import KNNStanceClassifier
+
+class TestKNNStanceClassifier(unittest.TestCase):
+
+    @staticmethod
+    def normalized(matrix):
+        return (matrix / np.linalg.norm(matrix, axis=1, keepdims=True)).astype(np.float32)
+
+    def setUp(self):
+        # One cluster of embeddings per stance.
+        rng = np.random.default_rng(0)
+        self.centers = rng.normal(size=(3, 16))
+        classes = rng.integers(0, 3, 900)
+        self.vectors = self.normalized(self.centers[classes] + 0.4 * rng.normal(size=(900, 16)))
+        self.labels = [('left', 'neutral', 'right')[c] for c in classes]
+
+    def test_held_out_agreement(self):
+        """Test that held-out vectors get the label of their cluster, in batches."""
+        classifier = KNNStanceClassifier(k=7, batch_size=64).fit(self.vectors[:600], self.labels[:600])
+        predicted, confidences = classifier.predict(self.vectors[600:])
+        self.assertGreater(np.mean(np.array(predicted) == np.array(self.labels[600:])), 0.95)
+        self.assertTrue(np.all((confidences > 1 / 3) & (confidences <= 1)))
+
+    def test_ivf_matches_exact_search(self):
+        """Test that the IVF path gives the same labels as the exact path when probing every list."""
+        exact = KNNStanceClassifier(k=5).fit(self.vectors[:600], self.labels[:600])
+        approximate = KNNStanceClassifier(k=5, n_lists=8, nprobe=8).fit(self.vectors[:600], self.labels[:600])
+        self.assertEqual(exact.predict(self.vectors[600:])[0], approximate.predict(self.vectors[600:])[0])
+
+    def test_vote_and_unknown_labels(self):
+        """Test the unweighted vote shares, and that unknown labels are left out."""
+        vectors = self.normalized(np.array([[1, 0], [1, 0.1], [1, -0.1], [0, 1], [1, 0.05]]))
+        classifier = KNNStanceClassifier(k=3, weighted=False).fit(vectors, ['left', 'left', 'right', 'right', 'error'])
+        self.assertEqual(len(classifier.vectors), 4)
+        probabilities = classifier.predict_proba(self.normalized(np.array([[1.0, 0.0]])))
+        np.testing.assert_allclose(probabilities, [[2 / 3, 0, 1 / 3]], rtol=1e-6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import unittest
+import urllib.error
+import urllib.request
+import sys
+sys.path.append('..')
+from core.mock_openai_server import MockOpenAIServer
+
+def request_body(user_content):
+    return {'model': 'mock-model',
+            'input': [{'role': 'developer', 'content': 'Classify the tweet.'},
+                      {'role': 'user', 'content': user_content}],
+            'temperature': 0}
+
+class TestMockOpenAIServer(unittest.TestCase):
+
+    def test_labels_are_deterministic(self):
+        """Test that the same prompt always gets the same label."""
+        server = MockOpenAIServer(latency_seconds=0, seed=0)
+        try:
+            texts = [server.respond(request_body('Tweet: honk honk'))[2]['output'][0]['content'][0]['text']
+                     for _ in range(3)]
+        finally:
+            server.stop()
+        self.assertEqual(len(set(texts)), 1)
+        self.assertIn(texts[0], MockOpenAIServer.TWEET_LABELS)
+
+    def test_user_prompt_gets_json_score(self):
+        """Test that user timelines are answered with a JSON score."""
+        answer = json.loads(MockOpenAIServer.label_for('tweet 1: honk\ntweet 2: honk honk'))
+        self.assertIn('score', answer)
+
+    def test_rate_limit(self):
+        """Test that requests beyond the rate limit get a 429 with a retry-after header."""
+        server = MockOpenAIServer(latency_seconds=0, rate_limit_rpm=60, seed=0)
+        try:
+            statuses = [server.respond(request_body('Tweet: a'))[0] for _ in range(3)]
+            status, headers, _ = server.respond(request_body('Tweet: a'))
+        finally:
+            server.stop()
+        self.assertEqual(statuses, [200, 429, 429])
+        self.assertEqual(status, 429)
+        self.assertGreater(float(headers['retry-after']), 0)
+        self.assertEqual(server.stats()['rate_limited'], 3)
+
+    def test_error_injection(self):
+        """Test that the error rate produces 500 responses."""
+        server = MockOpenAIServer(latency_seconds=0, error_rate=1.0, seed=0)
+        try:
+            status, _, payload = server.respond(request_body('Tweet: a'))
+        finally:
+            server.stop()
+        self.assertEqual(status, 500)
+        self.assertEqual(payload['error']['type'], 'server_error')
+
+    def test_http_round_trip(self):
+        """Test a POST /v1/responses through HTTP."""
+        with MockOpenAIServer(latency_seconds=0, seed=0) as server:
+            request = urllib.request.Request(f'{server.url}/responses',
+                                             data=json.dumps(request_body('Tweet: a')).encode('utf-8'),
+                                             headers={'content-type': 'application/json'})
+            with urllib.request.urlopen(request) as response:
+                payload = json.loads(response.read())
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(urllib.request.Request(f'{server.url}/chat/completions', data=b'{}'))
+        self.assertEqual(payload['object'], 'response')
+        self.assertGreater(payload['usage']['input_tokens'], 0)
+        self.assertEqual(context.exception.code, 404)
+
+if __name__ == "__main__":
+    unittest.main()
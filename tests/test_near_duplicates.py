@@ -0,0 +1,35 @@
+import unittest
+import sys
+sys.path.append('..')
+from src.near_duplicates import NearDuplicateClusterer
+
+class TestNearDuplicateClusterer(unittest.TestCase):
+
+    def setUp(self):
+        self.clusterer = NearDuplicateClusterer(threshold=0.8)
+
+    def test_near_duplicates_are_clustered(self):
+        """Test that copies with small edits share the representative of the first copy."""
+        texts = ['Honk honk! Freedom convoy rolling into Ottawa today, join us #FreedomConvoy2022',
+                 'We need to talk about the price of groceries this winter.',
+                 'honk honk!! Freedom convoy rolling into Ottawa today,  join us #FreedomConvoy2022']
+        self.assertEqual(self.clusterer.cluster(texts), [0, 1, 0])
+
+    def test_different_texts_are_not_clustered(self):
+        """Test that unrelated texts stay in their own cluster."""
+        texts = ['The convoy arrived in Ottawa this morning.',
+                 'Parliament debated the Emergencies Act all night.',
+                 'Truckers blocked the Ambassador Bridge in Windsor.']
+        self.assertEqual(self.clusterer.cluster(texts), [0, 1, 2])
+
+    def test_empty_texts_are_singletons(self):
+        """Test that empty texts are never clustered together."""
+        self.assertEqual(self.clusterer.cluster(['', '  ', '']), [0, 1, 2])
+
+    def test_similarity_estimate(self):
+        """Test that identical texts have similarity 1."""
+        signature = self.clusterer.signature('Freedom convoy')
+        self.assertEqual(NearDuplicateClusterer.similarity(signature, self.clusterer.signature('freedom  convoy')), 1.0)
+
+if __name__ == "__main__":
+    unittest.main()
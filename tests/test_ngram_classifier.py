@@ -0,0 +1,40 @@
+import unittest
+import sys
+import numpy as np
+sys.path.append('..')
+from src.ngram_classifier import HashedNgramClassifier
+
+class TestHashedNgramClassifier(unittest.TestCase):
+
+    def setUp(self):
+        """Train a classifier on a small synthetic corpus."""
+        rng = np.random.default_rng(0)
+        templates = {'right': 'trudeau must go #freedomconvoy honk honk',
+                     'left': 'go home convoy, ottawa residents deserve peace',
+                     'neutral': 'traffic update for the downtown core'}
+        self.texts, self.labels = [], []
+        for _ in range(300):
+            label = str(rng.choice(list(templates)))
+            self.texts.append(f"{templates[label]} {' '.join(rng.choice(['today', 'again', 'now', 'folks'], 3))}")
+            self.labels.append(label)
+        self.classifier = HashedNgramClassifier(n_features=2 ** 12).fit(self.texts, self.labels)
+
+    def test_learns_labels(self):
+        """Test that the training labels are recovered with high confidence."""
+        predicted, confidences = self.classifier.predict(self.texts)
+        self.assertEqual(predicted, self.labels)
+        self.assertTrue((confidences > 0.5).all())
+
+    def test_probabilities(self):
+        """Test that the probabilities of each text sum to one."""
+        probabilities = self.classifier.predict_proba(['honk honk', ''])
+        self.assertEqual(probabilities.shape, (2, 3))
+        np.testing.assert_allclose(probabilities.sum(axis=1), 1.0, rtol=1e-5)
+
+    def test_deterministic(self):
+        """Test that training twice with the same seed gives the same model."""
+        other = HashedNgramClassifier(n_features=2 ** 12).fit(self.texts, self.labels)
+        np.testing.assert_array_equal(other.weights, self.classifier.weights)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import sys
+import threading
+import time
+sys.path.append('..')
+from src.pipeline import Pipeline, Stage
+
+class TestPipeline(unittest.TestCase):
+
+    def test_items_flow_through_stages(self):
+        """Test that every item goes through every stage and that None drops an item."""
+        results = []
+        pipeline = Pipeline([Stage('filter', lambda x: x if x % 2 == 0 else None),
+                             Stage('square', lambda x: x * x, workers=4)], queue_size=2)
+        stats = pipeline.run(range(20), sink=results.append)
+        self.assertEqual(sorted(results), [x * x for x in range(0, 20, 2)])
+        self.assertEqual((stats['source'], stats['filter'], stats['square'], stats['sink']), (20, 10, 10, 10))
+
+    def test_first_item_reaches_sink_before_source_ends(self):
+        """Test that the sink receives items while the source is still producing."""
+        source_done = threading.Event()
+        seen_before_end = []
+
+        def source():
+            for k in range(10):
+                time.sleep(0.02)
+                yield k
+            source_done.set()
+
+        Pipeline([Stage('identity', lambda x: x)], queue_size=1).run(
+            source(), sink=lambda item: seen_before_end.append(not source_done.is_set()))
+        self.assertTrue(seen_before_end[0])
+
+    def test_stage_error_stops_pipeline(self):
+        """Test that an exception in a stage is raised by run, without hanging."""
+        def fail(x):
+            if x == 5:
+                raise ValueError('bad item')
+            return x
+
+        with self.assertRaises(ValueError):
+            Pipeline([Stage('fail', fail, workers=2)], queue_size=1).run(iter(range(1000)), sink=lambda item: None)
+
+
+if __name__ == '__main__':
+    unittest.main()
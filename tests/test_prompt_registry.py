@@ -0,0 +1,53 @@
+import unittest
+import sys
+import os
+import tempfile
+sys.path.append('..')
+from core.prompt_registry import PromptRegistry
+
+class TestPromptRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'tweet-prompt.md')
+        self._write('Classify the tweet.\r\nAnswer left, neutral or right.\r\n')
+        self.changed = []
+        self.registry = PromptRegistry(self.tmp_dir.name, watch_seconds=None, on_change=self.changed.append)
+
+    def tearDown(self):
+        self.registry.close()
+        self.tmp_dir.cleanup()
+
+    def _write(self, content):
+        with open(self.filename, 'w', encoding='utf-8', newline='') as writer:
+            writer.write(content)
+
+    def test_template_is_cached_and_normalized(self):
+        """Test that a template is read once, with normalized line endings."""
+        template = self.registry.get('tweet-prompt')
+        self.assertEqual(template.content, 'Classify the tweet.\nAnswer left, neutral or right.\n')
+        self.assertEqual(template.version, PromptRegistry.version(template.content))
+        os.remove(self.filename)
+        self.assertIs(self.registry.get('tweet-prompt'), template)
+
+    def test_changed_file_is_reloaded(self):
+        """Test that refresh reloads a modified template and reports the new version."""
+        first = self.registry.get('tweet-prompt')
+        self.assertEqual(self.registry.refresh(), 0)
+        self._write('Classify the stance of the tweet.\n')
+        os.utime(self.filename, ns=(0, os.stat(self.filename).st_mtime_ns + 10**9))
+        self.assertEqual(self.registry.refresh(), 1)
+        second = self.registry.get('tweet-prompt')
+        self.assertNotEqual(second.version, first.version)
+        self.assertEqual(self.changed, [second])
+
+    def test_watcher_stops(self):
+        """Test that close stops the watcher thread."""
+        registry = PromptRegistry(self.tmp_dir.name, watch_seconds=0.01)
+        registry.get('tweet-prompt')
+        registry.close()
+        self.assertIsNone(registry._watcher)
+
+
+if __name__ == '__main__':
+    unittest.main()
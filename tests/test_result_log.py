@@ -0,0 +1,119 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import unittest
+import sys
+sys.path.append('..')
+from src.result_log import ResultLog
+
+
+def _append_many(log_file, worker, count):
+    with ResultLog(log_file, fsync_every=1000) as log:
+        for k in range(count):
+            log.append({'worker': worker, 'k': k, 'text': 'x' * 5000})
+
+class TestResultLog(unittest.TestCase):
+
+    def setUp(self):
+        """Create a temporary folder for the log files."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.tmp_dir.name, 'results.jsonl')
+        self.json_file = os.path.join(self.tmp_dir.name, 'results.json')
+        self.results = [
+            {'llm_response': 'right', 'tweet_id': '1', 'author_id': '10'},
+            {'llm_response': 'left', 'tweet_id': '2', 'author_id': '20'},
+            {'llm_response': 'neutral', 'tweet_id': '3', 'author_id': '10'},
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_append_and_iterate(self):
+        """Test that appended results are streamed back in order."""
+        with ResultLog(self.log_file, fsync_every=2) as log:
+            for result in self.results:
+                log.append(result)
+        self.assertEqual(list(ResultLog(self.log_file)), self.results)
+
+    def test_appended_results_visible_before_close(self):
+        """Test that results are readable without closing the writer (crash safety)."""
+        log = ResultLog(self.log_file, fsync_every=100)
+        log.append(self.results[0])
+        self.assertEqual(list(ResultLog(self.log_file)), [self.results[0]])
+        log.close()
+
+    def test_partial_trailing_line_is_dropped(self):
+        """Test that a record truncated by a crash is removed when the log is reopened."""
+        with ResultLog(self.log_file) as log:
+            log.append(self.results[0])
+        with open(self.log_file, 'a', encoding='utf-8') as writer:
+            writer.write('{"llm_response": "ri')
+        with ResultLog(self.log_file) as log:
+            log.append(self.results[1])
+        self.assertEqual(list(ResultLog(self.log_file)), self.results[:2])
+
+    def test_readers_do_not_truncate(self):
+        """Test that a line still being written is left untouched by readers (only writers repair the tail)."""
+        with ResultLog(self.log_file) as log:
+            log.append(self.results[0])
+        with open(self.log_file, 'a', encoding='utf-8') as writer:
+            writer.write('{"llm_response": "ri')
+        reader = ResultLog(self.log_file)
+        self.assertEqual(list(reader), [self.results[0]])
+        self.assertEqual(len(reader), 1)
+        reader.close()
+        with open(self.log_file, 'r', encoding='utf-8') as file:
+            self.assertTrue(file.read().endswith('{"llm_response": "ri'))
+
+    def test_concurrent_processes_do_not_interleave(self):
+        """Test that large lines appended by several processes stay whole."""
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_append_many, args=(self.log_file, worker, 50)) for worker in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        results = list(ResultLog(self.log_file))
+        self.assertEqual(len(results), 200)
+        self.assertEqual(sorted((result['worker'], result['k']) for result in results),
+                         [(worker, k) for worker in range(4) for k in range(50)])
+
+    def test_merge_shards(self):
+        """Test that the worker shards are appended to the log and deleted."""
+        for worker, result in enumerate(self.results[1:]):
+            with ResultLog(ResultLog.shard_filepath(self.log_file, worker)) as shard:
+                shard.append(result)
+        self.assertEqual(ResultLog.shard_filepath(self.log_file, 0), os.path.join(self.tmp_dir.name, 'results.worker-0.jsonl'))
+        with ResultLog(self.log_file) as log:
+            log.append(self.results[0])
+            self.assertEqual(log.merge_shards(), 2)
+        self.assertEqual(list(ResultLog(self.log_file)), self.results)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['results.jsonl'])
+
+    def test_compact_matches_json_dump(self):
+        """Test that compaction produces the same file as json.dump(results, indent=4)."""
+        with ResultLog(self.log_file) as log:
+            for result in self.results:
+                log.append(result)
+            self.assertEqual(log.compact(self.json_file), 3)
+        with open(self.json_file, 'r', encoding='utf-8') as reader:
+            compacted = reader.read()
+        self.assertEqual(compacted, json.dumps(self.results, indent=4))
+
+    def test_compact_empty_log(self):
+        """Test that compacting an empty log produces an empty JSON list."""
+        ResultLog(self.log_file).compact(self.json_file)
+        with open(self.json_file, 'r', encoding='utf-8') as reader:
+            self.assertEqual(json.load(reader), [])
+
+    def test_legacy_json_is_imported(self):
+        """Test that an existing JSON output seeds a new log."""
+        with open(self.json_file, 'w', encoding='utf-8') as writer:
+            json.dump(self.results, writer, indent=4)
+        log = ResultLog(self.log_file, legacy_filepath=self.json_file)
+        self.assertEqual(list(log), self.results)
+        self.assertEqual(len(log), 3)
+
+if __name__ == "__main__":
+    unittest.main()
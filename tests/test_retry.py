@@ -0,0 +1,141 @@
+import unittest
+import sys
+sys.path.append('..')
+from openai import AuthenticationError, InternalServerError, RateLimitError
+from core.retry import FATAL_ERRORS, RETRYABLE_ERRORS, CircuitBreaker, LLMResponseError, RetryPolicy
+
+def api_error(error_class):
+    """Instance of an OpenAI error class, without an HTTP response."""
+    error = error_class.__new__(error_class)
+    Exception.__init__(error, error_class.__name__)
+    return error
+
+class FakeClock:
+    """Clock that only moves when `sleep` is called, recording the delays."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.delays = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.delays.append(delay)
+        self.now += delay
+
+class FakeFunction:
+    """Raises the given errors, one per call, then returns 'ok'."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_error_classification(self):
+        """Test which errors are retried and which stop the run."""
+        self.assertIsInstance(api_error(RateLimitError), RETRYABLE_ERRORS)
+        self.assertIsInstance(api_error(InternalServerError), RETRYABLE_ERRORS)
+        self.assertIsInstance(LLMResponseError('bad output'), RETRYABLE_ERRORS)
+        self.assertNotIsInstance(api_error(AuthenticationError), RETRYABLE_ERRORS)
+        self.assertIsInstance(api_error(AuthenticationError), FATAL_ERRORS)
+
+    def test_backoff_is_bounded_full_jitter(self):
+        """Test that the delay before attempt k+1 is in [0, min(max_delay, base_delay * 2**k)]."""
+        function = FakeFunction([api_error(InternalServerError) for _ in range(5)])
+        policy = RetryPolicy(max_attempts=6, base_delay=1.0, max_delay=8.0, seed=0, sleep=self.clock.sleep)
+        self.assertEqual(policy.call(function), 'ok')
+        self.assertEqual(function.calls, 6)
+        self.assertEqual(len(self.clock.delays), 5)
+        for attempt, delay in enumerate(self.clock.delays):
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(8.0, 2 ** attempt))
+
+    def test_last_error_is_raised(self):
+        """Test that the error of the last attempt is raised once the attempts run out."""
+        function = FakeFunction([api_error(RateLimitError) for _ in range(3)])
+        policy = RetryPolicy(max_attempts=3, seed=0, sleep=self.clock.sleep)
+        with self.assertRaises(RateLimitError):
+            policy.call(function)
+        self.assertEqual(function.calls, 3)
+        self.assertEqual(len(self.clock.delays), 2)
+
+    def test_non_retryable_errors_are_raised_at_once(self):
+        """Test that fatal and unknown errors are not retried."""
+        for error in (api_error(AuthenticationError), KeyError('x')):
+            function = FakeFunction([error])
+            with self.assertRaises(type(error)):
+                RetryPolicy(max_attempts=5, sleep=self.clock.sleep).call(function)
+            self.assertEqual(function.calls, 1)
+        self.assertEqual(self.clock.delays, [])
+
+    def test_malformed_outputs_have_their_own_limit(self):
+        """Test that malformed outputs are retried without backoff, at most max_parse_attempts times."""
+        function = FakeFunction([LLMResponseError('bad output')])
+        policy = RetryPolicy(max_attempts=5, max_parse_attempts=2, sleep=self.clock.sleep)
+        self.assertEqual(policy.call(function), 'ok')
+        self.assertEqual(self.clock.delays, [])
+
+        function = FakeFunction([LLMResponseError('bad output') for _ in range(2)])
+        with self.assertRaises(LLMResponseError):
+            policy.call(function)
+        self.assertEqual(function.calls, 2)
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(window_size=10, error_rate_threshold=0.5, cooldown_seconds=30,
+                                      min_calls=4, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_stays_closed_below_threshold(self):
+        """Test that the circuit stays closed with few calls or a low error rate."""
+        for success in (False, False, False):
+            self.breaker.record(success)
+        self.assertFalse(self.breaker.is_open)
+
+        breaker = CircuitBreaker(window_size=10, error_rate_threshold=0.5, min_calls=4, clock=self.clock)
+        for success in (True, True, True, False, True, False, True):
+            breaker.record(success)
+            self.assertFalse(breaker.is_open)
+
+    def test_open_wait_and_half_open(self):
+        """Test closed -> open -> half-open: the breaker blocks for the cool-down, then lets calls through."""
+        for success in (True, False, True, False):
+            self.breaker.record(success)
+        self.assertTrue(self.breaker.is_open)
+
+        self.clock.now += 10
+        self.breaker.wait_until_closed()
+        self.assertEqual(self.clock.delays, [20])
+        self.assertFalse(self.breaker.is_open)
+
+        # The window was cleared: a single failure does not open the circuit again.
+        self.breaker.record(False)
+        self.assertFalse(self.breaker.is_open)
+        for _ in range(3):
+            self.breaker.record(False)
+        self.assertTrue(self.breaker.is_open)
+
+    def test_retry_policy_reports_to_breaker(self):
+        """Test that retried API errors count as failures and the policy waits while the circuit is open."""
+        breaker = CircuitBreaker(window_size=4, error_rate_threshold=1.0, cooldown_seconds=30,
+                                 min_calls=2, clock=self.clock, sleep=self.clock.sleep)
+        policy = RetryPolicy(max_attempts=5, base_delay=0.0, circuit_breaker=breaker, sleep=self.clock.sleep)
+        function = FakeFunction([api_error(InternalServerError) for _ in range(2)])
+        self.assertEqual(policy.call(function), 'ok')
+        self.assertIn(30, self.clock.delays)
+        self.assertFalse(breaker.is_open)
+
+if __name__ == '__main__':
+    unittest.main()
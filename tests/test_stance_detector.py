@@ -0,0 +1,131 @@
+import unittest
+import sys
+from unittest import mock
+import numpy as np
+sys.path.append('..')
+from src.paths_handler import PathsHandler
+
+try:
+    import torch
+    from core.llms import StanceDetector
+except ImportError:
+    torch = None
+
+TINY_MODEL = 'hf-internal-testing/tiny-random-LlamaForCausalLM'
+CHAT_TEMPLATE = ("{% for message in messages %}<|{{ message['role'] }}|>\n{{ message['content'] }}\n{% endfor %}"
+                 "{% if add_generation_prompt %}<|assistant|>\n{% endif %}")
+TWEETS = ['Honk!', 'Go home, the convoy has been blocking downtown Ottawa for three weeks now.', 'Freedom for all']
+
+def tiny_detector(**configuration):
+    """StanceDetector of a tiny random Llama model, with the given configuration overrides."""
+    stance_detector_config = {
+        'model-name': TINY_MODEL,
+        'device': 'cpu',
+        'torch-dtype': 'float32',
+        'torch-threads': None,
+        'quantization': 'none',
+        'system-prompt': 'Rate the political stance of the tweet.',
+        'batch-max-tokens': 4096,
+        'batch-max-size': 64,
+        'decoding': 'score',
+        'score-labels': ['left', 'neutral', 'right'],
+        'score-temperature': 1.0,
+        'prefix-cache': False,
+        **configuration,
+    }
+    with mock.patch.object(PathsHandler, 'get_variable', return_value=stance_detector_config):
+        detector = StanceDetector()
+    # The tokenizer of the tiny model has no chat template.
+    detector.tokenizer.chat_template = CHAT_TEMPLATE
+    return detector
+
+@unittest.skipIf(torch is None, 'torch and transformers are not installed.')
+class TestScoreLabels(unittest.TestCase):
+
+    def detector(self, score_labels, logits):
+        """Detector scoring the given labels, whose label logits are `logits` (no model loaded)."""
+        detector = StanceDetector.__new__(StanceDetector)
+        detector.score_labels, detector.label_scores = StanceDetector.resolve_score_labels(score_labels)
+        detector.score_temperature = 1.0
+        detector.label_logits = lambda tweets: np.array(logits, dtype=np.float32)
+        return detector
+
+    def test_numeric_labels(self):
+        """Test that numeric labels are returned as integers."""
+        detector = self.detector(['-1', '0', '10'], [[0.0, 1.0, 5.0], [3.0, 1.0, 0.0]])
+        scores, probabilities = detector.score_batch(['a', 'b'])
+        self.assertEqual(scores, [10, -1])
+        self.assertEqual(probabilities.shape, (2, 3))
+
+    def test_non_numeric_labels(self):
+        """Test that labels such as left/neutral/right are returned as is."""
+        detector = self.detector(['left', 'neutral', 'right'], [[0.0, 1.0, 5.0], [3.0, 1.0, 0.0]])
+        scores, probabilities = detector.score_batch(['a', 'b'])
+        self.assertEqual(scores, ['right', 'left'])
+        np.testing.assert_allclose(probabilities.sum(axis=1), 1.0, rtol=1e-5)
+
+    def test_label_to_score_table(self):
+        """Test that a mapping of score-labels gives the score of each label."""
+        detector = self.detector({'left': -1, 'neutral': 0, 'right': 1}, [[0.0, 1.0, 5.0], [0.0, 4.0, 1.0]])
+        self.assertEqual(detector.score_labels, ['left', 'neutral', 'right'])
+        self.assertEqual(detector.score_batch(['a', 'b'])[0], [1, 0])
+
+@unittest.skipIf(torch is None, 'torch and transformers are not installed.')
+class TestPrefixCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.detector = tiny_detector()
+        cls.detector._build_prefix_cache()
+
+    def test_prefix_is_shared(self):
+        """Test that every prompt starts with the cached prefix and that the suffix lengths are mixed."""
+        full_inputs = self.detector._full_inputs(TWEETS)
+        prompts = [self.detector.prompt_ids(messages) for messages in full_inputs]
+        for prompt in prompts:
+            self.assertEqual(prompt[:len(self.detector._prefix_ids)], self.detector._prefix_ids)
+        self.assertGreater(len({len(prompt) for prompt in prompts}), 1)
+
+    def test_cached_logits_match(self):
+        """Test that scoring from the cached prefix gives the logits of the full forward pass."""
+        full_inputs = self.detector._full_inputs(TWEETS)
+        np.testing.assert_allclose(self.detector._label_logits_from_prefix(full_inputs),
+                                   self.detector._label_logits(full_inputs), atol=1e-4, rtol=1e-4)
+
+    def test_cached_logits_do_not_depend_on_the_batch(self):
+        """Test that the padding of a batch with mixed suffix lengths does not change the logits of a tweet."""
+        full_inputs = self.detector._full_inputs(TWEETS)
+        batch_logits = self.detector._label_logits_from_prefix(full_inputs)
+        for index, messages in enumerate(full_inputs):
+            np.testing.assert_allclose(batch_logits[index], self.detector._label_logits_from_prefix([messages])[0],
+                                       atol=1e-4, rtol=1e-4)
+
+@unittest.skipIf(torch is None, 'torch and transformers are not installed.')
+class TestDynamicInt8Quantization(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.detector = tiny_detector(quantization='dynamic-int8')
+
+    def test_linear_layers_are_quantized(self):
+        """Test that the linear layers of the loaded model are replaced by dynamic int8 ones."""
+        modules = list(self.detector.pipe.model.modules())
+        self.assertTrue(any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in modules))
+        self.assertFalse(any(type(module) is torch.nn.Linear for module in modules))
+
+    def test_score_batch(self):
+        """Test that the quantized model returns one valid label and a probability distribution per tweet."""
+        scores, probabilities = self.detector.score_batch(TWEETS)
+        self.assertEqual(len(scores), len(TWEETS))
+        self.assertTrue(set(scores) <= {'left', 'neutral', 'right'})
+        self.assertEqual(probabilities.shape, (len(TWEETS), 3))
+        self.assertTrue(np.isfinite(probabilities).all())
+        np.testing.assert_allclose(probabilities.sum(axis=1), 1.0, rtol=1e-5)
+
+    def test_requires_cpu(self):
+        """Test that dynamic int8 quantization is rejected on other devices."""
+        with self.assertRaises(ValueError):
+            tiny_detector(quantization='dynamic-int8', device='cuda')
+
+if __name__ == '__main__':
+    unittest.main()
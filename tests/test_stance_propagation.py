@@ -0,0 +1,63 @@
+import unittest
+import sys
+from datetime import datetime
+sys.path.append('..')
+import numpy as np
+from src.stance_propagation import TweetGraph, propagate_labels
+from src.tweet import Tweet
+
+class TestStancePropagation(unittest.TestCase):
+
+    @staticmethod
+    def tweet(tweet_id, author_id, conversation_id=None, text='some text', referenced=None):
+        return Tweet('en', author_id, {}, datetime(2022, 2, 1), tweet_id, conversation_id or tweet_id, text, False,
+                     referenced_tweets=referenced)
+
+    def setUp(self):
+        # Two communities: authors 'a' and 'b' (left), authors 'c' and 'd' (right).
+        self.tweets = [
+            self.tweet('1', 'a'),
+            self.tweet('2', 'a'),
+            self.tweet('3', 'b', referenced=[{'type': 'retweeted', 'id': '1'}]),
+            self.tweet('4', 'c'),
+            self.tweet('5', 'c', conversation_id='4', text='@UserD agreed'),
+            self.tweet('6', 'd'),
+            self.tweet('7', 'e', referenced=[{'type': 'quoted', 'id': '999'}]),
+        ]
+        self.graph = TweetGraph(self.tweets, username2author_id={'userd': 'd'})
+
+    def test_graph_structure(self):
+        """Test the nodes and edges built from authors, references, conversations and mentions."""
+        self.assertEqual(self.graph.tweet_ids(), [tweet.id for tweet in self.tweets])
+        self.assertIsNotNone(self.graph.index('conversation', '4'))
+        self.assertIsNone(self.graph.index('conversation', '1'))  # Single-tweet conversation.
+        edges = set(zip(self.graph.rows.tolist(), self.graph.cols.tolist()))
+        retweet = (self.graph.index('tweet', '3'), self.graph.index('tweet', '1'))
+        mention = (self.graph.index('tweet', '5'), self.graph.index('user', 'd'))
+        self.assertIn(retweet, edges)
+        self.assertIn(retweet[::-1], edges)
+        self.assertIn(mention, edges)
+        # 7 author edges, 1 retweet, 2 conversation and 1 mention, in both directions.
+        self.assertEqual(len(self.graph.rows), 2 * 11)
+
+    def test_propagate_is_symmetric_normalized(self):
+        """Test that the propagation matrix is D^-1/2 W D^-1/2."""
+        n = len(self.graph)
+        dense = np.zeros((n, n))
+        np.add.at(dense, (self.graph.rows, self.graph.cols), self.graph.weights)
+        degrees = dense.sum(axis=1)
+        expected = dense / np.sqrt(np.outer(degrees, degrees))
+        np.testing.assert_allclose(self.graph.propagate(np.eye(n)), expected)
+
+    def test_labels_spread_within_communities(self):
+        """Test that unlabeled tweets get the label of their community, and unreached ones none."""
+        predictions = propagate_labels(self.graph, {'1': 'left', '6': 'right', '404': 'left'})
+        self.assertEqual(predictions['2'][0], 'left')
+        self.assertEqual(predictions['3'][0], 'left')
+        self.assertEqual(predictions['5'][0], 'right')
+        self.assertEqual(predictions['4'][0], 'right')
+        self.assertNotIn('7', predictions)
+        self.assertTrue(all(0.5 < confidence <= 1 for _, confidence in predictions.values()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+import sys
+sys.path.append('..')
+from datetime import datetime
+from src.result_log import ResultLog
+from src.stance_result_store import StanceResultStore
+from src.tweet import Tweet
+
+class TestStanceResultStore(unittest.TestCase):
+
+    def setUp(self):
+        """Create a store in a temporary folder with three tweet results."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = StanceResultStore(os.path.join(self.tmp_dir.name, 'results.sqlite'))
+        self.tweets = [
+            Tweet('en', '10', {}, datetime(2022, 1, 28, 10), '1', '1', 'Honk! #HonkHonk #HoldTheLine', False),
+            Tweet('en', '20', {}, datetime(2022, 1, 28, 11), '2', '2', 'Go home #FluTruxKlan', False),
+            Tweet('en', '10', {}, datetime(2022, 1, 29, 12), '3', '3', 'Nice weather #HonkHonk', False),
+        ]
+        self.results = [
+            {'llm_response': 'right', 'tweet_id': '1', 'author_id': '10', 'model': 'm1'},
+            {'llm_response': 'left', 'tweet_id': '2', 'author_id': '20', 'model': 'm1'},
+            {'llm_response': 'neutral', 'tweet_id': '3', 'author_id': '10', 'model': 'm2'},
+        ]
+        self.store.add_tweet_results(self.results, id2tweet={tweet.id: tweet for tweet in self.tweets})
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def test_get_many(self):
+        """Test that only the requested (and stored) tweets are returned."""
+        self.assertEqual(self.store.get_many(['1', '3', '99']), {'1': 'right', '3': 'neutral'})
+
+    def test_get_many_by_author(self):
+        """Test that tweet stances are grouped by author."""
+        self.assertEqual(self.store.get_many_by_author(['10']), {'10': {'1': 'right', '3': 'neutral'}})
+
+    def test_counts_by_stance(self):
+        """Test counting by a single column."""
+        self.assertEqual(self.store.counts_by('stance'),
+                         {('right',): 1, ('left',): 1, ('neutral',): 1})
+
+    def test_counts_by_day_and_hashtag(self):
+        """Test counting by day with a hashtag filter."""
+        self.assertEqual(self.store.counts_by('day', 'stance', hashtag='honkhonk'),
+                         {('2022-01-28', 'right'): 1, ('2022-01-29', 'neutral'): 1})
+
+    def test_counts_by_model(self):
+        """Test that the model column can be used to filter."""
+        self.assertEqual(self.store.counts_by(model='m1'), {(): 2})
+
+    def test_counts_by_invalid_column(self):
+        """Test that unknown columns are rejected."""
+        with self.assertRaises(ValueError):
+            self.store.counts_by('text')
+
+    def test_results_are_replaced(self):
+        """Test that storing a result twice keeps a single row."""
+        self.store.add_tweet_results([{'llm_response': 'left', 'tweet_id': '1', 'author_id': '10'}])
+        self.assertEqual(self.store.counts_by(), {(): 3})
+        self.assertEqual(self.store.get_many(['1']), {'1': 'left'})
+
+    def test_label_sources(self):
+        """Test that classifier labels can be told apart from the labels given by the LLM."""
+        self.store.add_tweet_results([
+            {'llm_response': 'right', 'tweet_id': '4', 'author_id': '10', 'label_source': 'near_duplicate'},
+            {'llm_response': 'left', 'tweet_id': '5', 'author_id': '20', 'label_source': 'cascade'},
+        ])
+        self.assertEqual(self.store.counts_by('label_source'),
+                         {('llm',): 3, ('near_duplicate',): 1, ('cascade',): 1})
+        self.assertEqual(self.store.counts_by('stance', label_source='cascade'), {('left',): 1})
+        self.assertEqual(self.store.get_many(['1', '4', '5'], label_sources=StanceResultStore.LLM_LABEL_SOURCES),
+                         {'1': 'right', '4': 'right'})
+        self.assertEqual(self.store.get_many(['1', '4', '5'], label_sources=['cascade']), {'5': 'left'})
+
+    def test_label_sources_are_migrated(self):
+        """Test that a tweet table without label sources (older versions) gets them from the results."""
+        filepath = os.path.join(self.tmp_dir.name, 'old.sqlite')
+        connection = sqlite3.connect(filepath)
+        connection.execute('CREATE TABLE tweet_stances (tweet_id TEXT PRIMARY KEY, author_id TEXT, '
+                           'stance TEXT NOT NULL, created_day TEXT, model TEXT, prompt_version TEXT, '
+                           'result TEXT NOT NULL)')
+        for tweet_id, label_source in (('1', None), ('2', 'cascade')):
+            result = {'llm_response': 'left', 'tweet_id': tweet_id}
+            if label_source is not None:
+                result['label_source'] = label_source
+            connection.execute("INSERT INTO tweet_stances VALUES (?, NULL, 'left', NULL, NULL, NULL, ?)",
+                               (tweet_id, json.dumps(result)))
+        connection.commit()
+        connection.close()
+        with StanceResultStore(filepath) as store:
+            self.assertEqual(store.counts_by('label_source'), {('llm',): 1, ('cascade',): 1})
+
+    def test_user_results(self):
+        """Test storing and counting user results."""
+        self.store.add_user_results([
+            {'llm_response': {'score': 7}, 'author_id': '10'},
+            {'llm_response': {'score': 'Not enough information'}, 'author_id': '20'},
+        ])
+        self.assertEqual(self.store.user_ids(), {'10', '20'})
+        self.assertEqual(self.store.user_counts_by('score'), {(7.0,): 1, (None,): 1})
+
+    def test_text_scores_are_migrated(self):
+        """Test that a user table with TEXT scores (older versions) is rebuilt with numbers."""
+        filepath = os.path.join(self.tmp_dir.name, 'old.sqlite')
+        connection = sqlite3.connect(filepath)
+        connection.execute('CREATE TABLE user_stances (author_id TEXT PRIMARY KEY, score TEXT, '
+                           'model TEXT, prompt_version TEXT, result TEXT NOT NULL)')
+        connection.execute("INSERT INTO user_stances VALUES ('10', '7', NULL, NULL, ?)",
+                           (json.dumps({'llm_response': {'score': 7}, 'author_id': '10'}),))
+        connection.commit()
+        connection.close()
+        with StanceResultStore(filepath) as store:
+            self.assertEqual(store.user_counts_by('score'), {(7.0,): 1})
+            self.assertEqual(store.get_many_users(['10'])['10']['llm_response'], {'score': 7})
+
+    def test_reconcile_tweet_log(self):
+        """Test that results only in the log are stored and results only in the store are logged."""
+        log = ResultLog(os.path.join(self.tmp_dir.name, 'log.jsonl'))
+        log.append(self.results[0])
+        log.append({'llm_response': 'left', 'tweet_id': '4', 'author_id': '30'})
+        self.assertEqual(self.store.reconcile_tweet_log(log, dict), (2, 1))
+        self.assertEqual(self.store.tweet_ids(), {'1', '2', '3', '4'})
+        self.assertEqual({result['tweet_id'] for result in log}, {'1', '2', '3', '4'})
+        log.close()
+
+if __name__ == "__main__":
+    unittest.main()
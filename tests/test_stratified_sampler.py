@@ -0,0 +1,52 @@
+import unittest
+import sys
+sys.path.append('..')
+from src.stratified_sampler import StratifiedSampler
+
+class TestStratifiedSampler(unittest.TestCase):
+
+    def _sampler(self, sizes, labeled_strata=(), target_width=0.2):
+        item2stratum = {f'{stratum}-{k}': stratum for stratum, size in sizes.items() for k in range(size)}
+        return StratifiedSampler(item2stratum, labeled_strata, target_width=target_width)
+
+    def test_every_stratum_gets_min_labeled_first(self):
+        """Test that the first batch covers the minimum of every stratum."""
+        sampler = self._sampler({'a': 100, 'b': 100, 'c': 100})
+        batch = sampler.next_batch(15)
+        self.assertEqual(sorted(item_id[0] for item_id in batch), ['a'] * 5 + ['b'] * 5 + ['c'] * 5)
+
+    def test_allocation_favours_wide_strata(self):
+        """Test that the stratum with the widest interval receives most of the batch."""
+        sampler = self._sampler({'a': 1000, 'b': 1000},
+                                labeled_strata=[('a', 'left')] * 200 + [('b', 'left')] * 5 + [('b', 'right')] * 5)
+        batch = sampler.next_batch(100)
+        self.assertEqual(len(batch), 100)
+        self.assertGreater(sum(item_id.startswith('b') for item_id in batch), 50)
+
+    def test_converges_and_stops(self):
+        """Test that sampling stops once every interval is narrower than the target."""
+        sampler = self._sampler({'a': 500, 'b': 500})
+        calls = 0
+        while not sampler.converged:
+            batch = sampler.next_batch(50)
+            self.assertTrue(batch)
+            for item_id in batch:
+                sampler.add_label(item_id[0], 'left' if hash(item_id) % 4 else 'right')
+            calls += len(batch)
+        self.assertLess(calls, 1000)
+        self.assertTrue(all(width <= 0.2 for _, _, _, width in sampler.report()))
+
+    def test_exhausted_strata_converge(self):
+        """Test that a fully labeled stratum is converged and never sampled again."""
+        sampler = self._sampler({'a': 3, 'b': 100}, target_width=0.01)
+        batch = sampler.next_batch(50)
+        self.assertEqual(sum(item_id.startswith('a') for item_id in batch), 3)
+        for item_id in batch:
+            sampler.add_label(item_id[0], 'neutral')
+        self.assertTrue(sampler.is_converged('a'))
+        self.assertEqual(sampler.interval_width('a'), 0.0)
+        self.assertFalse(any(item_id.startswith('a') for item_id in sampler.next_batch(50)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import sys
+from datetime import datetime, timedelta
+sys.path.append('..')
+from core.timeline_selector import TimelineSelector
+from src.tweet import Tweet
+
+def format_prompt(tweets):
+    lines = [f'tweet {ix+1}: {tweet.sanitized_text}' for ix, tweet in enumerate(tweets)]
+    return '<user_query>\n' + '\n'.join(lines) + '\n</user_query>'
+
+class TestTimelineSelector(unittest.TestCase):
+
+    def _tweets(self, texts):
+        start = datetime(2022, 1, 1)
+        return [Tweet('en', '42', {}, start + timedelta(days=k), str(1000 + k), str(1000 + k), text, False)
+                for k, text in enumerate(texts)]
+
+    def test_fewer_tweets_than_max_count(self):
+        """Test that a user with fewer tweets than the maximum gets all of them."""
+        tweets = self._tweets([f'The convoy reached Ottawa on day {k}' for k in range(3)])
+        selected = TimelineSelector(max_tweet_count=50, max_tokens=10_000, encoding_name=None).select(tweets, format_prompt)
+        self.assertEqual([tweet.id for tweet in selected], ['1000', '1001', '1002'])
+
+    def test_empty_and_duplicate_tweets_are_skipped(self):
+        """Test that tweets with only hashtags and mentions, and repeated texts, are not selected."""
+        tweets = self._tweets(['Freedom convoy now', '#HonkHonk @someone', 'freedom   CONVOY now', 'Trucks on Wellington'])
+        selected = TimelineSelector(max_tweet_count=50, max_tokens=10_000, encoding_name=None).select(tweets, format_prompt)
+        self.assertEqual([tweet.id for tweet in selected], ['1000', '1003'])
+
+    def test_token_budget_and_time_spread(self):
+        """Test that the prompt fits the budget and that the selection spans the whole timeline."""
+        tweets = self._tweets([f'Protest update number {k} from downtown Ottawa today' for k in range(100)])
+        selector = TimelineSelector(max_tweet_count=50, max_tokens=300, encoding_name=None)
+        selected = selector.select(tweets, format_prompt)
+        self.assertTrue(0 < len(selected) < 50)
+        self.assertLessEqual(selector.count_tokens(format_prompt(selected)), 300)
+        self.assertEqual(selected[0].id, '1000')
+        self.assertEqual(selected[-1].id, '1099')
+        self.assertEqual(selected, sorted(selected, key=lambda tweet: tweet.created_at))
+
+    def test_spread_order(self):
+        """Test that the spread order is a permutation starting with the ends and the middle."""
+        order = TimelineSelector.spread_order(9)
+        self.assertEqual(sorted(order), list(range(9)))
+        self.assertEqual(order[:3], [0, 8, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+import sys
+from types import SimpleNamespace
+sys.path.append('..')
+from core.usage_metrics import BudgetExceededError, UsageMetrics
+from src.result_log import ResultLog
+
+PRICES = {'model-a': {'input': 1.0, 'output': 4.0}}
+
+class TestUsageMetrics(unittest.TestCase):
+
+    def setUp(self):
+        """Create metrics writing to a temporary folder."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp_dir.name, 'usage.jsonl')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def call(metrics, item_id, attempts=1, input_tokens=1_000_000, output_tokens=0, fail=False):
+        with metrics.track_call('tweet', item_id):
+            for _ in range(attempts):
+                metrics.add_attempt()
+                metrics.add_response('model-a', SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens))
+            if fail:
+                raise ValueError()
+
+    def test_records_calls(self):
+        """Test that every call is written to the sink with its tokens, cost and retries."""
+        metrics = UsageMetrics(PRICES, sink_filepath=self.filepath)
+        self.call(metrics, '1', attempts=3, input_tokens=100, output_tokens=10)
+        with self.assertRaises(ValueError):
+            self.call(metrics, '2', fail=True)
+        metrics.close()
+
+        records = list(ResultLog(self.filepath))
+        self.assertEqual([record['item_id'] for record in records], ['1', '2'])
+        self.assertEqual(records[0]['input_tokens'], 300)
+        self.assertEqual(records[0]['output_tokens'], 30)
+        self.assertEqual(records[0]['retries'], 2)
+        self.assertAlmostEqual(records[0]['cost_usd'], (300 + 30 * 4) / 1_000_000)
+        self.assertTrue(records[0]['success'])
+        self.assertFalse(records[1]['success'])
+
+    def test_summary(self):
+        """Test the aggregated totals of a run."""
+        metrics = UsageMetrics(PRICES)
+        for item_id in range(4):
+            self.call(metrics, str(item_id), output_tokens=250_000)
+        summary = metrics.summary()
+        self.assertEqual(summary['calls'], 4)
+        self.assertEqual(summary['input_tokens'], 4_000_000)
+        self.assertAlmostEqual(summary['cost_usd'], 8.0)
+        self.assertEqual(summary['mean_retries'], 0.0)
+        self.assertLessEqual(summary['latency_p50_seconds'], summary['latency_p95_seconds'])
+
+    def test_unknown_model_without_budget(self):
+        """Test that models without a price do not break the accounting when no budget is set."""
+        self.assertEqual(UsageMetrics(PRICES).cost('model-b', 10, 10), 0.0)
+
+    def test_unknown_model_with_budget(self):
+        """Test that a budget cannot be used with a model without a price."""
+        metrics = UsageMetrics(PRICES, budget_usd=1.0)
+        with self.assertRaises(ValueError):
+            metrics.require_price('model-b')
+        with self.assertRaises(ValueError):
+            metrics.cost('model-b', 10, 10)
+
+    def test_budget_stops_before_exceeding(self):
+        """Test that no call is dispatched when its expected cost would exceed the budget."""
+        metrics = UsageMetrics(PRICES, budget_usd=2.5)
+        self.call(metrics, '1')
+        self.call(metrics, '2')
+        with self.assertRaises(BudgetExceededError):
+            self.call(metrics, '3')
+        self.assertAlmostEqual(metrics.spent_usd, 2.0)
+
+    def test_reservations_stop_concurrent_calls(self):
+        """Test that calls in flight reserve their expected cost, so concurrent calls cannot overshoot."""
+        metrics = UsageMetrics(PRICES, budget_usd=2.5, first_output_tokens=0)
+        with metrics.reserve('model-a', 1_000_000):
+            with metrics.reserve('model-a', 1_000_000):
+                with self.assertRaises(BudgetExceededError):
+                    with metrics.reserve('model-a', 1_000_000):
+                        pass
+        with metrics.reserve('model-a', 2_000_000):
+            pass
+
+    def test_first_estimate_uses_prompt_tokens(self):
+        """Test that the first call is estimated from its prompt (and not at zero cost)."""
+        metrics = UsageMetrics(PRICES, budget_usd=0.5, first_output_tokens=0)
+        with self.assertRaises(BudgetExceededError):
+            with metrics.reserve('model-a', 1_000_000):
+                pass
+        with metrics.reserve('model-a', 100_000):
+            pass
+
+    def test_reservation_settled_with_actual_usage(self):
+        """Test that a reservation is replaced by the actual cost of the response."""
+        metrics = UsageMetrics(PRICES, budget_usd=10.0)
+        with metrics.track_call('tweet', '1'):
+            with metrics.reserve('model-a', 2_000_000):
+                metrics.add_attempt()
+                metrics.add_response('model-a', SimpleNamespace(input_tokens=1_000_000, output_tokens=250_000))
+        self.assertAlmostEqual(metrics.spent_usd, 2.0)
+        self.assertEqual(metrics._reserved_usd, 0.0)
+        # The next estimate uses the average output tokens of the responses (250k tokens = $1).
+        with self.assertRaises(BudgetExceededError):
+            with metrics.reserve('model-a', 7_000_001):
+                pass
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import time
+import unittest
+import sys
+sys.path.append('..')
+from src.work_queue import WorkQueue
+
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        """Create a queue with five items in a temporary folder."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp_dir.name, 'queue.sqlite')
+        self.queue = WorkQueue(self.filepath, queue_name='tweets')
+        self.queue.enqueue(['1', '2', '3', '4', '5'])
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmp_dir.cleanup()
+
+    def test_enqueue_ignores_existing_items(self):
+        """Test that enqueuing an item twice keeps a single copy."""
+        self.assertEqual(self.queue.enqueue(['5', '6']), 1)
+        self.assertEqual(self.queue.remaining(), 6)
+
+    def test_claims_are_disjoint(self):
+        """Test that two workers (with their own connections) never claim the same item."""
+        other = WorkQueue(self.filepath, queue_name='tweets')
+        first = self.queue.claim('worker-1', max_items=3, lease_seconds=60)
+        second = other.claim('worker-2', max_items=3, lease_seconds=60)
+        other.close()
+        self.assertEqual(first, ['1', '2', '3'])
+        self.assertEqual(second, ['4', '5'])
+
+    def test_complete(self):
+        """Test that completed items are not claimed again."""
+        item_ids = self.queue.claim('worker-1', max_items=5, lease_seconds=60)
+        self.queue.complete('worker-1', item_ids)
+        self.assertEqual(self.queue.claim('worker-2', max_items=5, lease_seconds=60), [])
+        self.assertEqual(self.queue.remaining(), 0)
+        self.assertEqual(self.queue.counts()[WorkQueue.DONE], 5)
+
+    def test_expired_lease_is_reclaimed(self):
+        """Test that the items of a dead worker are claimed again once the lease expires."""
+        self.queue.claim('dead-worker', max_items=2, lease_seconds=0.01)
+        time.sleep(0.05)
+        self.assertEqual(self.queue.claim('worker-2', max_items=2, lease_seconds=60), ['1', '2'])
+
+    def test_complete_by_other_owner_is_ignored(self):
+        """Test that a worker whose lease was taken over cannot complete the items."""
+        self.queue.claim('slow-worker', max_items=1, lease_seconds=0.01)
+        time.sleep(0.05)
+        self.queue.claim('worker-2', max_items=1, lease_seconds=60)
+        self.queue.complete('slow-worker', ['1'])
+        self.assertEqual(self.queue.remaining_ids(), ['1', '2', '3', '4', '5'])
+
+    def test_renew_keeps_lease(self):
+        """Test that a renewed lease is not claimed by other workers."""
+        self.queue.claim('worker-1', max_items=2, lease_seconds=0.01)
+        self.assertEqual(self.queue.renew('worker-1', ['1', '2'], lease_seconds=60), ['1', '2'])
+        time.sleep(0.05)
+        self.assertEqual(self.queue.claim('worker-2', max_items=2, lease_seconds=60), ['3', '4'])
+
+    def test_renew_after_takeover(self):
+        """Test that renewing items taken over by another worker leaves them out."""
+        self.queue.claim('slow-worker', max_items=2, lease_seconds=0.01)
+        time.sleep(0.05)
+        self.queue.claim('worker-2', max_items=1, lease_seconds=60)
+        self.assertEqual(self.queue.renew('slow-worker', ['1', '2'], lease_seconds=60), ['2'])
+
+    def test_release(self):
+        """Test that released items can be claimed right away."""
+        item_ids = self.queue.claim('worker-1', max_items=2, lease_seconds=60)
+        self.queue.release('worker-1', item_ids)
+        self.assertEqual(self.queue.claim('worker-2', max_items=2, lease_seconds=60), ['1', '2'])
+
+    def test_clear(self):
+        """Test that clearing a queue removes its items and leaves the other queues alone."""
+        other = WorkQueue(self.filepath, queue_name='users')
+        other.enqueue(['10'])
+        self.queue.claim('worker-1', max_items=2, lease_seconds=60)
+        self.queue.clear()
+        self.assertEqual(self.queue.remaining(), 0)
+        self.assertEqual(other.remaining_ids(), ['10'])
+        other.close()
+
+if __name__ == "__main__":
+    unittest.main()